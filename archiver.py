@@ -23,7 +23,9 @@ import logging.config
 import argparse
 from datetime import datetime, timedelta
 import isodate
+import multiprocessing
 import sys
+import time
 
 import serviceinfo.service_store
 import serviceinfo.common
@@ -53,6 +55,60 @@ def get_current_servicedate(date='TODAY'):
 
     return service_date
 
+def archive_services(service_date, args, worker=0, workers=1):
+    """
+    Archive all services on the given service date, or only the services
+    in the given partition when workers is larger than 1.
+    """
+
+    archive = serviceinfo.archive.Archive(service_date, serviceinfo.common.configuration['archive_database'],
+                                          serviceinfo.common.configuration['schedule_store'], args.bulk_size,
+                                          args.commit_size, worker, workers)
+
+    # Store services to archive:
+    archive.store_archive(args.restart)
+
+def archive_worker(service_date, args, worker, workers):
+    """
+    Worker process, archives one partition of the service numbers
+    """
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        archive_services(service_date, args, worker, workers)
+    except Exception:
+        logger.exception("Worker %d/%d failed", worker + 1, workers)
+        sys.exit(1)
+
+def archive_finished(args):
+    """
+    Archive all finished services which are not archived yet.
+    Without service date, services on both the previous and the current
+    service date are archived.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    if args.servicedate is not None:
+        service_dates = [get_current_servicedate(args.servicedate)]
+    else:
+        service_dates = [get_current_servicedate('YESTERDAY'), get_current_servicedate('TODAY')]
+
+    if None in service_dates:
+        logger.error("No valid service date, aborting.")
+        sys.exit(1)
+
+    for service_date in service_dates:
+        archive = serviceinfo.archive.Archive(service_date, serviceinfo.common.configuration['archive_database'],
+                                              serviceinfo.common.configuration['schedule_store'], args.bulk_size,
+                                              args.commit_size)
+
+        number_archived = archive.store_finished(args.grace_period)
+        archive.archive_connection.close()
+
+        logger.info("%d finished services on %s archived", number_archived, service_date)
+
 def main():
     """
     Main loop
@@ -67,7 +123,42 @@ def main():
         action='store', help='Configuration file')
 
     parser.add_argument('-d', '--servicedate', dest='servicedate',
-        default='YESTERDAY', action='store', help='Service date')
+        default=None, action='store',
+        help='Service date (default: YESTERDAY, or both YESTERDAY and TODAY in incremental mode)')
+
+    parser.add_argument('-b', '--bulk', dest='bulk_size', type=int,
+        default=0, action='store',
+        help='Write services in batches of this size with multi-row inserts (default: 0, disabled)')
+
+    parser.add_argument('--commit-size', dest='commit_size', type=int,
+        default=1000, action='store',
+        help='Number of services per transaction (default: 1000)')
+
+    parser.add_argument('--restart', dest='restart',
+        action='store_true', help='Ignore saved progress, delete and re-archive all services')
+
+    parser.add_argument('-w', '--workers', dest='workers', type=int,
+        default=1, action='store',
+        help='Number of worker processes, service numbers are partitioned over the workers (default: 1)')
+
+    parser.add_argument('-i', '--incremental', dest='incremental',
+        action='store_true', help='Only archive finished services which are not archived yet')
+
+    parser.add_argument('--grace', dest='grace_period', type=int,
+        default=30, action='store',
+        help='Incremental mode: minutes after the last arrival before a service is archived (default: 30)')
+
+    parser.add_argument('--interval', dest='interval', type=int,
+        default=0, action='store',
+        help='Incremental mode: keep running, archive finished services every interval seconds (default: 0, once)')
+
+    parser.add_argument('-e', '--export', dest='export_directory',
+        default=None, action='store',
+        help='Export archived stops on the service date to a columnar file in this directory')
+
+    parser.add_argument('--format', dest='export_format',
+        default=None, action='store', choices=['parquet', 'npz'],
+        help='Export format (default: parquet if pyarrow is installed, otherwise npz)')
 
     args = parser.parse_args()
 
@@ -79,19 +170,62 @@ def main():
     logger = logging.getLogger(__name__)
     logger.info('Archiver starting')
 
-    service_date = get_current_servicedate(args.servicedate)
+    if args.incremental:
+        if args.workers != 1:
+            logger.error("Incremental mode does not support multiple workers, aborting.")
+            sys.exit(1)
+
+        archive_finished(args)
+
+        while args.interval > 0:
+            time.sleep(args.interval)
+            archive_finished(args)
+
+        return
+
+    service_date = get_current_servicedate(args.servicedate or 'YESTERDAY')
 
     if service_date is None:
         logger.error("No valid service date, aborting.")
         sys.exit(1)
 
+    if args.workers < 1:
+        logger.error("Number of workers must be at least 1, aborting.")
+        sys.exit(1)
+
+    if args.export_directory is not None:
+        archive = serviceinfo.archive.Archive(service_date, serviceinfo.common.configuration['archive_database'],
+                                              serviceinfo.common.configuration['schedule_store'])
+        archive.export(args.export_directory, args.export_format)
+        return
+
     logger.info("Archiving all services on %s", service_date)
 
-    archive = serviceinfo.archive.Archive(service_date, serviceinfo.common.configuration['archive_database'],
-                                          serviceinfo.common.configuration['schedule_store'])
+    if args.workers == 1:
+        archive_services(service_date, args)
+        return
+
+    # Start a process for every partition. Each worker connects to
+    # the schedule store and archive database itself:
+    logger.info("Starting %d workers", args.workers)
+    workers = []
+    for worker in range(args.workers):
+        process = multiprocessing.Process(target=archive_worker,
+                                          args=(service_date, args, worker, args.workers))
+        process.start()
+        workers.append(process)
+
+    failed = 0
+    for process in workers:
+        process.join()
+        if process.exitcode != 0:
+            failed += 1
+
+    if failed > 0:
+        logger.error("%d of %d workers failed, run the archiver again to resume", failed, args.workers)
+        sys.exit(1)
 
-    # Store services to archive:
-    archive.store_archive()
+    logger.info("All workers finished")
 
 if __name__ == "__main__":
     main()
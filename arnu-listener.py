@@ -76,7 +76,7 @@ class WorkerThread(threading.Thread):
         self.store = serviceinfo.service_store.ServiceStore(serviceinfo.common.configuration['schedule_store'])
 
         self.logger.debug('Initializing IFF connection')
-        self.iff = serviceinfo.iff.IffSource(serviceinfo.common.configuration['iff_database'])
+        self.iff = serviceinfo.iff.get_iff_source(serviceinfo.common.configuration['iff_database'])
 
         threading.Thread.__init__(self, name='WorkerThread')
 
@@ -36,7 +36,7 @@ def load_dummy_messages(filename):
     logger = logging.getLogger(__name__)
     logger.debug('Initializing store')
 
-    iff = serviceinfo.iff.IffSource(serviceinfo.common.configuration['iff_database'])
+    iff = serviceinfo.iff.get_iff_source(serviceinfo.common.configuration['iff_database'])
     store = serviceinfo.service_store.ServiceStore(serviceinfo.common.configuration['schedule_store'])
 
     logger.info('Loading message dump')
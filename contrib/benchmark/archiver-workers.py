@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for parallel archiving
+
+Fills the schedule store with synthetic services on a benchmark service
+date and measures archiver.py throughput with 1 to 8 workers. The archived
+services are removed from the archive database after every run.
+
+Use a configuration with test databases only, for example:
+contrib/benchmark/archiver-workers.py config/serviceinfo-unittest.yaml
+"""
+
+import datetime
+import subprocess
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import serviceinfo.archive as archive
+import serviceinfo.common as common
+import serviceinfo.data as data
+import serviceinfo.service_store as service_store
+import serviceinfo.util as util
+
+SERVICE_DATE = datetime.date(2000, 1, 3)
+NUMBER_OF_SERVICES = 5000
+WORKERS = [1, 2, 4, 8]
+
+
+def create_service(servicenumber, number_of_stops=15):
+    """
+    Create a service with the given number of stops
+    """
+
+    service = data.Service()
+    service.servicenumber = servicenumber
+    service.service_id = servicenumber
+    service.service_date = SERVICE_DATE
+    service.transport_mode = 'SPR'
+    service.transport_mode_description = 'Sprinter'
+    service.company_code = 'ns'
+    service.company_name = 'NS'
+
+    departure = util.get_localized_datetime(datetime.datetime.combine(SERVICE_DATE, datetime.time(7, 3)))
+
+    for index in range(number_of_stops):
+        stop = data.ServiceStop('st%s' % index, 'Station number %s' % index)
+        stop.servicenumber = servicenumber
+
+        if index > 0:
+            stop.arrival_time = departure + datetime.timedelta(minutes=index * 4)
+            stop.scheduled_arrival_platform = '%s' % (index % 8)
+        if index < number_of_stops - 1:
+            stop.departure_time = departure + datetime.timedelta(minutes=index * 4 + 1)
+            stop.scheduled_departure_platform = '%s' % (index % 8)
+
+        service.stops.append(stop)
+
+    return service
+
+
+def clear_archive(config):
+    """
+    Remove all archived services on the benchmark service date
+    """
+
+    connection = archive.Archive(SERVICE_DATE, config['archive_database'],
+                                 config['schedule_store']).archive_connection
+    cursor = connection.cursor()
+    service_date = util.datetime_to_iso(SERVICE_DATE)
+
+    cursor.execute("""
+        DELETE stops FROM stops
+        JOIN services ON services.id = stops.service_id
+        WHERE services.service_date = %s""", [service_date])
+    cursor.execute("DELETE FROM services WHERE service_date = %s", [service_date])
+    cursor.execute("DELETE FROM archive_progress WHERE service_date = %s", [service_date])
+    connection.commit()
+    connection.close()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print 'Usage: %s <configuration file> [bulk size]' % sys.argv[0]
+        sys.exit(1)
+
+    config_file = sys.argv[1]
+    bulk_size = sys.argv[2] if len(sys.argv) > 2 else '0'
+    config = common.load_config(config_file)
+
+    store = service_store.ServiceStore(config['schedule_store'])
+    services = [create_service(10000 + index) for index in range(NUMBER_OF_SERVICES)]
+    store.store_services(services, store.TYPE_SCHEDULED)
+
+    print '%-8s %10s %12s %8s' % ('Workers', 'Seconds', 'Services/s', 'Speedup')
+
+    baseline = None
+    for workers in WORKERS:
+        clear_archive(config)
+
+        start = time.time()
+        subprocess.check_call([sys.executable, 'archiver.py', '-c', config_file,
+                               '-d', util.datetime_to_iso(SERVICE_DATE), '-b', bulk_size,
+                               '-w', str(workers)])
+        elapsed = time.time() - start
+
+        if baseline is None:
+            baseline = elapsed
+
+        print '%-8d %10.2f %12.1f %8.2f' % (workers, elapsed, NUMBER_OF_SERVICES / elapsed, baseline / elapsed)
+
+    clear_archive(config)
+    store.trash_store(util.datetime_to_iso(SERVICE_DATE), store.TYPE_SCHEDULED)
+
+
+if __name__ == '__main__':
+    main()
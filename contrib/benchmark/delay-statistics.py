@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for delay statistics
+
+Writes a month of synthetic archived stops as exports (numpy, and Parquet
+when pyarrow is installed) and measures loading the month and computing
+statistics per station, company and transport mode.
+"""
+
+import datetime
+import shutil
+import sys
+import os
+import tempfile
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import serviceinfo.delay_statistics as delay_statistics
+import serviceinfo.export as export
+
+START_DATE = datetime.date(2016, 3, 1)
+DAYS = 31
+SERVICES_PER_DAY = 15000
+STOPS_PER_SERVICE = 12
+STATIONS = 400
+
+
+def create_columns(service_date, random):
+    """
+    Create columns for one day of synthetic services
+    """
+
+    stops = SERVICES_PER_DAY * STOPS_PER_SERVICE
+    stop_nr = numpy.tile(numpy.arange(STOPS_PER_SERVICE), SERVICES_PER_DAY)
+    start = int(time.mktime(service_date.timetuple())) + 5 * 3600
+
+    departure = start + random.randint(0, 18 * 3600, SERVICES_PER_DAY).repeat(STOPS_PER_SERVICE) + stop_nr * 300
+    arrival = departure - 60
+    arrival[stop_nr == 0] = export.NO_TIME
+    departure[stop_nr == STOPS_PER_SERVICE - 1] = export.NO_TIME
+
+    companies = numpy.array([u'arriva', u'connexxion', u'ns', u'veolia'])
+    transport_modes = numpy.array([u'IC', u'SPR', u'ST'])
+    platforms = numpy.array([u''] + [unicode(number) for number in range(1, 20)])
+
+    return {
+        'service_id': numpy.arange(SERVICES_PER_DAY, dtype=numpy.uint32).repeat(STOPS_PER_SERVICE),
+        'stop_nr': stop_nr.astype(numpy.uint8),
+        'arrival': arrival.astype(numpy.int64),
+        'departure': departure.astype(numpy.int64),
+        'arrival_delay': random.geometric(0.4, stops).astype(numpy.int16) - 1,
+        'departure_delay': random.geometric(0.4, stops).astype(numpy.int16) - 1,
+        'arrival_cancelled': random.random_sample(stops) < 0.01,
+        'departure_cancelled': random.random_sample(stops) < 0.01,
+        'cancelled': (random.random_sample(SERVICES_PER_DAY) < 0.005).repeat(STOPS_PER_SERVICE),
+        'service_number': numpy.arange(SERVICES_PER_DAY, dtype=numpy.int16).repeat(STOPS_PER_SERVICE),
+        'service_number_dictionary': numpy.array([unicode(number) for number in range(SERVICES_PER_DAY)]),
+        'company': random.randint(0, len(companies), SERVICES_PER_DAY).astype(numpy.int16).repeat(
+            STOPS_PER_SERVICE),
+        'company_dictionary': companies,
+        'transport_mode': random.randint(0, len(transport_modes), SERVICES_PER_DAY).astype(numpy.int16).repeat(
+            STOPS_PER_SERVICE),
+        'transport_mode_dictionary': transport_modes,
+        'stop': random.randint(0, STATIONS, stops).astype(numpy.int16),
+        'stop_dictionary': numpy.array(sorted(u'st%03d' % number for number in range(STATIONS))),
+        'arrival_platform': random.randint(0, len(platforms), stops).astype(numpy.int16),
+        'arrival_platform_dictionary': platforms,
+        'departure_platform': random.randint(0, len(platforms), stops).astype(numpy.int16),
+        'departure_platform_dictionary': platforms,
+    }
+
+
+def benchmark(directory, export_format):
+    random = numpy.random.RandomState(1)
+
+    for day in range(DAYS):
+        service_date = START_DATE + datetime.timedelta(days=day)
+        export.write_columns(create_columns(service_date, random),
+                             export.get_filename(directory, service_date, export_format), export_format)
+
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+    start = time.time()
+    columns = export.load_dates(directory, START_DATE, START_DATE + datetime.timedelta(days=DAYS - 1))
+    load_time = time.time() - start
+
+    print '%-8s %10d stops %8.1f MB   load %6.2f s' % (export_format, len(columns['service_id']),
+                                                       size / 1024.0 / 1024, load_time)
+
+    for name, group in sorted(delay_statistics.GROUPS.items()):
+        start = time.time()
+        statistics = delay_statistics.get_delay_statistics(columns, group)
+        print '%-8s %-16s %4d groups   %6.2f s' % ('', name, len(statistics), time.time() - start)
+
+
+def main():
+    formats = [export.FORMAT_NUMPY]
+    if export.pyarrow is not None:
+        formats.append(export.FORMAT_PARQUET)
+
+    for export_format in formats:
+        directory = tempfile.mkdtemp()
+
+        try:
+            benchmark(directory, export_format)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
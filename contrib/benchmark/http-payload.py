@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for the HTTP service details payload
+
+Compares payload size and encoding time of the service details JSON for a
+40-stop intercity service, with and without field selection, compact
+times and compression.
+"""
+
+import datetime
+import json
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import serviceinfo.data as data
+import serviceinfo.http as http
+import serviceinfo.util as util
+
+ITERATIONS = 1000
+
+
+def create_service(number_of_stops=40):
+    """
+    Create an intercity service with the given number of stops
+    """
+
+    service = data.Service()
+    service.servicenumber = 1750
+    service.service_id = 12345
+    service.service_date = datetime.date(2016, 4, 1)
+    service.transport_mode = 'IC'
+    service.transport_mode_description = 'Intercity'
+    service.company_code = 'ns'
+    service.company_name = 'NS'
+    service.source = 'scheduled'
+
+    departure = util.get_localized_datetime(datetime.datetime(2016, 4, 1, 7, 3))
+
+    for index in range(number_of_stops):
+        stop = data.ServiceStop('st%s' % index, 'Station number %s' % index)
+        stop.servicenumber = service.servicenumber
+
+        if index > 0:
+            stop.arrival_time = departure + datetime.timedelta(minutes=index * 6)
+            stop.scheduled_arrival_platform = '%sa' % (index % 12)
+            stop.arrival_delay = index % 4
+        if index < number_of_stops - 1:
+            stop.departure_time = departure + datetime.timedelta(minutes=index * 6 + 1)
+            stop.scheduled_departure_platform = '%sa' % (index % 12)
+            stop.departure_delay = index % 4
+
+        service.stops.append(stop)
+
+    return service
+
+
+def benchmark(name, services, fields=None, compact=False):
+    encode = lambda: json.dumps(http.services_to_dict(services, fields, compact))
+    body = encode()
+
+    encode_time = timeit.timeit(encode, number=ITERATIONS) / ITERATIONS * 1000
+    gzip_time = timeit.timeit(lambda: http.compress(body, 'gzip'), number=ITERATIONS) / ITERATIONS * 1000
+
+    print '%-32s %8d %8d %8d %10.3f %10.3f' % (name, len(body), len(http.compress(body, 'gzip')),
+                                                len(http.compress(body, 'deflate')), encode_time, gzip_time)
+
+
+def main():
+    services = [create_service()]
+    mobile_fields = set(['station', 'departure_time', 'departure_delay', 'scheduled_departure_platform',
+                         'actual_departure_platform', 'cancelled_departure'])
+
+    print '%-32s %8s %8s %8s %10s %10s' % ('Variant', 'Bytes', 'Gzip', 'Deflate', 'Encode ms', 'Gzip ms')
+    benchmark('full', services)
+    benchmark('compact', services, compact=True)
+    benchmark('fields', services, fields=mobile_fields)
+    benchmark('compact + fields', services, fields=mobile_fields, compact=True)
+
+
+if __name__ == '__main__':
+    main()
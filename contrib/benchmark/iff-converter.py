@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for the IFF converter
+
+Writes a synthetic timetbls.dat and footnote.dat, converts them with
+iff-converter.py and reports the runtime and peak memory usage (RSS) of
+the conversion, with one job and with parallel jobs. The conversion runs in
+a child process, so its peak RSS does not include the generation of the
+dataset.
+"""
+
+import datetime
+import imp
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, ROOT_PATH)
+
+converter = imp.load_source('iff_converter', os.path.join(ROOT_PATH, 'iff-converter.py'))
+
+SERVICES = [10000, 50000, 200000]
+JOBS = [1, 4]
+STOPS_PER_SERVICE = 15
+FOOTNOTES = 5000
+DAYS = 365
+
+
+def write_dataset(path, services):
+    """
+    Write a synthetic timetable with the given number of services
+    """
+
+    with open(os.path.join(path, 'timetbls.dat'), 'wb') as timetables:
+        timetables.write('@100,01012016,31122016,0001,Synthetic dataset\r\n')
+
+        for service_id in range(1, services + 1):
+            timetables.write('#%08d\r\n' % service_id)
+            timetables.write('%%100,%05d,      ,001,%03d,                              \r\n' %
+                             (service_id % 100000, STOPS_PER_SERVICE))
+            timetables.write('-%05d,000,999\r\n' % (service_id % FOOTNOTES))
+            timetables.write('&IC   ,001,%03d\r\n' % STOPS_PER_SERVICE)
+            timetables.write('*NIIN,001,%03d,000\r\n' % STOPS_PER_SERVICE)
+
+            for stop in range(STOPS_PER_SERVICE):
+                minutes = 360 + stop * 5
+                stop_time = '%02d%02d' % (minutes / 60, minutes % 60)
+
+                if stop == 0:
+                    timetables.write('>st%03d  ,%s\r\n' % (stop, stop_time))
+                elif stop == STOPS_PER_SERVICE - 1:
+                    timetables.write('<st%03d  ,%s\r\n' % (stop, stop_time))
+                elif stop % 3 == 0:
+                    timetables.write(';st%03d  \r\n' % stop)
+                else:
+                    timetables.write('+st%03d  ,%s,%s\r\n' % (stop, stop_time, stop_time))
+
+                timetables.write('?%-5s,%-5s,%05d\r\n' % (stop % 10 + 1, stop % 10 + 1, 0))
+
+    with open(os.path.join(path, 'footnote.dat'), 'wb') as footnotes:
+        footnotes.write('@100,01012016,31122016,0001,Synthetic dataset\r\n')
+
+        for footnote in range(FOOTNOTES):
+            footnotes.write('#%05d\r\n' % footnote)
+            footnotes.write(''.join('1' if (day + footnote) % 7 < 5 else '0' for day in range(DAYS)) + '\r\n')
+
+
+def convert(path, jobs):
+    converter.DATASET_PATH = path + '/'
+    converter.OUTPUT_PATH = path + '/'
+
+    delivery = {'firstday': datetime.date(2016, 1, 1)}
+
+    converter.convert_files(delivery, ['footnote', 'timetbls'], jobs)
+
+
+def main():
+    print '%10s %10s %6s %10s %12s' % ('Services', 'Input MB', 'Jobs', 'Seconds', 'Peak RSS MB')
+
+    for services in SERVICES:
+        path = tempfile.mkdtemp()
+
+        try:
+            write_dataset(path, services)
+            size = os.path.getsize(os.path.join(path, 'timetbls.dat')) + os.path.getsize(
+                os.path.join(path, 'footnote.dat'))
+
+            for jobs in JOBS:
+                start = time.time()
+                process = multiprocessing.Process(target=convert, args=(path, jobs))
+                process.start()
+                process.join()
+                elapsed = time.time() - start
+
+                # Peak RSS of the largest child process so far (in kB on Linux):
+                peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+                print '%10d %10.1f %6d %10.2f %12.1f' % (services, size / 1024.0 / 1024, jobs, elapsed,
+                                                         peak_rss / 1024.0)
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for the service filter
+
+Filters a full day of synthetic services with the scheduler filter from
+serviceinfo.yaml.dist and with a larger filter, comparing
+is_service_included() (filter configuration interpreted for every service)
+with a compiled ServiceFilter.
+"""
+
+import random
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import serviceinfo.data as data
+import serviceinfo.service_filter as service_filter
+
+SERVICES = 25000
+STOPS_PER_SERVICE = 12
+STATIONS = 400
+
+COMPANIES = ['ns', 'arriva', 'connexxion', 'db', 'nmbs', 'thalys', 'est', 'veolia', 'syntus']
+TRANSPORT_MODES = ['IC', 'SPR', 'ICE', 'THA', 'ST', 'INT']
+
+# Scheduler filter from config/serviceinfo.yaml.dist:
+DEFAULT_FILTER = {
+    'exclude': {'company': ['db', 'nmbs', 'thalys', 'est']},
+    'include': {'service': [[2500, 2599], [300, 499], [20180, 20199], [20200, 20299], [11900, 11999],
+                            [11000, 11099]]},
+}
+
+# Filter with more companies, service number ranges, transport modes and stops:
+LARGE_FILTER = {
+    'exclude': {'company': ['db', 'nmbs', 'thalys', 'est', 'veolia', 'syntus'],
+                'transport_mode': ['ICE', 'THA'],
+                'stop': ['st%03d' % number for number in range(0, STATIONS, 10)]},
+    'include': {'service': [[number, number + 49] for number in range(0, 30000, 200)],
+                'transport_mode': ['IC']},
+}
+
+
+def create_services():
+    """
+    Create a day of synthetic services
+    """
+
+    generator = random.Random(1)
+    services = []
+
+    for number in range(SERVICES):
+        service = data.Service()
+        service.servicenumber = generator.randint(1, 30000)
+        service.company_code = generator.choice(COMPANIES)
+        service.transport_mode = generator.choice(TRANSPORT_MODES)
+
+        for _ in range(STOPS_PER_SERVICE):
+            service.stops.append(data.ServiceStop('st%03d' % generator.randint(0, STATIONS - 1)))
+
+        services.append(service)
+
+    return services
+
+
+def benchmark(name, services, filter_config):
+    start = time.time()
+    included = [service for service in services if service_filter.is_service_included(service, filter_config)]
+    interpreted_time = time.time() - start
+
+    start = time.time()
+    is_included = service_filter.ServiceFilter(filter_config)
+    compiled = [service for service in services if is_included(service)]
+    compiled_time = time.time() - start
+
+    assert included == compiled
+
+    print '%-8s %6d of %6d included   interpreted %6.3f s   compiled %6.3f s' % (
+        name, len(compiled), len(services), interpreted_time, compiled_time)
+
+
+def main():
+    services = create_services()
+
+    benchmark('default', services, DEFAULT_FILTER)
+    benchmark('large', services, LARGE_FILTER)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,8 +29,15 @@ if [[ $? -ne 0 ]]; then
 
 	unzip $BASEDIR/cache/ns-latest.zip -d $BASEDIR/cache/dataset/
 	rm $BASEDIR/cache/iff_parsed/*.tsv
-	$BASEDIR/iff-converter.py --input $BASEDIR/cache/dataset --config $BASEDIR/config/serviceinfo.yaml --output $BASEDIR/cache/iff_parsed
-	$BASEDIR/iff-loader.py --parsed_dir $BASEDIR/cache/iff_parsed --config $BASEDIR/config/serviceinfo.yaml --truncate_tables
+	$BASEDIR/iff-converter.py --input $BASEDIR/cache/dataset --config $BASEDIR/config/serviceinfo.yaml --output $BASEDIR/cache/iff_parsed --snapshot $BASEDIR/cache/iff-snapshot.sqlite
+	$BASEDIR/iff-loader.py --parsed_dir $BASEDIR/cache/iff_parsed --config $BASEDIR/config/serviceinfo.yaml --delta --changed_dates $BASEDIR/cache/changed-dates.txt
+
+	# Reschedule the current service date (starts at 4:00) when its schedule has changed:
+	SERVICEDATE=`date -d '4 hours ago' +%Y-%m-%d`
+	if grep -q "^$SERVICEDATE\$" $BASEDIR/cache/changed-dates.txt; then
+		echo "Schedule changed for $SERVICEDATE, rescheduling"
+		$BASEDIR/scheduler.py --config $BASEDIR/config/serviceinfo.yaml --servicedate $SERVICEDATE
+	fi;
 else 
 	echo "Retrieved data is equal to existing data"
 fi;
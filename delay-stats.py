@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+RDT ServiceInfo delay statistics
+Copyright (C) 2016 Geert Wirken
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import isodate
+import sys
+
+import serviceinfo.delay_statistics
+import serviceinfo.export
+
+# Setup argparse
+parser = argparse.ArgumentParser(description='RDT Serviceinfo / Delay statistics')
+
+parser.add_argument('-e', '--export', dest='export_directory', required=True,
+    action='store', help='Directory with exported service dates (see archiver.py --export)')
+parser.add_argument('-d', '--servicedate', dest='servicedate', required=True,
+    action='store', help='Service date, or first service date of a range')
+parser.add_argument('-u', '--until', dest='until', default=None,
+    action='store', help='Last service date of a range (default: only the given service date)')
+parser.add_argument('-g', '--group', dest='group', default='company',
+    choices=sorted(serviceinfo.delay_statistics.GROUPS.keys()),
+    action='store', help='Group statistics by station, company or transport mode (default: company)')
+parser.add_argument('-t', '--threshold', dest='threshold', type=int, default=5,
+    action='store', help='Arrivals with a delay below this number of minutes are punctual (default: 5)')
+parser.add_argument('-n', '--limit', dest='limit', type=int, default=0,
+    action='store', help='Only show the groups with the most arrivals (default: all)')
+args = parser.parse_args()
+
+try:
+    start_date = isodate.parse_date(args.servicedate)
+    end_date = isodate.parse_date(args.until) if args.until is not None else start_date
+except (isodate.ISO8601Error, ValueError) as exception:
+    print "Could not parse service date: %s" % exception
+    sys.exit(1)
+
+columns = serviceinfo.export.load_dates(args.export_directory, start_date, end_date)
+
+if columns is None:
+    print "No exported service dates found"
+    sys.exit(1)
+
+statistics = serviceinfo.delay_statistics.get_delay_statistics(
+    columns, serviceinfo.delay_statistics.GROUPS[args.group], args.threshold)
+
+if args.limit > 0:
+    statistics = statistics[:args.limit]
+
+
+def format_value(value, value_format, scale=1):
+    return '-' if value is None else value_format % (value * scale)
+
+print '%-16s %9s %11s %10s %11s %7s %7s %7s' % (args.group, 'Arrivals', 'Punctuality', 'Cancelled',
+                                                'Mean delay', 'p50', 'p90', 'p95')
+
+for group in statistics:
+    print '%-16s %9d %11s %10s %11s %7s %7s %7s' % (
+        group['key'].encode('utf-8'), group['arrivals'],
+        format_value(group['punctuality'], '%.1f%%', 100), format_value(group['cancellation_rate'], '%.1f%%', 100),
+        format_value(group['mean_delay'], '%.1f'), format_value(group['p50'], '%d'),
+        format_value(group['p90'], '%d'), format_value(group['p95'], '%d'))
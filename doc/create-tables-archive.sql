@@ -1,7 +1,25 @@
+CREATE TABLE `archive_progress` (
+  `service_date` date NOT NULL,
+  `worker` tinyint(3) unsigned NOT NULL DEFAULT '0',
+  `workers` tinyint(3) unsigned NOT NULL DEFAULT '1',
+  `last_service_number` varchar(12) DEFAULT NULL,
+  `completed` tinyint(1) NOT NULL,
+  PRIMARY KEY (`service_date`,`worker`,`workers`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
+CREATE TABLE `sequences` (
+  `name` varchar(20) NOT NULL,
+  `value` int(11) unsigned NOT NULL,
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
 CREATE TABLE `services` (
   `id` int(11) unsigned NOT NULL AUTO_INCREMENT,
   `service_date` date NOT NULL,
   `service_number` varchar(12) NOT NULL,
+  `service_id` varchar(32) DEFAULT NULL,
   `company` varchar(10) NOT NULL,
   `transport_mode` varchar(4) NOT NULL,
   `cancelled` tinyint(1) NOT NULL,
@@ -11,8 +29,8 @@ CREATE TABLE `services` (
   `to` varchar(6) NOT NULL,
   `source` enum('actual','scheduled') NOT NULL,
   PRIMARY KEY (`id`),
-  KEY `service_number` (`service_number`),
-  KEY `service_date_service_number` (`service_date`,`service_number`)
+  UNIQUE KEY `service_date_service_number_service_id` (`service_date`,`service_number`,`service_id`),
+  KEY `service_number` (`service_number`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
@@ -48,4 +66,4 @@ CREATE TABLE `transport_modes` (
   `mode` varchar(4) NOT NULL,
   `mode_description` varchar(30) NOT NULL,
   PRIMARY KEY (`mode`)
-) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
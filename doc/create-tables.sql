@@ -11,7 +11,8 @@ CREATE TABLE `company` (
   `code` varchar(9) CHARACTER SET utf8 NOT NULL,
   `name` varchar(29) CHARACTER SET utf8 NOT NULL,
   `timeturn` time DEFAULT NULL,
-  PRIMARY KEY (`company`)
+  PRIMARY KEY (`company`),
+  KEY `code` (`code`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 
@@ -58,6 +59,14 @@ CREATE TABLE `footnote` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 
+CREATE TABLE `footnote_bitmap` (
+  `footnote` int(11) NOT NULL DEFAULT '0',
+  `firstday` date NOT NULL,
+  `days` varbinary(128) NOT NULL,
+  PRIMARY KEY (`footnote`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+
 CREATE TABLE `station` (
   `shortname` varchar(6) NOT NULL,
   `trainchanges` smallint(6) DEFAULT NULL,
@@ -80,6 +89,13 @@ CREATE TABLE `timetable_attribute` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 
+CREATE TABLE `timetable_hash` (
+  `serviceid` int(11) NOT NULL,
+  `hash` char(40) CHARACTER SET ascii NOT NULL,
+  PRIMARY KEY (`serviceid`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+
 CREATE TABLE `timetable_platform` (
   `serviceid` int(11) NOT NULL DEFAULT '0',
   `idx` int(11) NOT NULL DEFAULT '0',
@@ -99,8 +115,8 @@ CREATE TABLE `timetable_service` (
   `firststop` int(11) DEFAULT NULL,
   `laststop` int(11) DEFAULT NULL,
   `servicename` varchar(29) CHARACTER SET utf8 DEFAULT NULL,
-  KEY `serviceid` (`serviceid`),
-  KEY `serviceid_firststop_laststop` (`serviceid`,`firststop`,`laststop`)
+  KEY `serviceid_firststop_laststop` (`serviceid`,`firststop`,`laststop`,`servicenumber`,`variant`,`companynumber`),
+  KEY `servicenumber_serviceid` (`servicenumber`,`serviceid`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 
@@ -119,7 +135,7 @@ CREATE TABLE `timetable_transport` (
   `transmode` varchar(4) CHARACTER SET utf8 DEFAULT NULL,
   `firststop` int(11) DEFAULT NULL,
   `laststop` int(11) DEFAULT NULL,
-  KEY `serviceid` (`serviceid`),
+  KEY `serviceid_firststop_laststop` (`serviceid`,`firststop`,`laststop`,`transmode`),
   KEY `transmode` (`transmode`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
@@ -130,8 +146,7 @@ CREATE TABLE `timetable_validity` (
   `firststop` int(11) DEFAULT NULL,
   `laststop` int(11) DEFAULT NULL,
   UNIQUE KEY `serviceid_2` (`serviceid`,`footnote`),
-  KEY `serviceid` (`serviceid`),
-  KEY `footnote` (`footnote`)
+  KEY `footnote_serviceid` (`footnote`,`serviceid`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 
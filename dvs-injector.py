@@ -22,85 +22,179 @@ import logging
 import logging.config
 import argparse
 import datetime
+import json
+import time
 import zmq
-import pytz
 
 import serviceinfo.common
 import serviceinfo.util
 import serviceinfo.service_store
-import serviceinfo.service_filter as service_filter
+import serviceinfo.statistics
 import serviceinfo.injection as injection
 
 
-def get_services(config):
-    filtered_services = []
-    logging.debug("Retrieving services from schedule store")
+def get_departures(config):
+    logging.debug("Retrieving departures from schedule store")
 
     store = serviceinfo.service_store.ServiceStore(config['schedule_store'])
-    from_time = datetime.datetime.now(pytz.utc)
-    to_time = from_time + datetime.timedelta(minutes=config['injector']['window'])
-    services = store.get_services_between(from_time, to_time)
+    selection = injection.Selection(config['injector']['selection'], config['injector']['window'])
+    departures = selection.get_departures(store)
 
-    logging.debug("Found %s services in time window", len(services))
+    logging.debug("Found %s departures eligible for injecting", len(departures))
+    return departures
 
-    for service in services:
-        match = False
 
-        for filter_config in config['injector']['selection']:
-            if service_filter.match_filter(service, filter_config):
-                match = True
+class Injector(object):
+    """
+    Sends injections to the DVS injection receiver over a persistent DEALER
+    socket. Many injections are in flight at the same time, every request
+    carries a correlation ID frame which is returned with the reply (both
+    REP and ROUTER receivers return all frames before the empty delimiter).
+
+    Messages are only queued on a connected socket, and sends time out, so
+    an unreachable server never blocks the injector. When the server does not
+    reply, the socket is closed and opened again (lazy pirate pattern).
+    """
 
-        if match is True:
-            filtered_services.append(service)
+    context = None
+    client = None
+    poller = None
+    server = None
+    max_in_flight = None
+    timeout = None
+    next_id = 0
+
+    def __init__(self, config):
+        logging.debug("Opening connection to injection receiver")
+
+        self.max_in_flight = config['injector'].get('max_in_flight', 50)
+        self.timeout = config['injector'].get('timeout', 5) * 1000
 
-    logging.debug("Found %s services eligible for injecting", len(filtered_services))
-    return filtered_services
+        self.server = config['injector']['injector_server']
+
+        self.context = zmq.Context()
+        self.poller = zmq.Poller()
+        self._connect()
+
+    def _connect(self):
+        self.client = self.context.socket(zmq.DEALER)
+        self.client.setsockopt(zmq.LINGER, 0)
+        self.client.setsockopt(zmq.IMMEDIATE, 1)
+        self.client.setsockopt(zmq.SNDTIMEO, self.timeout)
+        self.client.setsockopt(zmq.RCVTIMEO, self.timeout)
+        self.client.connect(self.server)
 
+        self.poller.register(self.client, zmq.POLLIN)
 
-def get_departures(services, config):
-    departures = []
+    def _reconnect(self):
+        """
+        Close the socket and open a new one, dropping queued requests and late replies
+        """
 
-    for service in services:
-        for stop in service.stops:
-            if service_filter.departure_time_window(stop, config['injector']['window']):
-                departures.append((service, stop))
+        logging.debug("Reopening connection to injection receiver")
 
-    logging.debug("Found %s departures eligible for injecting", len(departures))
-    return departures
+        self.poller.unregister(self.client)
+        self.client.close()
+        self._connect()
+
+    def inject(self, injections, cache):
+        """
+        Send injections and wait for the replies. A slow or missing reply
+        does not stop the other injections; injections without a successful
+        reply are not added to the cache and are sent again in the next run.
+        Only when the server does not reply at all, the remaining injections
+        are aborted.
+
+        Args:
+            injections (list): List of injection dicts
+            cache (serviceinfo.injection.InjectionCache): Cache of sent injections
+
+        Returns:
+            int: Number of successful injections
+        """
+
+        queue = list(reversed(injections))
+        pending = {}
+        sent = []
+        reply_count = 0
+
+        while len(queue) > 0 or len(pending) > 0:
+            while len(queue) > 0 and len(pending) < self.max_in_flight:
+                inject = queue.pop()
+                correlation_id = str(self.next_id)
+                self.next_id += 1
+
+                logging.debug("Injecting service %s at stop %s", inject['service_id'], inject['stop_code'])
+
+                try:
+                    self.client.send_multipart([correlation_id, '', json.dumps(inject)])
+                except zmq.Again:
+                    logging.error("DVS server not reachable, %s injections aborted", len(queue) + 1)
+                    queue = []
+                    break
 
+                pending[correlation_id] = inject
 
-def inject_stops(stops, config):
-    logging.debug("Opening connection to injection receiver")
+            if len(pending) == 0:
+                break
 
-    context = zmq.Context()
-    client = context.socket(zmq.REQ)
-    client.connect(config['injector']['injector_server'])
-    client.setsockopt(zmq.LINGER, 0)
+            if not self.poller.poll(self.timeout):
+                logging.error("DVS server timeout, %s injections not confirmed", len(pending))
+                pending = {}
+                self._reconnect()
 
-    poller = zmq.Poller()
-    poller.register(client, zmq.POLLIN)
+                # Stop when the server did not reply at all:
+                if reply_count == 0:
+                    logging.error("DVS server not responding, %s injections aborted", len(queue))
+                    break
 
-    inject_count = 0
+                continue
 
-    for (service, stop) in stops:
-        logging.debug("Injecting service %s at stop %s", service, stop)
-        inject = injection.Injection(service, stop)
-        client.send_json(inject.as_dict())
+            # Process all available replies:
+            while self.poller.poll(0):
+                frames = self.client.recv_multipart()
+                reply_count += 1
+                inject = pending.pop(frames[0], None)
 
-        if poller.poll(5000):
-            result = client.recv_json()
-        else:
-            logging.error("DVS server timeout, injections aborted")
-            break
+                if inject is None:
+                    logging.debug("Ignoring late reply %s", frames[0])
+                    continue
 
-        if 'result' not in result or result['result'] is not True:
-            logging.error("Server did not respond successfully while injecting service %s, stop %s", service, stop)
-        else:
-            inject_count += 1
+                result = json.loads(frames[-1])
 
-    client.close()
+                if 'result' not in result or result['result'] is not True:
+                    logging.error("Server did not respond successfully while injecting service %s, stop %s",
+                                  inject['service_id'], inject['stop_code'])
+                else:
+                    sent.append(inject)
 
-    logging.info("Processed %s injections", inject_count)
+        cache.set_sent(sent)
+
+        logging.info("Processed %s injections", len(sent))
+        return len(sent)
+
+    def close(self):
+        self.client.close()
+        self.context.term()
+
+
+def run_injector(injector, cache, stats, config):
+    """
+    Inject all new and changed departures in the time window
+    """
+
+    injections = [injection.Injection(service, stop).as_dict() for service, stop in get_departures(config)]
+    changed = cache.get_changed(injections)
+    skipped = len(injections) - len(changed)
+
+    logging.debug("%s of %s departures new or changed", len(changed), len(injections))
+
+    sent = injector.inject(changed, cache)
+
+    stats.increment_skipped_injections(skipped)
+    stats.increment_sent_injections(sent)
+
+    logging.info("Sent %s injections, skipped %s unchanged departures", sent, skipped)
 
 
 def get_servicedate():
@@ -120,17 +214,43 @@ def main():
         default='config/serviceinfo.yaml',
         action='store', help='Configuration file')
 
+    parser.add_argument('-i', '--interval', dest='interval', type=int,
+        default=0, action='store',
+        help='Keep running, inject new and changed departures every interval seconds (default: 0, once)')
+
     args = parser.parse_args()
 
     # Load configuration:
     serviceinfo.common.load_config(args.configFile)
     serviceinfo.common.setup_logging('dvs-injector')
 
-    services = get_services(serviceinfo.common.configuration)
-    stops = get_departures(services, serviceinfo.common.configuration)
-
-    # Inject stops to DVS:
-    inject_stops(stops, serviceinfo.common.configuration)
+    config = serviceinfo.common.configuration
+    injector = Injector(config)
+    cache = injection.InjectionCache(config['schedule_store'])
+    stats = serviceinfo.statistics.Statistics(config['schedule_store'])
+
+    try:
+        next_run = time.time()
+
+        while True:
+            try:
+                run_injector(injector, cache, stats, config)
+            except Exception:
+                if args.interval <= 0:
+                    raise
+
+                logging.error("Error while injecting departures", exc_info=True)
+
+            if args.interval <= 0:
+                break
+
+            # Keep a fixed schedule, regardless of the duration of a run:
+            next_run = max(next_run + args.interval, time.time())
+            time.sleep(max(0, next_run - time.time()))
+    except KeyboardInterrupt:
+        logging.info("Shutting down...")
+    finally:
+        injector.close()
 
 
 if __name__ == "__main__":
@@ -21,17 +21,28 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import argparse
+import binascii
 import codecs
+import hashlib
 from datetime import date, timedelta
 import logging
 import logging.config
+import multiprocessing
+import os
+import shutil
 
 import serviceinfo.common
+import serviceinfo.footnote
+import serviceinfo.iff_snapshot
 
 CHARSET = 'cp1252' # yes, this isn't what the documentation suggests
 DATASET_PATH = None
 OUTPUT_PATH = None
 
+# Output files for timetables:
+TIMETABLE_RECORDS = ['service', 'validity', 'transport', 'attribute', 'stop', 'platform']
+TIMETABLE_TABLES = TIMETABLE_RECORDS + ['hash']
+
 
 def parse_date(day):
     return date(int(day[4:8]), int(day[2:4]), int(day[0:2]))
@@ -39,10 +50,33 @@ def parse_date(day):
 def parse_time(time):
     return time[0:2] + ':' + time[2:4] + ':00'
 
-def open_iff(filename, delivery):
-    l_content = codecs.open(DATASET_PATH + filename + '.dat', 'r', CHARSET).read().split('\r\n')
+def open_iff(filename, delivery, start=None, end=None):
+    """
+    Iterate over the lines of an IFF file, without the header line.
+    The file is read line by line, so memory usage does not depend on the file size.
+    When start and end are given, only the lines between these byte offsets are read.
+    """
+    with open(DATASET_PATH + filename + '.dat', 'rb') as f:
+        if start:
+            f.seek(start)
+        else:
+            # Skip header:
+            start = len(f.readline())
+
+        position = start
+
+        for line in iter(f.readline, ''):
+            if end is not None and position >= end:
+                break
+            position += len(line)
 
-    return l_content[1:-1]
+            # Skip the last line when it is not terminated (e.g. an end of file marker):
+            if not line.endswith('\n'):
+                break
+
+            line = line.rstrip('\r\n')
+            if line:
+                yield line.decode(CHARSET)
 
 def simple_list_writer(filename, arguments, data):
     f = codecs.open(OUTPUT_PATH+filename+'.tsv', 'w', 'UTF-8')
@@ -66,10 +100,44 @@ def simple_dict_list_writer(filename, arguments, data):
             f.write('\t'.join([unicode(x)] + [unicode(u[z] or '') for z in arguments[1:]]) + '\n')
     f.close()
 
-def parse_timetables(delivery):
-    l_timetables = open_iff('timetbls', delivery)
+def get_record_chunks(filename, count):
+    """
+    Split an IFF file in at most count chunks of about the same size. Chunks start
+    at a record boundary (a line starting with #).
+    Returns a list of (start, end) byte offsets, end is None for the last chunk.
+    """
+    path = DATASET_PATH + filename + '.dat'
+    size = os.path.getsize(path)
+    offsets = [0]
+
+    with open(path, 'rb') as f:
+        for chunk in range(1, count):
+            position = max(size * chunk / count, offsets[-1])
+            f.seek(position)
+
+            # Skip partial line:
+            if position > 0:
+                position += len(f.readline())
+
+            for line in iter(f.readline, ''):
+                if line.startswith('#'):
+                    break
+                position += len(line)
+            else:
+                break
+
+            if position > offsets[-1]:
+                offsets.append(position)
+
+    return zip(offsets, offsets[1:] + [None])
+
+def parse_timetables(delivery, start=None, end=None):
+    """
+    Parse the timetables. Yields (serviceid, record) as soon as a record is complete,
+    so only a single record is kept in memory.
+    """
+    l_timetables = open_iff('timetbls', delivery, start, end)
 
-    timetables = {}
     current_id = None
     current_record = {}
     s_stationshort = None
@@ -78,7 +146,7 @@ def parse_timetables(delivery):
     for x in l_timetables:
         if x[0] == '#':
             if current_id is not None:
-                timetables[current_id] = current_record
+                yield current_id, current_record
             s_index = 0
             current_id = int(x[1:])
             current_record = {'service': [], 'validity': [], 'transport': [], 'attribute': [], 'stop': [], 'platform': []}
@@ -125,19 +193,18 @@ def parse_timetables(delivery):
             current_record['stop'].append({'station': s_stationshort, 'index': s_index, 'arrivaltime': parse_time(s_arrivaltime), 'departuretime': '\N'})
     
     if current_id is not None:
-        timetables[current_id] = current_record
-    
-    return timetables
-
-def sql_timetables(data):
+        yield current_id, current_record
+
+def sql_timetables(data, suffix='', header=True):
+    """
+    Write the timetable TSV files. For every service a content hash of all its
+    rows is written to timetable_hash.tsv, which is used to load only changed
+    services (iff-loader.py --delta).
+    """
     f = {}
     a = {}
-    f['service'] = codecs.open(OUTPUT_PATH+'timetable_service.tsv', 'w', 'UTF-8')
-    f['validity'] = codecs.open(OUTPUT_PATH+'timetable_validity.tsv', 'w', 'UTF-8')
-    f['transport'] = codecs.open(OUTPUT_PATH+'timetable_transport.tsv', 'w', 'UTF-8')
-    f['attribute'] = codecs.open(OUTPUT_PATH+'timetable_attribute.tsv', 'w', 'UTF-8')
-    f['stop'] = codecs.open(OUTPUT_PATH+'timetable_stop.tsv', 'w', 'UTF-8')
-    f['platform'] = codecs.open(OUTPUT_PATH+'timetable_platform.tsv', 'w', 'UTF-8')
+    for x in TIMETABLE_TABLES:
+        f[x] = codecs.open(OUTPUT_PATH+'timetable_'+x+'.tsv'+suffix, 'w', 'UTF-8')
 
     a['service'] = ['company', 'service', 'variant', 'first', 'last', 'name']
     a['validity'] = ['footnote', 'first', 'last']
@@ -145,18 +212,42 @@ def sql_timetables(data):
     a['attribute'] = ['code', 'first', 'last']
     a['stop'] = ['index', 'station', 'arrivaltime', 'departuretime']
     a['platform'] = ['index','station','arrival', 'departure', 'footnote']
+    a['hash'] = ['hash']
 
-    for x in f.keys():
-        f[x].write('\t'.join(['serviceid'] + a[x]) + '\n')
+    if header:
+        for x in f.keys():
+            f[x].write('\t'.join(['serviceid'] + a[x]) + '\n')
 
-    for x, y in data.items():
-        for z in f.keys():
+    for x, y in data:
+        h = hashlib.sha1()
+        for z in TIMETABLE_RECORDS:
             for u in y[z]:
-                f[z].write('\t'.join([unicode(x)] + [unicode(u[w] or '') for w in a[z]]) + '\n')
+                row = '\t'.join([unicode(u[w] or '') for w in a[z]])
+                f[z].write(unicode(x) + '\t' + row + '\n')
+                h.update((z + '\t' + row + '\n').encode('UTF-8'))
+        f['hash'].write('\t'.join([unicode(x), unicode(h.hexdigest())]) + '\n')
     
     for x in f.keys():
         f[x].close()
 
+def convert_timetables(delivery, chunk, start, end):
+    """
+    Convert a chunk of the timetables to partial TSV files
+    """
+    sql_timetables(parse_timetables(delivery, start, end), '.%d' % chunk, chunk == 0)
+
+def merge_timetables(chunks):
+    """
+    Concatenate the partial timetable TSV files in order
+    """
+    for x in TIMETABLE_TABLES:
+        filename = OUTPUT_PATH+'timetable_'+x+'.tsv'
+        with open(filename, 'wb') as f:
+            for chunk in range(chunks):
+                with open(filename+'.%d' % chunk, 'rb') as part:
+                    shutil.copyfileobj(part, f)
+                os.remove(filename+'.%d' % chunk)
+
 def parse_timezones(delivery):
     l_timezones = open_iff('timezone', delivery)
 
@@ -219,27 +310,35 @@ def sql_transattributequestions(data):
     f.close()
 
 def parse_footnotes(delivery):
+    """
+    Parse the footnotes. Yields (footnote, days) for each footnote.
+    """
     l_footnotes = open_iff('footnote', delivery)
 
-    footnotes = {}
     current_id = None
 
     for x in l_footnotes:
         if x[0] == '#':
             current_id = int(x[1:])
         else:
-            footnotes[current_id] = [y == '1' for y in x]
-
-    return footnotes
+            yield current_id, [y == '1' for y in x]
 
 def sql_footnotes(delivery, data):
+    """
+    Write the footnotes, both as one row per footnote and day (footnote.tsv)
+    and as one packed bitmap per footnote (footnote_bitmap.tsv, hex encoded).
+    """
     f = codecs.open(OUTPUT_PATH+'footnote.tsv', 'w', 'UTF-8')
     f.write('\t'.join(['footnote', 'servicedate']) + '\n')
-    for x, y in data.items():
+    b = codecs.open(OUTPUT_PATH+'footnote_bitmap.tsv', 'w', 'UTF-8')
+    b.write('\t'.join(['footnote', 'firstday', 'days']) + '\n')
+    for x, y in data:
         for z in range(0, len(y)):
             if y[z] == True:
                 f.write('\t'.join([unicode(x), unicode(delivery['firstday'] + timedelta(days=z))]) + '\n')
+        b.write('\t'.join([unicode(x), unicode(delivery['firstday']), unicode(binascii.hexlify(serviceinfo.footnote.pack_days(y)))]) + '\n')
     f.close()
+    b.close()
 
 def parse_changes(delivery):
     l_changes = open_iff('changes', delivery)
@@ -364,42 +463,76 @@ def sql_delivery(delivery):
     f.write('\t'.join([unicode(delivery[x] or '') for x in ['companynumber', 'firstday', 'lastday', 'versionnumber', 'description']]) + '\n')
     f.close()
 
-def parse_delivery():
+# Converters for all IFF files except timetables:
+CONVERTERS = {
+    'country': lambda delivery: sql_countries(parse_countries(delivery)),
+    'timezone': lambda delivery: sql_timezones(parse_timezones(delivery)),
+    'footnote': lambda delivery: sql_footnotes(delivery, parse_footnotes(delivery)),
+    'stations': lambda delivery: sql_stations(parse_stations(delivery)),
+    'company': lambda delivery: sql_companies(parse_companies(delivery)),
+    'delivery': sql_delivery,
+    'trnsaqst': lambda delivery: sql_transattributequestions(parse_transattributequestions(delivery)),
+    'trnsattr': lambda delivery: sql_transattributes(parse_transattributes(delivery)),
+    'trnsmode': lambda delivery: sql_transmodes(parse_transmodes(delivery)),
+    'contconn': lambda delivery: sql_continuousconnections(parse_continuousconnections(delivery)),
+    'connmode': lambda delivery: sql_connectionmodes(parse_connectionmodes(delivery)),
+    'changes': lambda delivery: sql_changes(parse_changes(delivery)),
+}
+
+def convert_file(name, delivery):
+    CONVERTERS[name](delivery)
+
+def convert_files(delivery, names, jobs=1):
+    """
+    Convert IFF files to TSV files. With more than one job, files are converted
+    in a process pool and the timetables are split in chunks which are converted
+    in parallel. The output is identical to the output of a single job.
+    """
+    if jobs <= 1:
+        for name in names:
+            if name == 'timetbls':
+                sql_timetables(parse_timetables(delivery))
+            else:
+                convert_file(name, delivery)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    results = []
+    chunks = []
+
+    # Start with the timetables, the largest file:
+    if 'timetbls' in names:
+        chunks = get_record_chunks('timetbls', jobs)
+        for chunk, (start, end) in enumerate(chunks):
+            results.append(pool.apply_async(convert_timetables, (delivery, chunk, start, end)))
+
+    for name in names:
+        if name != 'timetbls':
+            results.append(pool.apply_async(convert_file, (name, delivery)))
+
+    pool.close()
+
+    # Wait for all files, raises the exception of a failed conversion:
+    for result in results:
+        result.get()
+
+    pool.join()
+
+    if len(chunks) > 0:
+        merge_timetables(len(chunks))
+
+def parse_delivery(jobs=1):
     delivery = codecs.open(DATASET_PATH + 'delivery.dat', 'r', CHARSET).read().split('\r\n')[0]
     number, firstday, lastday, versionnumber, description = delivery[1:].split(',')
 
     delivery = {'companynumber': int(number), 'firstday': parse_date(firstday), 'lastday': parse_date(lastday), 'versionnumber': int(versionnumber), 'description': description.strip()}
 
-    countries = parse_countries(delivery)
     companies = parse_companies(delivery)
-    transmodes = parse_transmodes(delivery)
-    transattributes = parse_transattributes(delivery)
-    timezones = parse_timezones(delivery)
-    transattributequestions = parse_transattributequestions(delivery)
-    footnotes = parse_footnotes(delivery)
-    continuousconnections = parse_continuousconnections(delivery)
-    connectionmodes = parse_connectionmodes(delivery)
-    changes = parse_changes(delivery)
-    timetables = parse_timetables(delivery)
 
     logging.info("Received file from %s for period %s to %s (%s)", companies[delivery['companynumber']]['name'], delivery['firstday'], delivery['lastday'], delivery['description'])
 
-    stations = parse_stations(delivery)
-
     # Write TSV files:
-    sql_countries(countries)
-    sql_timezones(timezones)
-    sql_footnotes(delivery, footnotes)
-    sql_stations(stations)
-    sql_companies(companies)
-    sql_delivery(delivery)
-    sql_transattributequestions(transattributequestions)
-    sql_transattributes(transattributes)
-    sql_transmodes(transmodes)
-    sql_continuousconnections(continuousconnections)
-    sql_connectionmodes(connectionmodes)
-    sql_changes(changes)
-    sql_timetables(timetables)
+    convert_files(delivery, sorted(CONVERTERS.keys()) + ['timetbls'], jobs)
 
 
 def main():
@@ -414,6 +547,10 @@ def main():
         action='store', help='path to IFF dataset (default: ./cache/dataset)')
     parser.add_argument('--output', dest='output_path', default='./cache/iff_parsed',
         action='store', help='parsed IFF data (default: ./cache/iff_parsed)')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+        action='store', help='number of parallel conversion processes (default: 1)')
+    parser.add_argument('--snapshot', dest='snapshot', default=None,
+        action='store', help='also write a SQLite snapshot of the delivery to this file')
 
     args = parser.parse_args()
 
@@ -425,7 +562,11 @@ def main():
     serviceinfo.common.setup_logging('iff-converter')
 
     logging.info("Parsing IFF delivery")
-    parse_delivery()
+    parse_delivery(args.jobs)
+
+    if args.snapshot is not None:
+        logging.info("Writing snapshot to %s", args.snapshot)
+        serviceinfo.iff_snapshot.build_snapshot(OUTPUT_PATH, args.snapshot)
 
 if __name__ == "__main__":
     main()
@@ -9,8 +9,34 @@ import argparse
 import MySQLdb
 import serviceinfo.common
 import warnings
+import binascii
+import datetime
+import os
+import re
 
-def load_tsv_files():
+import serviceinfo.footnote
+import serviceinfo.iff
+
+# Suffixes for staging tables and replaced tables when swapping tables:
+STAGING_SUFFIX = '_new'
+OLD_SUFFIX = '_old'
+
+TABLES = ['changes', 'company', 'connmode', 'contconn', 'country',
+    'delivery', 'footnote', 'footnote_bitmap', 'station', 'timetable_attribute', 'timetable_hash', 'timetable_platform',
+    'timetable_service', 'timetable_stop', 'timezone', 'trnsaqst', 'trnsattr', 'trnsmode', 'timetable_transport',
+    'timetable_validity'
+    ]
+
+# Tables with rows for each service, these can be loaded incrementally:
+TIMETABLE_TABLES = [t for t in TABLES if t.startswith('timetable_')]
+
+# Number of service ID's in a single DELETE statement:
+DELETE_SIZE = 1000
+
+# Table definitions, used to create tables:
+CREATE_TABLES_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'doc', 'create-tables.sql')
+
+def connect():
     # Connect to MySQL
     connection = MySQLdb.connect(host=config['host'],
         user=config['user'], passwd=config['password'],
@@ -18,16 +44,22 @@ def load_tsv_files():
 
     connection.ping(True)
 
-    tables = ['changes', 'company', 'connmode', 'contconn', 'country',
-        'delivery', 'footnote', 'station', 'timetable_attribute', 'timetable_platform', 'timetable_service',
-        'timetable_stop', 'timezone', 'trnsaqst', 'trnsattr', 'trnsmode', 'timetable_transport', 'timetable_validity'
-        ]
+    return connection
+
+def load_tsv_files(tables=TABLES, swap=True):
+    """
+    Load the TSV files of the given tables. When swapping tables, the staging
+    tables replace the current tables afterwards, unless swap is False (the
+    caller swaps the tables with swap_tables() then).
+    """
+
+    connection = connect()
 
     # Create tables if asked
     if CREATE_TABLES:
         c = connection.cursor()
         logging.info("Creating tables using SQL")
-        f = open('doc/create-tables.sql','r')
+        f = open(CREATE_TABLES_SQL,'r')
         sql = f.read()
         c.execute(sql)
         c.close()
@@ -43,24 +75,282 @@ def load_tsv_files():
             c.execute(q)
         connection.commit()
 
+    # Load into staging tables when swapping, the current tables stay
+    # available to readers until all staging tables are loaded:
+    if SWAP_TABLES:
+        create_missing_tables(c)
+
+        logging.info("Creating staging tables...")
+        for t in tables:
+            c.execute('DROP TABLE IF EXISTS %s%s' % (t, STAGING_SUFFIX))
+            c.execute('CREATE TABLE %s%s LIKE %s' % (t, STAGING_SUFFIX, t))
+        target_suffix = STAGING_SUFFIX
+    else:
+        target_suffix = ''
+
+    # Columns which need conversion while loading (bitmaps are hex encoded in the TSV files):
+    columns = {
+        'footnote_bitmap': "(footnote, firstday, @days) SET days = UNHEX(@days)",
+        }
+
     # Disable warnings while importing
     warnings.filterwarnings('ignore', category = MySQLdb.Warning)
     for t in tables:
-        logging.info("""Loading %s.tsv into table %s""" % (t, t))
-        q = """LOAD DATA LOCAL INFILE '%s/%s.tsv' INTO TABLE %s FIELDS TERMINATED BY '\t' IGNORE 1 LINES""" % (PARSED_FILES_PATH, t, t)
+        # Drop secondary indexes of staging tables while loading and build them
+        # afterwards, which is much faster than updating them for every row.
+        # Indexes of the current tables are kept, a failed load would lose them:
+        indexes = []
+        if SWAP_TABLES:
+            indexes = get_secondary_indexes(c, t + target_suffix)
+            drop_indexes(c, t + target_suffix, indexes)
+
+        logging.info("""Loading %s.tsv into table %s%s""" % (t, t, target_suffix))
+        q = """LOAD DATA LOCAL INFILE '%s/%s.tsv' INTO TABLE %s%s FIELDS TERMINATED BY '\t' IGNORE 1 LINES %s""" % (PARSED_FILES_PATH, t, t, target_suffix, columns.get(t, ''))
         c.execute(q)
         connection.commit()
         logging.info("""Loading %s.tsv complete""" % (t))
 
+        create_indexes(c, t + target_suffix, indexes)
+
     # Re-enable warnings
     warnings.resetwarnings()
 
+    if SWAP_TABLES and swap:
+        swap_tables(c, tables)
+
+def load_delta():
+    """
+    Load a new delivery incrementally. Services are compared by their content
+    hash, only inserted, changed and removed services are applied to the
+    timetable tables. All other tables are small and are replaced completely.
+    Returns a sorted list of service dates on which the schedule has changed.
+    """
+
+    connection = connect()
+    c = connection.cursor()
+
+    # Databases loaded by older versions lack the tables for delta loading:
+    create_missing_tables(c)
+
+    old_footnotes = get_footnotes()
+    new_footnotes = read_footnotes()
+
+    c.execute('SELECT serviceid, hash FROM timetable_hash')
+    old_hashes = dict(c.fetchall())
+
+    if len(old_hashes) == 0:
+        logging.warning("No service hashes loaded, loading all tables")
+        load_tsv_files()
+
+        # Every date in both deliveries has changed:
+        empty = serviceinfo.footnote.Footnotes()
+        return sorted(set(old_footnotes.get_changed_dates(empty)) | set(new_footnotes.get_changed_dates(empty)))
+
+    new_hashes = dict(read_tsv('timetable_hash'))
+
+    inserted = set(new_hashes) - set(old_hashes)
+    removed = set(old_hashes) - set(new_hashes)
+    changed = set(serviceid for serviceid in set(new_hashes) & set(old_hashes)
+                  if old_hashes[serviceid] != new_hashes[serviceid])
+
+    logging.info("Services inserted: %d, changed: %d, removed: %d", len(inserted), len(changed), len(removed))
+
+    # Service dates of the old and new version of all inserted, changed and removed services,
+    # and the dates on which a footnote has changed:
+    dates = set(old_footnotes.get_changed_dates(new_footnotes))
+
+    for footnote in get_validity_footnotes(c, changed | removed):
+        dates.update(old_footnotes.get_active_dates(footnote))
+
+    for row in read_tsv('timetable_validity', changed | inserted):
+        dates.update(new_footnotes.get_active_dates(int(row[1])))
+
+    # Load all other tables into staging tables first, so the changed services
+    # are only applied when all files could be loaded:
+    other_tables = [t for t in TABLES if t not in TIMETABLE_TABLES]
+    load_tsv_files(other_tables, swap=False)
+
+    # Apply changed services in a single transaction:
+    warnings.filterwarnings('ignore', category = MySQLdb.Warning)
+    for t in TIMETABLE_TABLES:
+        logging.info("""Updating table %s""" % t)
+        delete_services(c, t, changed | removed)
+        load_services(c, t, changed | inserted)
+    warnings.resetwarnings()
+
+    connection.commit()
+    logging.info("Services updated")
+
+    # Replace the other tables directly after the services are updated,
+    # so footnotes and services stay consistent:
+    swap_tables(c, other_tables)
+
+    return sorted(dates)
+
+def get_footnotes():
+    iff = serviceinfo.iff.IffSource(config)
+    footnotes = iff.get_footnotes()
+    iff.close()
+
+    return footnotes
+
+def read_footnotes():
+    footnotes = serviceinfo.footnote.Footnotes()
+
+    for footnote, firstday, days in read_tsv('footnote_bitmap'):
+        footnotes.add(footnote, datetime.datetime.strptime(firstday, '%Y-%m-%d').date(), binascii.unhexlify(days))
+
+    return footnotes
+
+def read_tsv(table, serviceids=None):
+    """
+    Read the rows of a TSV file, optionally only the rows for the given service ID's.
+    Yields (first column as integer, second column) tuples.
+    """
+
+    with open(PARSED_FILES_PATH + table + '.tsv', 'r') as f:
+        f.readline()
+
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if serviceids is None or int(row[0]) in serviceids:
+                yield (int(row[0]),) + tuple(row[1:])
+
+def get_validity_footnotes(c, serviceids):
+    footnotes = set()
+    serviceids = sorted(serviceids)
+
+    for i in range(0, len(serviceids), DELETE_SIZE):
+        batch = serviceids[i:i + DELETE_SIZE]
+        c.execute('SELECT DISTINCT footnote FROM timetable_validity WHERE serviceid IN (%s)'
+                  % ', '.join(['%s'] * len(batch)), batch)
+        footnotes.update(row[0] for row in c.fetchall())
+
+    return footnotes
+
+def delete_services(c, table, serviceids):
+    serviceids = sorted(serviceids)
+
+    for i in range(0, len(serviceids), DELETE_SIZE):
+        batch = serviceids[i:i + DELETE_SIZE]
+        c.execute('DELETE FROM %s WHERE serviceid IN (%s)' % (table, ', '.join(['%s'] * len(batch))), batch)
+
+def load_services(c, table, serviceids):
+    """
+    Load the rows of the given services from a TSV file, by writing them to a
+    temporary TSV file first.
+    """
+
+    if len(serviceids) == 0:
+        return
+
+    filename = PARSED_FILES_PATH + table + '.delta.tsv'
+
+    with open(PARSED_FILES_PATH + table + '.tsv', 'r') as f:
+        with open(filename, 'w') as delta:
+            delta.write(f.readline())
+
+            for line in f:
+                if int(line.split('\t', 1)[0]) in serviceids:
+                    delta.write(line)
+
+    c.execute("""LOAD DATA LOCAL INFILE '%s' INTO TABLE %s FIELDS TERMINATED BY '\t' IGNORE 1 LINES""" % (filename, table))
+    os.remove(filename)
+
+def create_missing_tables(c):
+    """
+    Create tables which do not exist yet (e.g. tables added in a newer version),
+    using the table definitions in doc/create-tables.sql.
+    """
+
+    c.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()")
+    existing = set(row[0] for row in c.fetchall())
+    missing = set(TABLES) - existing
+
+    if len(missing) == 0:
+        return
+
+    with open(CREATE_TABLES_SQL, 'r') as f:
+        statements = f.read().split(';')
+
+    for statement in statements:
+        match = re.search(r'CREATE TABLE `(\w+)`', statement)
+
+        if match is not None and match.group(1) in missing:
+            logging.info("""Creating missing table %s""" % match.group(1))
+            c.execute(statement)
+
+def get_secondary_indexes(c, table):
+    """
+    Get the non-unique secondary indexes of a table. Primary keys and unique
+    keys are not returned, these are needed while loading to skip duplicate rows.
+    Returns a list of (index name, list of columns) tuples.
+    """
+
+    c.execute("""SELECT INDEX_NAME, COLUMN_NAME, SUB_PART FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND NON_UNIQUE = 1
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX""", [table])
+
+    indexes = []
+    for name, column, sub_part in c.fetchall():
+        if sub_part is not None:
+            column = '`%s`(%d)' % (column, sub_part)
+        else:
+            column = '`%s`' % column
+
+        if len(indexes) == 0 or indexes[-1][0] != name:
+            indexes.append((name, []))
+        indexes[-1][1].append(column)
+
+    return indexes
+
+def drop_indexes(c, table, indexes):
+    if len(indexes) == 0:
+        return
+
+    c.execute('ALTER TABLE %s %s' % (table, ', '.join(['DROP INDEX `%s`' % name for name, _ in indexes])))
+
+def create_indexes(c, table, indexes):
+    """
+    Create indexes, all indexes of a table are built with a single ALTER TABLE.
+    """
+
+    if len(indexes) == 0:
+        return
+
+    logging.info("""Building indexes for table %s""" % table)
+    c.execute('ALTER TABLE %s %s' % (table, ', '.join(['ADD INDEX `%s` (%s)' % (name, ', '.join(columns))
+                                                       for name, columns in indexes])))
+
+def swap_tables(c, tables):
+    """
+    Replace the current tables by the staging tables. All tables are renamed
+    in a single RENAME TABLE statement, which is atomic: readers see either
+    the old or the new dataset, never a mix or empty tables.
+    """
+
+    logging.info("Swapping staging tables...")
+
+    for t in tables:
+        c.execute('DROP TABLE IF EXISTS %s%s' % (t, OLD_SUFFIX))
+
+    renames = []
+    for t in tables:
+        renames.append('%s TO %s%s' % (t, t, OLD_SUFFIX))
+        renames.append('%s%s TO %s' % (t, STAGING_SUFFIX, t))
+
+    c.execute('RENAME TABLE %s' % ', '.join(renames))
+    logging.info("Staging tables swapped")
+
+    for t in tables:
+        c.execute('DROP TABLE %s%s' % (t, OLD_SUFFIX))
+
 def main():
     """
     Main loop
     """
 
-    global config, PARSED_FILES_PATH, TRUNCATE_TABLES, CREATE_TABLES
+    global config, PARSED_FILES_PATH, TRUNCATE_TABLES, CREATE_TABLES, SWAP_TABLES
 
     # Initialize argparse
     parser = argparse.ArgumentParser(description='IFF loader')
@@ -73,6 +363,12 @@ def main():
         action='store_true', help='Create tables')
     parser.add_argument('--truncate_tables', dest='truncate_tables',
         action='store_true', help='Truncate (empty) tables')
+    parser.add_argument('--swap_tables', dest='swap_tables',
+        action='store_true', help='Load into staging tables and replace the current tables atomically')
+    parser.add_argument('--delta', dest='delta',
+        action='store_true', help='Only load inserted, changed and removed services, replace all other tables')
+    parser.add_argument('--changed_dates', dest='changed_dates', default=None,
+        action='store', help='Delta mode: write the service dates with a changed schedule to this file')
 
     args = parser.parse_args()
 
@@ -80,8 +376,27 @@ def main():
     PARSED_FILES_PATH = args.parsed_dir + '/'
     CREATE_TABLES = args.create_tables
     TRUNCATE_TABLES = args.truncate_tables
+    SWAP_TABLES = args.swap_tables
     serviceinfo.common.setup_logging('iff-loader')
 
+    if TRUNCATE_TABLES and (SWAP_TABLES or args.delta):
+        logging.error("--truncate_tables can not be combined with --swap_tables or --delta")
+        return
+
+    if args.delta:
+        # Tables which are not loaded incrementally are swapped:
+        SWAP_TABLES = True
+
+        logging.info("Loading changed services from TSV files")
+        dates = load_delta()
+
+        logging.info("Schedule changed on %d service dates", len(dates))
+        if args.changed_dates is not None:
+            with open(args.changed_dates, 'w') as f:
+                for service_date in dates:
+                    f.write(service_date.isoformat() + '\n')
+        return
+
     logging.info("Loading TSV files")
     load_tsv_files()
 
@@ -21,7 +21,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 import logging.config
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta
 import isodate
 import sys
 
@@ -57,59 +57,50 @@ def get_current_servicedate(date='TODAY'):
 
     return service_date
 
-def load_schedule(service_date):
+def load_schedule(service_dates, schedule_filter=None):
     """
-    Retrieve the schedule from IFF.
+    Retrieve the schedule from IFF. The stops of every service are loaded
+    once and applied to all service dates on which the service runs.
 
     Args:
-        service_date (date): Date for which to retrieve the schedule
+        service_dates (list): Dates for which to retrieve the schedule
+        schedule_filter (ServiceFilter, optional): Compiled filter, services which
+            are excluded for certain are not retrieved from IFF
 
     Returns:
-        list of scheduled services (containing Service objects)
+        iterator over scheduled services (containing Service objects)
     """
 
     logger = logging.getLogger(__name__)
 
-    logger.debug('Getting services for %s', service_date)
-    iff = serviceinfo.iff.IffSource(
+    logger.debug('Getting services for %s', ', '.join(str(service_date) for service_date in service_dates))
+    iff = serviceinfo.iff.get_iff_source(
         serviceinfo.common.configuration['iff_database'])
-    services = iff.get_services_date(service_date)
 
-    logger.info('Found %s scheduled services on %s',
-        len(services), service_date.strftime('%Y-%m-%d'))
+    return iff.iter_services_details_dates(service_dates, schedule_filter)
 
-    # Get services:
-    schedule = iff.get_services_details(services, service_date)
-
-    logger.info('Loaded %s services', len(services))
-
-    return schedule
-
-def filter_schedule(schedule, filter_config):
+def filter_schedule(schedule, schedule_filter):
     """
-    Filter the list of scheduled services according to the configuration
+    Filter the scheduled services with a compiled filter (ServiceFilter),
+    returns an iterator over the included services
     """
 
     logger = logging.getLogger(__name__)
     logger.info('Filtering schedule')
 
-    filtered_schedule = []
-
     for service in schedule:
-        if service_filter.is_service_included(service, filter_config):
-            filtered_schedule.append(service)
+        if schedule_filter(service):
+            yield service
         else:
             logger.debug("Ignoring service %s/%s" % (service.company_code, service.servicenumber))
 
-    return filtered_schedule
-
 
 def store_schedule(schedule):
     """
     Store a schedule to the schedule store.
 
     Args:
-        schedule (list): List of scheduled services
+        schedule (iterable): Scheduled services, stored in batches
     """
 
     logger = logging.getLogger(__name__)
@@ -139,6 +130,10 @@ def main():
     parser.add_argument('-d', '--servicedate', dest='servicedate',
         default='TODAY', action='store', help='Service date')
 
+    parser.add_argument('-n', '--days', dest='days', type=int,
+        default=1, action='store',
+        help='Number of service dates to schedule, starting at the service date (default: 1)')
+
     args = parser.parse_args()
 
     # Load configuration:
@@ -155,9 +150,19 @@ def main():
         logger.error("No valid service date, aborting.")
         sys.exit(1)
 
-    schedule = load_schedule(servicedate)
-    schedule = filter_schedule(schedule,
+    if args.days < 1:
+        logger.error("Number of days must be at least 1, aborting.")
+        sys.exit(1)
+
+    service_dates = [servicedate + timedelta(days=day) for day in range(args.days)]
+
+    # The filter is applied in the IFF queries where possible, and
+    # to all loaded services:
+    schedule_filter = service_filter.ServiceFilter(
         serviceinfo.common.configuration['scheduler']['filter'])
+
+    schedule = load_schedule(service_dates, schedule_filter)
+    schedule = filter_schedule(schedule, schedule_filter)
     store_schedule(schedule)
 
 if __name__ == "__main__":
@@ -5,89 +5,658 @@ Module to store services into a MySQL database archive
 """
 
 import MySQLdb
+import MySQLdb.cursors
+import datetime
 import logging
+import os
+import re
+import zlib
 
+import serviceinfo.export as export
 import serviceinfo.service_store as service_store
 import serviceinfo.util as util
 
+# Table definitions, used to create tables added in newer versions:
+CREATE_TABLES_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'doc', 'create-tables-archive.sql')
+
+# All archive tables:
+TABLES = ['archive_progress', 'sequences', 'services', 'stations', 'stops', 'transport_modes']
+
 class Archive(object):
+    archive_config = None
     archive_connection = None
+    autocommit_connection = None
     store = None
     logger = None
     service_date = None
     store_type = None
 
-    station_cache = set()
-    transport_mode_cache = set()
+    # Bulk mode: number of services written per batch (0 to disable bulk mode)
+    bulk_size = 0
+    service_buffer = None
+
+    # Number of service numbers per transaction:
+    commit_size = 1000
+
+    # Number of service numbers loaded from the schedule store per pipelined request:
+    load_size = 100
+
+    # Partition of service numbers archived by this instance:
+    worker = 0
+    workers = 1
+
+    # Dimension rows known to be in the archive, and new rows to be written:
+    station_cache = None
+    transport_mode_cache = None
+    new_stations = None
+    new_transport_modes = None
+
+    # Service numbers and (service number, service ID) pairs already in the archive:
+    archived_numbers = None
+    archived_services = None
 
-    def __init__(self, service_date, archive_config, schedule_store_config):
+    def __init__(self, service_date, archive_config, schedule_store_config, bulk_size=0, commit_size=1000,
+                 worker=0, workers=1):
         """
         Initialize the ServiceStore. config must be a valid configuration
         dictionary, containing the Redis connection configuration.
+
+        When bulk_size is set, services and stops are buffered and written
+        with multi-row inserts of bulk_size services at a time. Services are
+        committed every commit_size service numbers.
+
+        When workers is larger than 1, only the service numbers in partition
+        worker (0 to workers - 1) are archived, so multiple processes can
+        archive the same service date in parallel.
         """
 
         self.logger = logging.getLogger(__name__)
         self.service_date = util.datetime_to_iso(service_date)
+        self.archive_config = archive_config
+        self.bulk_size = bulk_size
+        self.commit_size = commit_size
+        self.worker = worker
+        self.workers = workers
+        self.service_buffer = []
+
+        self.station_cache = set()
+        self.transport_mode_cache = set()
+        self.new_stations = {}
+        self.new_transport_modes = {}
+        self.archived_numbers = set()
+        self.archived_services = set()
 
         self.logger.debug("Connecting to archive database")
-        self.archive_connection = MySQLdb.connect(host=archive_config['host'],
-                                                  user=archive_config['user'], passwd=archive_config['password'],
-                                                  db=archive_config['database'], charset='utf8')
+        self.archive_connection = self._connect()
+        self._upgrade_schema()
 
         self.logger.debug("Connecting to schedule store")
         self.store = service_store.ServiceStore(schedule_store_config)
         self.store_type = self.store.TYPE_ACTUAL_OR_SCHEDULED
 
-    def store_archive(self):
+    def store_archive(self, restart=False):
         """
-        Store all services to the archive
+        Store all services to the archive.
+
+        Services are committed in chunks of commit_size service numbers. After each chunk, the last archived
+        service number is saved in the archive_progress table in the same transaction, so an interrupted run
+        resumes after the last committed service number.
+        :param restart: ignore the saved progress, delete the archived services of this partition
+            and start with the first service number
         """
 
-        self.logger.info("Retrieving service IDs")
-        service_ids = self._get_service_ids()
+        cursor = self.archive_connection.cursor()
+
+        self._load_dimensions(cursor)
+
+        if restart:
+            self._delete_archived_services(cursor)
+        else:
+            self._load_archived_services(cursor)
+
+        progress = self._get_progress(cursor)
+        start = None
+
+        if progress is not None and not restart:
+            if progress[1]:
+                self.logger.info("Services on %s are already archived", self.service_date)
+                cursor.close()
+                return
+
+            start = progress[0]
+
+        if start is not None:
+            self.logger.info("Resuming archive after service %s", start)
+        else:
+            self.logger.info("Storing services to archive...")
 
-        self.logger.info("Found %d service definitions, storing to archive...", len(service_ids))
         number_processed = 0
+        last_servicenumber = start
 
-        cursor = self.archive_connection.cursor()
+        for servicenumbers in self._get_batches(self._get_service_ids(start)):
+            services = self.store.get_services(self.service_date, servicenumbers, self.store_type)
+
+            for service_id in servicenumbers:
+                self._archive_service(services[service_id], service_id, cursor)
+
+                number_processed += 1
+                last_servicenumber = service_id
 
-        for service_id in service_ids:
-            service = self._load_service(service_id)
-            self._store_service(service, service_id, cursor)
-            number_processed += 1
+                if number_processed % self.commit_size == 0:
+                    self._commit_progress(last_servicenumber, False, cursor)
+                    self.logger.info("%d services stored, committed up to service %s",
+                                     number_processed, last_servicenumber)
 
         self.logger.info("Committing")
-        self.archive_connection.commit()
+        self._commit_progress(last_servicenumber, True, cursor)
         cursor.close()
 
+        if self.autocommit_connection is not None:
+            self.autocommit_connection.close()
+            self.autocommit_connection = None
+
         self.logger.info("%d services stored to archive", number_processed)
 
-    def _get_service_ids(self):
-        return self.store.get_service_numbers(self.service_date, self.store_type)
+    def store_finished(self, grace_period=30, now=None):
+        """
+        Store all services which arrived at their last stop at least grace_period
+        minutes ago, and which are not archived yet. Finished services are found
+        with the arrival time index of the schedule store, so this method can be
+        run frequently during the day.
+        :param grace_period: minutes after the (delayed) arrival before a service is archived
+        :param now: reference time (default: current time)
+        :return: number of archived service numbers
+        """
+
+        if now is None:
+            now = datetime.datetime.now()
+
+        before = now - datetime.timedelta(minutes=grace_period)
+
+        cursor = self.archive_connection.cursor()
+
+        self._load_dimensions(cursor)
+        self._load_archived_services(cursor)
+
+        servicenumbers = [servicenumber for servicenumber
+                          in self.store.get_finished_service_numbers(self.service_date, self.store_type, before)
+                          if self._in_partition(servicenumber) and servicenumber not in self.archived_numbers]
+
+        self.logger.info("%d finished services on %s to archive", len(servicenumbers), self.service_date)
+
+        number_processed = 0
+
+        for batch in self._get_batches(servicenumbers):
+            services = self.store.get_services(self.service_date, batch, self.store_type)
+
+            for servicenumber in batch:
+                self._archive_service(services[servicenumber], servicenumber, cursor)
+
+                number_processed += 1
+                if number_processed % self.commit_size == 0:
+                    self._commit(cursor)
+
+        self._commit(cursor)
+        cursor.close()
+
+        if self.autocommit_connection is not None:
+            self.autocommit_connection.close()
+            self.autocommit_connection = None
+
+        return number_processed
+
+    def export(self, directory, export_format=None):
+        """
+        Export all archived stops on the service date to a columnar file
+        in the given directory, named after the service date.
+        :param directory: export directory
+        :param export_format: export.FORMAT_PARQUET or export.FORMAT_NUMPY (default: Parquet if available)
+        :return: file name of the export
+        """
+
+        if export_format is None:
+            export_format = export.get_default_format()
+
+        # Stream rows from the database, instead of loading all rows at once:
+        cursor = self.archive_connection.cursor(MySQLdb.cursors.SSDictCursor)
+        cursor.execute("""
+            SELECT s.id AS service_id, s.service_number, s.company, s.transport_mode, s.cancelled,
+              st.stop_nr, st.stop, st.arrival, st.departure, st.arrival_delay, st.departure_delay,
+              st.arrival_cancelled, st.departure_cancelled, st.arrival_platform, st.departure_platform
+            FROM services s
+            JOIN stops st ON st.service_id = s.id
+            WHERE s.service_date = %s
+            ORDER BY s.id, st.stop_nr""", [self.service_date])
+
+        columns = export.rows_to_columns(cursor)
+        cursor.close()
+
+        # Write to a temporary file first, so readers never see an incomplete export:
+        filename = export.get_filename(directory, self.service_date, export_format)
+        export.write_columns(columns, '%s.tmp' % filename, export_format)
+        os.rename('%s.tmp' % filename, filename)
+
+        self.logger.info("%d stops on %s exported to %s", len(columns['service_id']), self.service_date, filename)
+
+        return filename
+
+    def _archive_service(self, services, servicenumber, cursor):
+        """
+        Store or buffer the services for a service number, skipping services
+        which are already archived
+        :param services: list of service objects, or None
+        :param servicenumber: service number
+        :param cursor: MySQLdb cursor
+        """
+
+        # Service may be removed from the store since the service numbers were retrieved:
+        if services is None:
+            return
+
+        services = [service for service in services
+                    if (str(servicenumber), str(service.service_id)) not in self.archived_services]
+
+        if self.bulk_size > 0:
+            self._buffer_service(services, servicenumber, cursor)
+        else:
+            self._store_service(services, servicenumber, cursor)
+
+        self.archived_numbers.add(str(servicenumber))
+        for service in services:
+            self.archived_services.add((str(servicenumber), str(service.service_id)))
+
+    def _load_archived_services(self, cursor):
+        """
+        Load the service numbers and service IDs already archived on the service date
+        :param cursor: MySQLdb cursor
+        """
+
+        cursor.execute("""
+            SELECT service_number, service_id FROM services
+            WHERE service_date = %s AND service_id IS NOT NULL""", [self.service_date])
+
+        for servicenumber, service_id in cursor.fetchall():
+            self.archived_numbers.add(str(servicenumber))
+            self.archived_services.add((str(servicenumber), str(service_id)))
+
+    def _delete_archived_services(self, cursor):
+        """
+        Delete the services archived on the service date in this partition (stops are deleted
+        by the foreign key). The deletes are committed together with the first archived services.
+        :param cursor: MySQLdb cursor
+        """
+
+        cursor.execute("SELECT id, service_number FROM services WHERE service_date = %s", [self.service_date])
+        ids = [row[0] for row in cursor.fetchall() if self._in_partition(row[1])]
+
+        for offset in range(0, len(ids), 1000):
+            chunk = ids[offset:offset + 1000]
+            cursor.execute("DELETE FROM services WHERE id IN (%s)" % ', '.join(['%s'] * len(chunk)), chunk)
+
+        self.archived_numbers = set()
+        self.archived_services = set()
+
+        self.logger.info("Deleted %d archived services on %s", len(ids), self.service_date)
+
+    def _get_progress(self, cursor):
+        """
+        Retrieve the saved progress for the service date and partition
+        :param cursor: MySQLdb cursor
+        :return: tuple with last archived service number and completed flag, None when there is no progress
+        """
+
+        cursor.execute("""
+            SELECT last_service_number, completed FROM archive_progress
+            WHERE service_date = %s AND worker = %s AND workers = %s""",
+                       [self.service_date, self.worker, self.workers])
+
+        if cursor.rowcount == 0:
+            return None
+
+        row = cursor.fetchone()
+        return row[0], bool(row[1])
+
+    def _commit_progress(self, last_servicenumber, completed, cursor):
+        """
+        Write all buffered services, save the progress and commit
+        :param last_servicenumber: last archived service number
+        :param completed: True when all services are archived
+        :param cursor: MySQLdb cursor
+        """
+
+        cursor.execute("""
+            INSERT INTO archive_progress
+              (service_date, worker, workers, last_service_number, completed)
+            VALUES
+              (%(service_date)s, %(worker)s, %(workers)s, %(last_service_number)s, %(completed)s)
+            ON DUPLICATE KEY UPDATE
+              last_service_number = VALUES(last_service_number), completed = VALUES(completed)""",
+                       {'service_date': self.service_date, 'worker': self.worker, 'workers': self.workers,
+                        'last_service_number': last_servicenumber, 'completed': completed})
+
+        self._commit(cursor)
+
+    def _commit(self, cursor):
+        """
+        Write all buffered services and new dimension rows and commit
+        :param cursor: MySQLdb cursor
+        """
+
+        self._flush_services(cursor)
+        self._flush_dimensions()
+
+        self.archive_connection.commit()
+
+    def _load_dimensions(self, cursor):
+        """
+        Preload the codes of all stations and transport modes in the archive,
+        so only new rows have to be written
+        :param cursor: MySQLdb cursor
+        """
+
+        cursor.execute("SELECT code FROM stations")
+        self.station_cache.update(row[0] for row in cursor.fetchall())
 
-    def _load_service(self, service_id):
-        return self.store.get_service(self.service_date, service_id, self.store_type)
+        cursor.execute("SELECT `mode` FROM transport_modes")
+        self.transport_mode_cache.update(row[0] for row in cursor.fetchall())
+
+        self.logger.debug("Preloaded %d stations and %d transport modes",
+                          len(self.station_cache), len(self.transport_mode_cache))
+
+    def _flush_dimensions(self):
+        """
+        Write all new stations and transport modes with a single batched upsert each.
+        Rows are written on the autocommit connection in key order, so parallel
+        workers writing the same rows do not deadlock.
+        """
+
+        if len(self.new_stations) == 0 and len(self.new_transport_modes) == 0:
+            return
+
+        cursor = self._connect_autocommit().cursor()
+
+        if len(self.new_stations) > 0:
+            cursor.executemany("""
+                INSERT INTO stations
+                  (code, name)
+                VALUES
+                  (%s, %s)
+                ON DUPLICATE KEY UPDATE
+                  name = COALESCE(VALUES(name), name)""", sorted(self.new_stations.items()))
+
+        if len(self.new_transport_modes) > 0:
+            cursor.executemany("""
+                INSERT INTO transport_modes
+                  (`mode`, mode_description)
+                VALUES
+                  (%s, %s)
+                ON DUPLICATE KEY UPDATE
+                  mode_description = COALESCE(VALUES(mode_description), mode_description)""",
+                               sorted(self.new_transport_modes.items()))
+
+        self.logger.debug("Stored %d new stations and %d new transport modes",
+                          len(self.new_stations), len(self.new_transport_modes))
+
+        cursor.close()
+        self.new_stations = {}
+        self.new_transport_modes = {}
+
+    def _connect(self):
+        """
+        Connect to the archive database
+        :return: MySQLdb connection
+        """
+
+        return MySQLdb.connect(host=self.archive_config['host'],
+                               user=self.archive_config['user'], passwd=self.archive_config['password'],
+                               db=self.archive_config['database'], charset='utf8')
+
+    def _upgrade_schema(self):
+        """
+        Upgrade an archive created by an older version: create the tables which do not
+        exist yet (using the table definitions in doc/create-tables-archive.sql), and add
+        the service_id column and its unique key to the services table.
+        """
+
+        cursor = self.archive_connection.cursor()
+
+        cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()")
+        missing = set(TABLES) - set(row[0] for row in cursor.fetchall())
+
+        if len(missing) > 0:
+            with open(CREATE_TABLES_SQL, 'r') as f:
+                statements = f.read().split(';')
+
+            for statement in statements:
+                match = re.search(r'CREATE TABLE `(\w+)`', statement)
+
+                if match is not None and match.group(1) in missing:
+                    self.logger.info("Creating missing table %s", match.group(1))
+                    cursor.execute(statement)
+
+        cursor.execute("""
+            SELECT DATA_TYPE FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'services' AND COLUMN_NAME = 'service_id'""")
+        row = cursor.fetchone()
+
+        cursor.execute("""
+            SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'services'""")
+        indexes = set(index_row[0] for index_row in cursor.fetchall())
+
+        alterations = []
+
+        if row is None:
+            alterations.append("ADD COLUMN service_id varchar(32) DEFAULT NULL AFTER service_number")
+        elif row[0] != 'varchar':
+            alterations.append("MODIFY service_id varchar(32) DEFAULT NULL")
+
+        if 'service_date_service_number_service_id' not in indexes:
+            alterations.append("ADD UNIQUE KEY service_date_service_number_service_id "
+                               "(service_date, service_number, service_id)")
+
+        # Replaced by the unique key:
+        if 'service_date_service_number' in indexes:
+            alterations.append("DROP KEY service_date_service_number")
+
+        if len(alterations) > 0:
+            self.logger.info("Upgrading services table: %s", ', '.join(alterations))
+            cursor.execute("ALTER TABLE services %s" % ', '.join(alterations))
+
+        cursor.close()
+
+    def _connect_autocommit(self):
+        """
+        Get the connection in autocommit mode, used for writes which should not
+        wait for the archive transaction (ID reservations and dimension rows)
+        :return: MySQLdb connection
+        """
+
+        if self.autocommit_connection is None:
+            self.autocommit_connection = self._connect()
+            self.autocommit_connection.autocommit(True)
+
+        return self.autocommit_connection
+
+    def _get_service_ids(self, start=None):
+        for servicenumber in self.store.iter_service_numbers(self.service_date, self.store_type, start):
+            if self._in_partition(servicenumber) and servicenumber not in self.archived_numbers:
+                yield servicenumber
+
+    def _get_batches(self, servicenumbers):
+        """
+        Group service numbers in batches of load_size, so each batch is
+        loaded with a single pipelined request
+        """
+
+        batch = []
+        for servicenumber in servicenumbers:
+            batch.append(servicenumber)
+
+            if len(batch) >= self.load_size:
+                yield batch
+                batch = []
+
+        if len(batch) > 0:
+            yield batch
+
+    def _in_partition(self, servicenumber):
+        return self.workers <= 1 or self._get_partition(servicenumber) == self.worker
+
+    def _get_partition(self, servicenumber):
+        """
+        Determine the partition of a service number. Partitions are based on a
+        hash, so services are spread evenly regardless of number ranges.
+        """
+
+        return (zlib.crc32(str(servicenumber)) & 0xffffffff) % self.workers
 
     def _store_service(self, services, servicenumber, cursor):
+        if len(services) == 0:
+            return
+
+        service_id = self._reserve_service_ids(len(services))
+
         for service in services:
             service_data = self._process_service_data(service)
             service_data['service_number'] = servicenumber
+            service_data['id'] = service_id
 
             cursor.execute("""
                 INSERT INTO services
-                  (service_date, service_number, company, transport_mode, cancelled, partly_cancelled, max_delay,
-                  `from`, `to`, `source`)
+                  (id, service_date, service_number, service_id, company, transport_mode, cancelled, partly_cancelled,
+                  max_delay, `from`, `to`, `source`)
                 VALUES
-                  (%(service_date)s, %(service_number)s, %(company)s, %(transmode)s, %(cancelled)s,
-                  %(partly_cancelled)s, %(max_delay)s, %(from)s, %(to)s, %(source)s)""", service_data)
+                  (%(id)s, %(service_date)s, %(service_number)s, %(service_id)s, %(company)s, %(transmode)s,
+                  %(cancelled)s, %(partly_cancelled)s, %(max_delay)s, %(from)s, %(to)s, %(source)s)
+                ON DUPLICATE KEY UPDATE
+                  id = id""", service_data)
 
-            service_id = cursor.lastrowid
+            # Service archived by an overlapping run, keep its stops:
+            if cursor.rowcount == 0:
+                self.logger.debug("Service %s (%s) is already archived", servicenumber, service.service_id)
+                service_id += 1
+                continue
 
             # Store stops:
             self._store_stops(service_id, service, cursor)
 
             # Store transportation mode:
-            self.store_transport_mode(service.transport_mode, service.transport_mode_description, cursor)
+            self.store_transport_mode(service.transport_mode, service.transport_mode_description)
+
+            service_id += 1
+
+    def _buffer_service(self, services, servicenumber, cursor):
+        """
+        Add services to the bulk buffer, write the buffer when it is full
+        :param services: list of service objects
+        :param servicenumber: service number
+        :param cursor: MySQLdb cursor
+        """
+
+        for service in services:
+            self.service_buffer.append((servicenumber, service))
+
+        if len(self.service_buffer) >= self.bulk_size:
+            self._flush_services(cursor)
+
+    def _flush_services(self, cursor):
+        """
+        Write all buffered services and their stops with multi-row inserts.
+        Archive IDs are reserved in advance, so stops can be linked to their
+        service without retrieving the ID of each inserted service.
+
+        Services already archived by an overlapping run are skipped, together
+        with their stops.
+        :param cursor: MySQLdb cursor
+        """
+
+        if len(self.service_buffer) == 0:
+            return
+
+        first_id = service_id = self._reserve_service_ids(len(self.service_buffer))
+
+        services_data = []
+        stops_data = []
+
+        for servicenumber, service in self.service_buffer:
+            service_data = self._process_service_data(service)
+            service_data['service_number'] = servicenumber
+            service_data['id'] = service_id
+            services_data.append(service_data)
+
+            for stop_nr, stop in enumerate(service.stops):
+                stops_data.append(self._process_stop_data(service_id, stop, stop_nr))
+                self.store_station(stop.stop_code, stop.stop_name)
+
+            self.store_transport_mode(service.transport_mode, service.transport_mode_description)
+
+            service_id += 1
+
+        cursor.executemany("""
+            INSERT INTO services
+              (id, service_date, service_number, service_id, company, transport_mode, cancelled, partly_cancelled,
+              max_delay, `from`, `to`, `source`)
+            VALUES
+              (%(id)s, %(service_date)s, %(service_number)s, %(service_id)s, %(company)s, %(transmode)s,
+              %(cancelled)s, %(partly_cancelled)s, %(max_delay)s, %(from)s, %(to)s, %(source)s)
+            ON DUPLICATE KEY UPDATE
+              id = id""", services_data)
+
+        # Reserved IDs of duplicate services are not inserted:
+        cursor.execute("SELECT id FROM services WHERE id BETWEEN %s AND %s", [first_id, service_id - 1])
+        inserted = set(row[0] for row in cursor.fetchall())
+
+        if len(inserted) < len(services_data):
+            self.logger.debug("%d services are already archived", len(services_data) - len(inserted))
+            stops_data = [stop_data for stop_data in stops_data if stop_data['service_id'] in inserted]
+
+        cursor.executemany("""
+            INSERT INTO stops
+              (service_id, stop_nr, `stop`, service_number, arrival, arrival_delay, arrival_cancelled,
+              arrival_platform, arrival_platform_scheduled, departure, departure_delay, departure_cancelled,
+              departure_platform, departure_platform_scheduled)
+            VALUES
+              (%(service_id)s, %(stop_nr)s, %(stop)s, %(service_number)s, %(arrival)s, %(arrival_delay)s,
+              %(arrival_cancelled)s, %(arrival_platform)s, %(arrival_platform_scheduled)s, %(departure)s,
+              %(departure_delay)s, %(departure_cancelled)s, %(departure_platform)s,
+              %(departure_platform_scheduled)s)""", stops_data)
+
+        self.logger.debug("Stored %d services with %d stops", len(services_data), len(stops_data))
+        self.service_buffer = []
+
+    def _reserve_service_ids(self, count):
+        """
+        Reserve a range of IDs in the services table. The reservation uses a
+        separate connection in autocommit mode, so the sequence is not locked
+        until the archive transaction is committed.
+
+        All services are inserted with reserved IDs, in bulk mode and in normal
+        mode, so the reservations never race with AUTO_INCREMENT IDs. The
+        sequence starts after the highest ID, for archives written before IDs
+        were reserved.
+        :param count: number of IDs to reserve
+        :return: first reserved ID
+        """
+
+        cursor = self._connect_autocommit().cursor()
+
+        cursor.execute("""
+            INSERT IGNORE INTO sequences
+              (name, value)
+            VALUES
+              ('services', 0)""")
+
+        cursor.execute("""
+            UPDATE sequences
+            SET value = LAST_INSERT_ID(GREATEST(value, (SELECT COALESCE(MAX(id), 0) FROM services)) + %s)
+            WHERE name = 'services'""", [count])
+
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        last_id = cursor.fetchone()[0]
+        cursor.close()
+
+        return last_id - count + 1
 
     def _store_stops(self, service_id, service, cursor):
         stop_nr = 0
@@ -105,7 +674,7 @@ class Archive(object):
                   %(departure_delay)s, %(departure_cancelled)s, %(departure_platform)s,
                   %(departure_platform_scheduled)s)""", stop_data)
 
-            self.store_station(stop.stop_code, stop.stop_name, cursor)
+            self.store_station(stop.stop_code, stop.stop_name)
 
             stop_nr += 1
 
@@ -130,6 +699,7 @@ class Archive(object):
         service_data = {
             "service_date": service.get_servicedate_str(),
             "service_number": service.servicenumber,
+            "service_id": service.service_id,
             "company": service.company_code,
             "transmode": service.transport_mode,
             "cancelled": service.cancelled,
@@ -168,62 +738,30 @@ class Archive(object):
 
         return stop_data
 
-    def store_station(self, station_code, station_name, cursor):
+    def store_station(self, station_code, station_name):
         """
-        Store a station to the archive
+        Store a station to the archive. New stations are written when the
+        archive transaction is committed.
         :param station_code: station code
         :param station_name: station name
-        :param cursor: MySQLdb cursor
         :return:
         """
         if station_code in self.station_cache:
             return
 
-        station_data = {
-            "code": station_code,
-            "name": station_name
-        }
-
-        # Verify whether station already exists:
-        cursor.execute("""
-            SELECT name FROM stations
-            WHERE code = %s;""", [station_code])
-
-        if cursor.rowcount == 0:
-            # Insert stop:
-            cursor.execute("""
-                    INSERT INTO stations
-                      (code, name)
-                    VALUES
-                      (%(code)s, %(name)s)""", station_data)
+        self.new_stations[station_code] = station_name
         self.station_cache.add(station_code)
 
-    def store_transport_mode(self, transport_mode_code, transport_mode_description, cursor):
+    def store_transport_mode(self, transport_mode_code, transport_mode_description):
         """
-        Store a transportation mode to the archive
+        Store a transportation mode to the archive. New transport modes are
+        written when the archive transaction is committed.
         :param transport_mode_code: transport mode code
         :param transport_mode_description: transport mode description
-        :param cursor: MySQLdb cursor
         :return:
         """
         if transport_mode_code in self.transport_mode_cache:
             return
 
-        transport_mode_data = {
-            "mode": transport_mode_code,
-            "mode_description": transport_mode_description
-        }
-
-        # Verify whether station already exists:
-        cursor.execute("""
-            SELECT `mode` FROM transport_modes
-            WHERE `mode` = %s;""", [transport_mode_code])
-
-        if cursor.rowcount == 0:
-            # Insert stop:
-            cursor.execute("""
-                    INSERT INTO transport_modes
-                      (`mode`, mode_description)
-                    VALUES
-                      (%(mode)s, %(mode_description)s)""", transport_mode_data)
+        self.new_transport_modes[transport_mode_code] = transport_mode_description
         self.transport_mode_cache.add(transport_mode_code)
@@ -0,0 +1,120 @@
+"""
+Delay statistics
+
+Module to compute punctuality, delay percentiles and cancellation rates
+over archived stops. Stops are loaded as columns (see serviceinfo.export)
+and all statistics are computed with vectorised numpy operations.
+"""
+
+import numpy
+
+import serviceinfo.export as export
+
+# Columns which can be used to group statistics:
+GROUP_STATION = 'stop'
+GROUP_COMPANY = 'company'
+GROUP_TRANSPORT_MODE = 'transport_mode'
+
+GROUPS = {
+    'station': GROUP_STATION,
+    'company': GROUP_COMPANY,
+    'transport_mode': GROUP_TRANSPORT_MODE,
+}
+
+
+def get_delay_statistics(columns, group_by, threshold=5, percentiles=(50, 90, 95)):
+    """
+    Compute statistics for arrivals, grouped by station, company or transport mode.
+    Cancelled arrivals count towards the cancellation rate only, punctuality and
+    delays are based on arrivals which were not cancelled.
+    :param columns: dict of columns, as returned by export.load_date() or export.load_dates()
+    :param group_by: GROUP_STATION, GROUP_COMPANY or GROUP_TRANSPORT_MODE
+    :param threshold: arrivals with a delay below this number of minutes are punctual
+    :param percentiles: delay percentiles to compute
+    :return: list of dicts with statistics, one for each group, sorted by number of arrivals
+    """
+
+    dictionary = columns['%s_dictionary' % group_by]
+    groups = len(dictionary)
+
+    # Only stops with an arrival (i.e. not the first stop of a service):
+    arrivals = columns['arrival'] != export.NO_TIME
+    keys = columns[group_by][arrivals].astype(numpy.intp)
+    delays = columns['arrival_delay'][arrivals]
+    cancelled = columns['arrival_cancelled'][arrivals] | columns['cancelled'][arrivals]
+
+    arrival_counts = numpy.bincount(keys, minlength=groups)
+    cancelled_counts = numpy.bincount(keys, weights=cancelled, minlength=groups)
+
+    # Statistics for arrivals which were not cancelled:
+    keys = keys[~cancelled]
+    delays = delays[~cancelled]
+
+    counts = numpy.bincount(keys, minlength=groups)
+    punctual_counts = numpy.bincount(keys, weights=delays < threshold, minlength=groups)
+    delay_sums = numpy.bincount(keys, weights=delays, minlength=groups)
+
+    delay_percentiles = _get_group_percentiles(keys, delays, counts, percentiles)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cancellation_rates = cancelled_counts / arrival_counts
+        punctuality = punctual_counts / counts
+        mean_delays = delay_sums / counts
+
+    statistics = []
+    for group in numpy.argsort(-arrival_counts, kind='mergesort'):
+        if arrival_counts[group] == 0:
+            continue
+
+        group_statistics = {
+            'key': dictionary[group],
+            'arrivals': int(arrival_counts[group]),
+            'cancelled': int(cancelled_counts[group]),
+            'cancellation_rate': float(cancellation_rates[group]),
+            'punctuality': _get_optional_float(punctuality[group], counts[group]),
+            'mean_delay': _get_optional_float(mean_delays[group], counts[group]),
+        }
+
+        for percentile in percentiles:
+            group_statistics['p%s' % percentile] = _get_optional_float(delay_percentiles[percentile][group],
+                                                                       counts[group])
+
+        statistics.append(group_statistics)
+
+    return statistics
+
+
+def _get_group_percentiles(keys, delays, counts, percentiles):
+    """
+    Compute delay percentiles (nearest rank) for every group at once, by sorting
+    all delays by group and delay and selecting the rank within each group
+    :return: dict with percentile as key and an array with a value for every group
+    """
+
+    # Sort on a single integer combining group and delay, which is much faster than
+    # sorting on two keys. Delays are shifted to fit in the lower 16 bits:
+    combined = (keys.astype(numpy.int64) << 16) | (delays.astype(numpy.int64) + 32768)
+    sorted_delays = ((numpy.sort(combined) & 0xffff) - 32768).astype(numpy.int16)
+
+    # Position of the first delay of every group in the sorted delays:
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+
+    result = {}
+    for percentile in percentiles:
+        if len(sorted_delays) == 0:
+            result[percentile] = numpy.zeros(len(counts))
+            continue
+
+        ranks = numpy.ceil(counts * percentile / 100.0).astype(numpy.intp)
+        positions = starts + numpy.maximum(ranks - 1, 0)
+        positions = numpy.minimum(positions, len(sorted_delays) - 1)
+        result[percentile] = sorted_delays[positions]
+
+    return result
+
+
+def _get_optional_float(value, count):
+    if count == 0:
+        return None
+    else:
+        return float(value)
@@ -0,0 +1,291 @@
+"""
+Archive export
+
+Module to export archived stops of a service date to columnar files, so
+archived days can be analysed without querying the archive database.
+Files are written as Parquet when pyarrow is available, otherwise as a
+compressed numpy archive (.npz). Both formats contain the same typed
+columns and are read back with load_date().
+"""
+
+import datetime
+import logging
+import os
+
+import numpy
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import serviceinfo.util as util
+
+# Value for missing arrival or departure times in numpy columns:
+NO_TIME = -1
+
+FORMAT_PARQUET = 'parquet'
+FORMAT_NUMPY = 'npz'
+
+# Columns with a fixed type:
+COLUMNS = [
+    ('service_id', numpy.uint32),
+    ('stop_nr', numpy.uint8),
+    ('arrival', numpy.int64),
+    ('departure', numpy.int64),
+    ('arrival_delay', numpy.int16),
+    ('departure_delay', numpy.int16),
+    ('arrival_cancelled', numpy.bool_),
+    ('departure_cancelled', numpy.bool_),
+    ('cancelled', numpy.bool_),
+]
+
+# Dictionary encoded columns, stored as integer codes and a dictionary of values:
+DICTIONARY_COLUMNS = ['service_number', 'company', 'transport_mode', 'stop', 'arrival_platform',
+                      'departure_platform']
+
+# Columns with Unix timestamps:
+TIME_COLUMNS = ['arrival', 'departure']
+
+
+def get_default_format():
+    """
+    Determine the export format: Parquet if pyarrow is available, otherwise numpy
+    """
+
+    if pyarrow is not None:
+        return FORMAT_PARQUET
+    else:
+        return FORMAT_NUMPY
+
+
+def get_filename(directory, service_date, export_format):
+    return os.path.join(directory, '%s.%s' % (util.datetime_to_iso(service_date), export_format))
+
+
+def rows_to_columns(rows):
+    """
+    Convert archived stop rows to typed columns
+    :param rows: iterable of dicts with a key for every column (times as datetime objects or None)
+    :return: dict with a numpy array for every column, and '<column>_dictionary'
+        arrays for dictionary encoded columns
+    """
+
+    values = dict((name, []) for name, _ in COLUMNS)
+    values.update((name, []) for name in DICTIONARY_COLUMNS)
+
+    for row in rows:
+        for name in values:
+            value = row[name]
+
+            if name in TIME_COLUMNS:
+                value = util.datetime_to_timestamp(value)
+                if value is None:
+                    value = NO_TIME
+            elif name in DICTIONARY_COLUMNS and value is None:
+                value = ''
+
+            values[name].append(value)
+
+    columns = {}
+    for name, dtype in COLUMNS:
+        columns[name] = numpy.array(values[name], dtype=dtype)
+
+    for name in DICTIONARY_COLUMNS:
+        codes, dictionary = dictionary_encode(values[name])
+        columns[name] = codes
+        columns['%s_dictionary' % name] = dictionary
+
+    return columns
+
+
+def dictionary_encode(values):
+    """
+    Dictionary encode a list of strings
+    :param values: list of strings
+    :return: tuple with an array of integer codes and a sorted array of unique values
+    """
+
+    dictionary, codes = numpy.unique(numpy.array(values, dtype=numpy.unicode_), return_inverse=True)
+
+    return codes.astype(_get_code_type(dictionary)), dictionary
+
+
+def _get_code_type(dictionary):
+    if len(dictionary) <= numpy.iinfo(numpy.int16).max:
+        return numpy.int16
+    else:
+        return numpy.int32
+
+
+def write_columns(columns, filename, export_format=None):
+    """
+    Write columns to a Parquet or numpy file
+    :param columns: dict of columns, as returned by rows_to_columns()
+    :param filename: file name, including extension
+    :param export_format: FORMAT_PARQUET or FORMAT_NUMPY (default: Parquet if available)
+    """
+
+    if export_format is None:
+        export_format = get_default_format()
+
+    if export_format == FORMAT_PARQUET:
+        arrays = []
+        names = []
+
+        for name, _ in COLUMNS:
+            if name in TIME_COLUMNS:
+                array = pyarrow.array(columns[name], type=pyarrow.timestamp('s'), mask=columns[name] == NO_TIME)
+            else:
+                array = pyarrow.array(columns[name])
+
+            arrays.append(array)
+            names.append(name)
+
+        for name in DICTIONARY_COLUMNS:
+            arrays.append(pyarrow.DictionaryArray.from_arrays(
+                columns[name], pyarrow.array(columns['%s_dictionary' % name], type=pyarrow.string())))
+            names.append(name)
+
+        pyarrow.parquet.write_table(pyarrow.Table.from_arrays(arrays, names), filename)
+    elif export_format == FORMAT_NUMPY:
+        with open(filename, 'wb') as export_file:
+            numpy.savez_compressed(export_file, **columns)
+    else:
+        raise ValueError("Unknown export format: %s" % export_format)
+
+    logging.getLogger(__name__).debug("Exported %d stops to %s", len(columns['service_id']), filename)
+
+
+def read_columns(filename):
+    """
+    Read columns from a Parquet or numpy file
+    :param filename: file name, the format is determined by the extension
+    :return: dict of columns, in the same format as rows_to_columns()
+    """
+
+    if filename.endswith('.%s' % FORMAT_NUMPY):
+        with numpy.load(filename) as data:
+            return dict((name, data[name]) for name in data.files)
+
+    table = pyarrow.parquet.read_table(filename)
+    columns = {}
+
+    for name, dtype in COLUMNS:
+        chunks = table.column(name).chunks
+        values = [chunk.to_numpy(zero_copy_only=False) for chunk in chunks]
+        values = numpy.concatenate(values) if len(values) > 0 else numpy.array([])
+
+        if name in TIME_COLUMNS:
+            # Parquet may store timestamps with a higher precision:
+            missing = numpy.isnat(values)
+            values = values.astype('datetime64[s]').astype(numpy.int64)
+            values[missing] = NO_TIME
+
+        columns[name] = values.astype(dtype)
+
+    for name in DICTIONARY_COLUMNS:
+        columns[name], columns['%s_dictionary' % name] = _read_dictionary_column(table.column(name).chunks)
+
+    return columns
+
+
+def _read_dictionary_column(chunks):
+    """
+    Combine the chunks of a dictionary encoded Parquet column. Every chunk may
+    have its own dictionary, the codes are translated to a single sorted dictionary.
+    """
+
+    chunk_dictionaries = []
+    chunk_codes = []
+
+    for chunk in chunks:
+        if isinstance(chunk, pyarrow.DictionaryArray):
+            chunk_dictionaries.append(numpy.array(chunk.dictionary.to_pylist(), dtype=numpy.unicode_))
+            chunk_codes.append(chunk.indices.to_numpy(zero_copy_only=False))
+        else:
+            codes, dictionary = dictionary_encode(chunk.to_pylist())
+            chunk_dictionaries.append(dictionary)
+            chunk_codes.append(codes)
+
+    if len(chunk_dictionaries) == 0:
+        return numpy.array([], dtype=numpy.int16), numpy.array([], dtype=numpy.unicode_)
+
+    return _merge_dictionaries(chunk_dictionaries, chunk_codes)
+
+
+def _merge_dictionaries(dictionaries, codes_list):
+    """
+    Translate codes for multiple dictionaries to codes for a single sorted dictionary
+    """
+
+    dictionary = numpy.unique(numpy.concatenate(dictionaries))
+    codes = numpy.concatenate([numpy.searchsorted(dictionary, item_dictionary)[item_codes]
+                               for item_dictionary, item_codes in zip(dictionaries, codes_list)])
+
+    return codes.astype(_get_code_type(dictionary)), dictionary
+
+
+def load_date(directory, service_date):
+    """
+    Load the exported columns for a service date
+    :param directory: export directory
+    :param service_date: service date (datetime.date)
+    :return: dict of columns, or None when the service date is not exported
+    """
+
+    for export_format in [FORMAT_PARQUET, FORMAT_NUMPY]:
+        filename = get_filename(directory, service_date, export_format)
+
+        if os.path.exists(filename) and (export_format == FORMAT_NUMPY or pyarrow is not None):
+            return read_columns(filename)
+
+    return None
+
+
+def load_dates(directory, start_date, end_date):
+    """
+    Load and combine the exported columns for a range of service dates.
+    Service dates which are not exported are skipped.
+    :param directory: export directory
+    :param start_date: first service date (datetime.date)
+    :param end_date: last service date (datetime.date, inclusive)
+    :return: dict of columns, or None when none of the service dates is exported
+    """
+
+    columns_list = []
+    service_date = start_date
+
+    while service_date <= end_date:
+        columns = load_date(directory, service_date)
+        if columns is not None:
+            columns_list.append(columns)
+
+        service_date += datetime.timedelta(days=1)
+
+    if len(columns_list) == 0:
+        return None
+
+    return concatenate_columns(columns_list)
+
+
+def concatenate_columns(columns_list):
+    """
+    Combine columns of multiple exports. Dictionary encoded columns are
+    translated to a single sorted dictionary.
+    :param columns_list: list of dicts of columns
+    :return: dict of columns
+    """
+
+    columns = {}
+
+    for name, dtype in COLUMNS:
+        columns[name] = numpy.concatenate([item[name] for item in columns_list]).astype(dtype)
+
+    for name in DICTIONARY_COLUMNS:
+        key = '%s_dictionary' % name
+        columns[name], columns[key] = _merge_dictionaries([item[key] for item in columns_list],
+                                                          [item[name] for item in columns_list])
+
+    return columns
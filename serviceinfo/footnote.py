@@ -0,0 +1,147 @@
+"""
+IFF footnotes
+
+An IFF footnote describes on which days of the delivery period a service runs.
+Footnotes are stored as packed bitmaps (one bit per day, starting at the first
+day of the delivery) instead of one row per footnote and day, which allows
+checking whether a footnote is active on a date in constant time.
+"""
+
+import datetime
+
+def pack_days(days):
+    """
+    Pack a list of booleans (one for each day) into a bitmap.
+    Day n is stored in bit (n % 8) of byte (n // 8).
+
+    Args:
+        days (list): List of booleans, True for days on which the footnote is active
+
+    Returns:
+        str: Packed bitmap
+    """
+
+    bitmap = bytearray((len(days) + 7) // 8)
+
+    for day, active in enumerate(days):
+        if active:
+            bitmap[day >> 3] |= 1 << (day & 7)
+
+    return str(bitmap)
+
+
+def is_day_active(bitmap, day):
+    """
+    Check whether a day is set in a packed bitmap.
+
+    Args:
+        bitmap (str): Packed bitmap, as returned by pack_days()
+        day (int): Day number (0 for the first day of the bitmap)
+
+    Returns:
+        bool: True when the day is set, False otherwise
+        (including days outside the bitmap)
+    """
+
+    if day < 0 or (day >> 3) >= len(bitmap):
+        return False
+
+    return (ord(bitmap[day >> 3]) >> (day & 7)) & 1 == 1
+
+
+class Footnotes(object):
+    """
+    Collection of footnote bitmaps, keyed by footnote number.
+    """
+
+    footnotes = None
+
+    def __init__(self):
+        self.footnotes = {}
+
+    def add(self, footnote, first_day, bitmap):
+        """
+        Add a footnote.
+
+        Args:
+            footnote (int): Footnote number
+            first_day (datetime.date): Date of the first day in the bitmap
+            bitmap (str): Packed bitmap, as returned by pack_days()
+        """
+
+        self.footnotes[footnote] = (first_day, bitmap)
+
+    def is_active(self, footnote, service_date):
+        """
+        Check whether a footnote is active on a service date.
+
+        Args:
+            footnote (int): Footnote number
+            service_date (datetime.date): Service date
+
+        Returns:
+            bool: True when the footnote is active, False when it is not
+            active or the footnote is unknown
+        """
+
+        if footnote not in self.footnotes:
+            return False
+
+        first_day, bitmap = self.footnotes[footnote]
+        return is_day_active(bitmap, (service_date - first_day).days)
+
+    def get_active_footnotes(self, service_date):
+        """
+        Retrieve all footnotes which are active on a service date.
+
+        Args:
+            service_date (datetime.date): Service date
+
+        Returns:
+            list: Sorted list of footnote numbers
+        """
+
+        return sorted(footnote for footnote in self.footnotes
+                      if self.is_active(footnote, service_date))
+
+    def get_active_dates(self, footnote):
+        """
+        Retrieve all dates on which a footnote is active.
+
+        Args:
+            footnote (int): Footnote number
+
+        Returns:
+            list: Sorted list of datetime.date objects, empty when
+            the footnote is unknown
+        """
+
+        if footnote not in self.footnotes:
+            return []
+
+        first_day, bitmap = self.footnotes[footnote]
+        return [first_day + datetime.timedelta(days=day) for day in range(len(bitmap) * 8)
+                if is_day_active(bitmap, day)]
+
+    def get_changed_dates(self, other):
+        """
+        Compare these footnotes with other footnotes (e.g. of a new delivery).
+
+        Args:
+            other (Footnotes): Footnotes to compare with
+
+        Returns:
+            list: Sorted list of datetime.date objects on which at least one
+            footnote is active in only one of both collections
+        """
+
+        dates = set()
+
+        for footnote in set(self.footnotes) | set(other.footnotes):
+            if self.footnotes.get(footnote) != other.footnotes.get(footnote):
+                dates.update(set(self.get_active_dates(footnote)) ^ set(other.get_active_dates(footnote)))
+
+        return sorted(dates)
+
+    def __len__(self):
+        return len(self.footnotes)
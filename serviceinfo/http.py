@@ -7,24 +7,185 @@ HTTP requests and automatic conversion from dicts to JSON.
 
 import bottle
 import isodate
+import itertools
 import json
+import threading
+import time
+import zlib
 from bottle import abort, response, error
 
 from serviceinfo import service_store, common, util, iff, service_filter
 
+# Maximum number of services in a single batch request:
+MAX_BATCH_SIZE = 250
+
+# Maximum number of service numbers in a single page:
+MAX_PAGE_SIZE = 1000
+
+# Interval (in seconds) for heartbeats in the change feed:
+CHANGES_HEARTBEAT = 15
+
+# Fields available for each stop:
+STOP_FIELDS = frozenset(['station', 'station_name', 'arrival_time', 'departure_time',
+                         'scheduled_arrival_platform', 'actual_arrival_platform',
+                         'scheduled_departure_platform', 'actual_departure_platform',
+                         'arrival_delay', 'departure_delay', 'cancelled_arrival',
+                         'cancelled_departure', 'servicenumber'])
+
+# Pool of IFF connections and cache of IFF lookups, used for the IFF fallback.
+# Both are initialized on first use:
+_iff_pool = None
+_iff_cache = None
+_iff_lock = threading.Lock()
+
+
+class CompressionPlugin(object):
+    """
+    Bottle plugin which encodes dicts returned by a route to JSON and
+    compresses the response with gzip or deflate when the client supports it
+    and the response is larger than a given size.
+    """
+
+    name = 'compression'
+    api = 2
+
+    min_size = None
+    level = None
+
+    def __init__(self, min_size=None, level=None):
+        """
+        Settings which are not given are read from the configuration
+        when the plugin is applied to a route.
+
+        Args:
+            min_size (int, optional): Minimum response size (in bytes) to compress
+            level (int, optional): Compression level (1-9)
+        """
+
+        self.min_size = min_size
+        self.level = level
+
+    def apply(self, callback, route):
+        compression_config = _get_compression_config()
+
+        if self.min_size is None:
+            self.min_size = compression_config['min_size']
+        if self.level is None:
+            self.level = compression_config['level']
+
+        def wrapper(*args, **kwargs):
+            result = callback(*args, **kwargs)
+
+            if not isinstance(result, dict):
+                return result
+
+            body = json.dumps(result)
+            response.content_type = 'application/json'
+
+            if len(body) < self.min_size:
+                return body
+
+            # The response depends on Accept-Encoding, also when it is not compressed:
+            response.add_header('Vary', 'Accept-Encoding')
+
+            encoding = _get_accepted_encoding(bottle.request.headers.get('Accept-Encoding', ''))
+            if encoding is None:
+                return body
+
+            response.set_header('Content-Encoding', encoding)
+
+            return compress(body, encoding, self.level)
+
+        return wrapper
+
+
+def compress(body, encoding, level=6):
+    """
+    Compress a response body.
+
+    Args:
+        body (string): Response body
+        encoding (string): 'gzip' or 'deflate'
+        level (int, optional): Compression level (1-9)
+
+    Returns:
+        string: compressed body
+    """
+
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = zlib.compressobj(level)
+
+    return compressor.compress(body) + compressor.flush()
+
+
+def _get_accepted_encoding(accept_encoding):
+    """
+    Determine the preferred supported encoding from an Accept-Encoding header.
+
+    Returns:
+        string: 'gzip', 'deflate' or None when compression is not accepted
+    """
+
+    accepted = set()
+
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        encoding = parts[0].strip().lower()
+
+        # Ignore encodings with q=0:
+        if len(parts) > 1 and parts[1].strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+
+        accepted.add(encoding)
+
+    for encoding in ('gzip', 'deflate'):
+        if encoding in accepted:
+            return encoding
+
+    return None
+
+
+def _get_compression_config():
+    """
+    Retrieve the compression configuration, with defaults for
+    missing settings.
+
+    Returns:
+        dict: dictionary with min_size and level
+    """
+
+    compression_config = {'min_size': 1024, 'level': 6}
+
+    if 'http' in common.configuration and 'compression' in common.configuration['http']:
+        compression_config.update(common.configuration['http']['compression'])
+
+    return compression_config
+
+
+bottle.install(CompressionPlugin())
+
 
 @bottle.route('/service/<servicedate>')
 def get_services(servicedate):
     """
-    Retrieve a list of all services on a given date
+    Retrieve a list of all services on a given date.
+    The list is sorted numerically and streamed, unless a page is requested
+    with the 'limit' (and optionally 'cursor') parameter. Lists are always
+    sorted, so the 'sort' parameter is not needed anymore.
     """
 
     # Prepare the store and store_type:
     store, store_type = _prepare_lookup()
-    services = store.get_service_numbers(servicedate, store_type)
 
-    # Send list:
-    return _send_servicenumbers_list(services)
+    # Send a single page when requested:
+    if bottle.request.query.limit:
+        return _send_servicenumbers_page(store, store_type, servicedate)
+
+    # Stream complete list:
+    response.content_type = 'application/json'
+    return _stream_servicenumbers_list(store.iter_service_numbers(servicedate, store_type))
 
 
 def _prepare_lookup():
@@ -52,23 +213,120 @@ def _prepare_lookup():
     return (store, store_type)
 
 
-def _send_servicenumbers_list(services):
+def _send_servicenumbers_page(store, store_type, servicedate):
+    """
+    Send a single page of the sorted list of services.
+    Aborts with a 400 error when the page size is invalid.
+
+    Returns:
+        dict: dictionary with services list and cursor for the next page
+    """
+
+    try:
+        limit = int(bottle.request.query.limit)
+    except ValueError:
+        limit = 0
+
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        abort(400, "Limit must be a number between 1 and %s" % MAX_PAGE_SIZE)
+
+    cursor = bottle.request.query.cursor or None
+    services, next_cursor = store.get_service_numbers_page(servicedate, store_type, cursor, limit)
+
+    return {'services': services, 'next_cursor': next_cursor}
+
+
+def _stream_servicenumbers_list(services, chunk_size=500):
     """
-    Send a list of services, sort list when requested.
+    Encode a list of services as JSON, yielding the output in chunks.
 
     Args:
-        services (list): List of services (as dictionary)
+        services (iterator): Service numbers
+        chunk_size (int, optional): Number of services per chunk
+
+    Returns:
+        iterator: JSON document with services list, split in chunks
+    """
+
+    yield '{"services": ['
+
+    first = True
+    for chunk in iter(lambda: list(itertools.islice(services, chunk_size)), []):
+        encoded = ', '.join(json.dumps(servicenumber) for servicenumber in chunk)
+
+        if first:
+            first = False
+            yield encoded
+        else:
+            yield ', ' + encoded
+
+    yield ']}'
+
+
+@bottle.route('/services/<servicedate>', method='POST')
+def get_services_details(servicedate):
+    """
+    Retrieve information about multiple services in one request.
+    The request body must be a JSON list of service numbers, or a JSON object
+    with the list of service numbers in 'services'.
+    Services not found in the service store are looked up in the IFF database.
+    """
+
+    service_numbers = _get_request_service_numbers()
+    fields, compact = _get_output_options()
+
+    store, store_type = _prepare_lookup()
+    services = store.get_services(servicedate, service_numbers, store_type)
+
+    # Look up services not found in Redis in the IFF database:
+    missing = [number for number in service_numbers if services[number] is None]
+    if len(missing) > 0:
+        services.update(_get_iff_services_batch(servicedate, missing))
+
+    data = {
+        'services': {},
+        'not_found': []
+    }
+
+    for service_number in service_numbers:
+        if services[service_number] is None or len(services[service_number]) == 0:
+            data['not_found'].append(service_number)
+        else:
+            data['services'][service_number] = services_to_dict(services[service_number], fields, compact)['services']
+
+    return data
+
+
+def _get_request_service_numbers():
+    """
+    Retrieve the list of service numbers from the request body.
+    Aborts with a 400 error when the request body is invalid.
 
     Returns:
-        dict: dictionary with services list
+        list: List of unique service numbers (as string)
     """
 
-    # Sort list when requested:
-    if bottle.request.query.sort == 'true':
-        services = sorted(services)
+    try:
+        request_data = bottle.request.json
+    except ValueError:
+        request_data = None
+
+    if isinstance(request_data, dict):
+        request_data = request_data.get('services')
+
+    if not isinstance(request_data, list):
+        abort(400, "Request body must be a list of service numbers")
 
-    # Return dict with list of services:
-    return {'services': services}
+    if len(request_data) > MAX_BATCH_SIZE:
+        abort(400, "Too many services requested (maximum is %s)" % MAX_BATCH_SIZE)
+
+    service_numbers = []
+    for service_number in request_data:
+        service_number = str(service_number)
+        if service_number not in service_numbers:
+            service_numbers.append(service_number)
+
+    return service_numbers
 
 
 @bottle.route('/service/<servicedate>/<service_number>')
@@ -82,33 +340,338 @@ def get_service_details(servicedate, service_number):
 
     # If service is not found in Redis, look it up in IFF database:
     if services is None:
-        iff_source = iff.IffSource(common.configuration['iff_database'])
-        servicedate_iso = isodate.isodates.parse_date(servicedate)
+        services = _get_iff_services(servicedate, service_number)
+
+    # Return 404 error when service cannot be found
+    if services is None or len(services) == 0:
+        abort(404, "Service not found")
+
+    # Return parsed dict when service is found
+    fields, compact = _get_output_options()
+    return services_to_dict(services, fields, compact)
+
+
+@bottle.route('/changes')
+def get_changes():
+    """
+    Push feed of service changes as server-sent events.
+    Events can be filtered with the 'service', 'station' and 'company'
+    parameters (comma separated lists), and with 'type' (actual or scheduled).
+    """
+
+    store = service_store.ServiceStore(common.configuration['schedule_store'])
+    change_filter = _get_change_filter()
+
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+
+    return _stream_changes(store.listen_changes(CHANGES_HEARTBEAT), change_filter)
+
+
+def _get_change_filter():
+    """
+    Construct a filter for change events from the request parameters.
+
+    Returns:
+        dict: dictionary with sets of service numbers, stations, companies
+            and store types (a set is None when not filtered)
+    """
+
+    change_filter = {}
+
+    for parameter in ['service', 'station', 'company', 'type']:
+        value = bottle.request.query.get(parameter)
+
+        if value:
+            change_filter[parameter] = set(item.strip().lower() for item in value.split(','))
+        else:
+            change_filter[parameter] = None
+
+    return change_filter
+
+
+def _match_change(event, change_filter):
+    """
+    Returns True when a change event matches all given filter conditions.
+    """
+
+    if change_filter['service'] is not None and event['service_number'].lower() not in change_filter['service']:
+        return False
+
+    if change_filter['type'] is not None and event['type'] not in change_filter['type']:
+        return False
 
-        service_id = iff_source.get_service_id_for_service_number(service_number, servicedate_iso)
+    if change_filter['company'] is not None:
+        if event['company'] is None or event['company'].lower() not in change_filter['company']:
+            return False
+
+    if change_filter['station'] is not None:
+        if len(change_filter['station'].intersection(stop.lower() for stop in event['stops'])) == 0:
+            return False
+
+    return True
+
+
+def _stream_changes(events, change_filter, heartbeat=CHANGES_HEARTBEAT):
+    """
+    Encode change events as server-sent events. A heartbeat comment is sent
+    when nothing was sent during the heartbeat interval, also when events are
+    published but do not match the filter. This keeps the connection alive
+    through proxies and detects disconnected clients.
+
+    Args:
+        events (iterator): change events, None when no change was
+            published within the heartbeat interval
+        change_filter (dict): filter constructed by _get_change_filter()
+        heartbeat (float, optional): heartbeat interval in seconds
+
+    Returns:
+        iterator: server-sent events
+    """
+
+    # Send a comment first, so headers are sent directly:
+    yield ': connected\n\n'
+    last_write = time.time()
+
+    for event in events:
+        if event is not None and _match_change(event, change_filter):
+            yield 'id: %s\nevent: %s\ndata: %s\n\n' % (event['version'], event['action'], json.dumps(event))
+            last_write = time.time()
+        elif event is None or time.time() - last_write >= heartbeat:
+            yield ': heartbeat\n\n'
+            last_write = time.time()
+
+
+def _get_output_options():
+    """
+    Determine the output options for service details from the request
+    parameters 'fields' (comma separated list of stop fields) and 'compact'.
+    Aborts with a 400 error when an unknown field is requested.
+
+    Returns:
+        tuple: set of stop fields (None for all fields), compact (bool)
+    """
+
+    fields = None
+
+    if bottle.request.query.fields:
+        fields = set(field.strip() for field in bottle.request.query.fields.split(','))
+
+        unknown_fields = fields - STOP_FIELDS
+        if len(unknown_fields) > 0:
+            abort(400, "Unknown field(s): %s" % ', '.join(sorted(unknown_fields)))
+
+    compact = (bottle.request.query.compact == 'true')
+
+    return fields, compact
+
+
+def _get_iff_fallback_config():
+    """
+    Retrieve the IFF fallback configuration, with defaults for
+    missing settings.
+
+    Returns:
+        dict: dictionary with pool_size, cache_ttl and cache_size
+    """
+
+    fallback_config = {'pool_size': 4, 'cache_ttl': 300, 'cache_size': 10000}
+
+    if 'http' in common.configuration and 'iff_fallback' in common.configuration['http']:
+        fallback_config.update(common.configuration['http']['iff_fallback'])
+
+    return fallback_config
+
+
+def _get_iff_pool():
+    """
+    Retrieve the IFF connection pool, create it when needed.
+
+    Returns:
+        serviceinfo.iff.IffSourcePool: IFF connection pool
+    """
+
+    global _iff_pool
+
+    with _iff_lock:
+        if _iff_pool is None:
+            _iff_pool = iff.IffSourcePool(common.configuration['iff_database'],
+                                          _get_iff_fallback_config()['pool_size'])
+
+    return _iff_pool
+
+
+def _get_iff_cache():
+    """
+    Retrieve the IFF lookup cache, create it when needed.
+
+    Returns:
+        LookupCache: cache for IFF lookups
+    """
+
+    global _iff_cache
+
+    with _iff_lock:
+        if _iff_cache is None:
+            fallback_config = _get_iff_fallback_config()
+            _iff_cache = LookupCache(fallback_config['cache_ttl'], fallback_config['cache_size'])
+
+    return _iff_cache
+
+
+def _get_iff_services(servicedate, service_number):
+    """
+    Look up a service in the IFF database. Both found and not found
+    (or filtered) services are cached, so repeated lookups for the same
+    service do not query the IFF database again until the cache expires.
+
+    Args:
+        servicedate (string): Service date (YYYY-MM-DD)
+        service_number (string): Service number
+
+    Returns:
+        list: List of services allowed by the scheduler filter (may be empty)
+    """
+
+    return _get_iff_services_batch(servicedate, [service_number])[service_number]
+
+
+def _get_iff_services_batch(servicedate, service_numbers):
+    """
+    Look up multiple services in the IFF database. Service numbers which are
+    not in the cache are translated to service IDs with a single query, and
+    the details of all these services are retrieved with a single query.
+
+    Args:
+        servicedate (string): Service date (YYYY-MM-DD)
+        service_numbers (list): List of service numbers
+
+    Returns:
+        dict: Dictionary with service number as key and a list of services
+            allowed by the scheduler filter as value (may be empty)
+    """
+
+    cache = _get_iff_cache()
+    services = {}
+    missing = []
+
+    for service_number in service_numbers:
+        cached = cache.get((servicedate, str(service_number)))
+        if cached is not None:
+            services[service_number] = cached
+        else:
+            missing.append(service_number)
+
+    if len(missing) == 0:
+        return services
+
+    servicedate_iso = isodate.isodates.parse_date(servicedate)
+    is_included = service_filter.ServiceFilter(common.configuration['scheduler']['filter'])
+
+    with _get_iff_pool().source() as iff_source:
+        service_ids = iff_source.get_service_ids_for_service_numbers(missing, servicedate_iso)
+
+        # Translate keys to strings, IFF returns integer service numbers:
+        service_ids = dict((str(number), service_id) for number, service_id in service_ids.items())
 
         # Get services:
-        iff_services = iff_source.get_service_details(service_id, servicedate_iso)
+        service_details = iff_source.get_service_details_batch(list(set(service_ids.values())), servicedate_iso)
 
-        # Found some services in IFF, check whether they can be returned:
-        if iff_services is not None and len(iff_services) > 0:
-            filter_config = common.configuration['scheduler']['filter']
-            services = []
+        for service_number in missing:
+            services[service_number] = []
 
-            for iff_service in iff_services:
-                # Set source to 'iff':
-                iff_service.source = 'iff'
+            service_id = service_ids.get(str(service_number))
+            if service_id is None:
+                cache.set((servicedate, str(service_number)), [])
+                continue
 
-                # Check whether these services are allowed:
-                if service_filter.is_service_included(iff_service, filter_config):
-                    services.append(iff_service)
+            iff_services = service_details[service_id]
 
-    # Return 404 error when service cannot be found
-    if services is None or len(services) == 0:
-        abort(404, "Service not found")
+            # Found some services in IFF, check whether they can be returned:
+            if iff_services is not None:
+                for iff_service in iff_services:
+                    # Set source to 'iff':
+                    iff_service.source = 'iff'
 
-    # Return parsed dict when service is found
-    return services_to_dict(services)
+                    # Check whether these services are allowed:
+                    if is_included(iff_service):
+                        services[service_number].append(iff_service)
+
+            cache.set((servicedate, str(service_number)), services[service_number])
+
+    return services
+
+
+class LookupCache(object):
+    """
+    Simple in-memory cache with a fixed time to live for each entry.
+    Used to remember the results of IFF fallback lookups.
+    """
+
+    ttl = None
+    size = None
+    entries = None
+    lock = None
+
+    def __init__(self, ttl, size):
+        """
+        Initialize the cache.
+
+        Args:
+            ttl (int): Time to live for each entry (in seconds)
+            size (int): Maximum number of entries
+        """
+
+        self.ttl = ttl
+        self.size = size
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Retrieve an entry from the cache.
+
+        Returns:
+            Cached value, or None when the key is not cached or expired
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+
+            return entry[1]
+
+    def set(self, key, value):
+        """
+        Store an entry in the cache. When the cache is full, expired entries
+        are removed first. If the cache is still full, it is emptied.
+        """
+
+        with self.lock:
+            now = time.time()
+
+            if len(self.entries) >= self.size:
+                for expired_key in [k for k, v in self.entries.items() if v[0] < now]:
+                    del self.entries[expired_key]
+
+                if len(self.entries) >= self.size:
+                    self.entries.clear()
+
+            self.entries[key] = (now + self.ttl, value)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+
+        with self.lock:
+            self.entries.clear()
 
 
 @error(404)
@@ -121,9 +684,25 @@ def error404(error_object):
     return json.dumps({'error': '404', 'message': error_object.body})
 
 
-def services_to_dict(services):
+@error(400)
+def error400(error_object):
+    """
+    400 JSON error
+    """
+
+    response.content_type = 'application/json'
+    return json.dumps({'error': '400', 'message': error_object.body})
+
+
+def services_to_dict(services, fields=None, compact=False):
     """
     Internal method to convert a Service object to a dictionary.
+
+    Args:
+        services (list): List of Service objects
+        fields (set, optional): Stop fields to include (default: all fields)
+        compact (bool, optional): When True, stop times are returned as
+            offsets (in seconds) from the first departure of the service
     """
 
     data = {
@@ -140,29 +719,48 @@ def services_to_dict(services):
             'company': service.company_code,
             'company_name': service.company_name,
             'servicedate': service.get_servicedate_str(),
-            'stops': service_stops_to_dict(service.stops),
             'destination': service.get_destination_str(),
             'source': service.source
         }
 
+        reference_time = None
+        if compact:
+            reference_time = _get_reference_time(service.stops)
+            service_data['first_departure'] = util.datetime_to_iso(reference_time)
+
+        service_data['stops'] = service_stops_to_dict(service.stops, fields, reference_time)
+
         data['services'].append(service_data)
 
     return data
 
 
-def service_stops_to_dict(stops):
+def service_stops_to_dict(stops, fields=None, reference_time=None):
     """
     Internal method to convert a list of ServiceStop object to a dictionary.
+
+    Args:
+        stops (list): List of ServiceStop objects
+        fields (set, optional): Stop fields to include (default: all fields)
+        reference_time (datetime, optional): When set, arrival and departure
+            times are returned as offset (in seconds) from reference_time
     """
 
     data = []
 
     for stop in stops:
+        if reference_time is None:
+            arrival_time = util.datetime_to_iso(stop.arrival_time)
+            departure_time = util.datetime_to_iso(stop.departure_time)
+        else:
+            arrival_time = _get_time_offset(stop.arrival_time, reference_time)
+            departure_time = _get_time_offset(stop.departure_time, reference_time)
+
         stop_data = {
             'station': stop.stop_code,
             'station_name': stop.stop_name,
-            'arrival_time': util.datetime_to_iso(stop.arrival_time),
-            'departure_time': util.datetime_to_iso(stop.departure_time),
+            'arrival_time': arrival_time,
+            'departure_time': departure_time,
             'scheduled_arrival_platform': stop.scheduled_arrival_platform,
             'actual_arrival_platform': stop.actual_arrival_platform,
             'scheduled_departure_platform': stop.scheduled_departure_platform,
@@ -174,6 +772,37 @@ def service_stops_to_dict(stops):
             'servicenumber': stop.servicenumber
         }
 
+        if fields is not None:
+            stop_data = dict((field, stop_data[field]) for field in fields)
+
         data.append(stop_data)
 
     return data
+
+
+def _get_reference_time(stops):
+    """
+    Determine the reference time for compact output: the departure time of
+    the first stop, or the first known time when the first stop has no
+    departure time.
+    """
+
+    for stop in stops:
+        for stop_time in (stop.departure_time, stop.arrival_time):
+            if stop_time is not None:
+                return stop_time
+
+    return None
+
+
+def _get_time_offset(stop_time, reference_time):
+    """
+    Returns the offset in seconds between stop_time and reference_time,
+    or None when stop_time is None.
+    """
+
+    if stop_time is None:
+        return None
+
+    offset = stop_time - reference_time
+    return offset.days * 86400 + offset.seconds
@@ -2,18 +2,46 @@
 Interaction with the IFF data source
 
 This module contains various methods for interacting with an IFF data source.
-It is assumed that the IFF data source is converted to a MySQL database.
+It is assumed that the IFF data source is converted to a MySQL database,
+or to a SQLite snapshot (see serviceinfo.iff_snapshot).
 """
 
 import MySQLdb
+import Queue
+import datetime
 import logging
+import os
 import pytz
+import sqlite3
+from contextlib import contextmanager
 
 import serviceinfo.data as data
+import serviceinfo.footnote as footnote
 import serviceinfo.util as util
 
 __logger__ = logging.getLogger(__name__)
 
+
+def get_iff_source(config):
+    """
+    Construct an IffSource for the given configuration.
+
+    Args:
+        config (dict): Configuration dictionary, containing either MySQL
+            connection information (host, user, password, database) or
+            the filename of a snapshot (snapshot).
+
+    Returns:
+        IffSource: IffSnapshotSource when a snapshot is configured,
+        otherwise an IffSource using MySQL.
+    """
+
+    if config.get('snapshot') is not None:
+        return IffSnapshotSource(config)
+    else:
+        return IffSource(config)
+
+
 class IffSource(object):
     """
     An IffSource object is used to interact with an IFF source.
@@ -22,6 +50,13 @@ class IffSource(object):
     timezone = None
     connection = None
 
+    # Number of services retrieved per query by iter_services_details_dates():
+    details_batch_size = 100
+
+    # Footnotes of the loaded dataset, and the version of the dataset:
+    footnotes = None
+    footnotes_version = None
+
     def __init__(self, config):
         """
         Construct an IffSource object and connect to MySQL.
@@ -38,16 +73,30 @@ class IffSource(object):
 
         self.connection.ping(True)
 
+        # Every query runs in its own transaction. This way no metadata locks
+        # are held between queries, which would block iff-loader.py from
+        # swapping in a new dataset, and the new dataset is used immediately:
+        self.connection.autocommit(True)
+
         # Always use Europe/Amsterdam as timezone (IFF times are local time)
         self.timezone = pytz.timezone('Europe/Amsterdam')
 
+    def close(self):
+        """
+        Close the MySQL connection.
+        """
+
+        self.connection.close()
 
-    def get_services_date(self, service_date):
+    def get_services_date(self, service_date, service_filter=None):
         """
         Retrieve all service ID's for the given service_date.
 
         Args:
             service_date (datetime.date): Service date
+            service_filter (serviceinfo.service_filter.ServiceFilter, optional):
+                Compiled filter, services which are excluded for certain
+                are left out in the query
 
         Returns:
             list: List of service ID's.
@@ -55,18 +104,96 @@ class IffSource(object):
 
         service_id = []
 
+        # Determine active footnotes from the bitmaps, instead of joining
+        # the footnote table (which has a row for every footnote and day):
+        footnotes = self.get_footnotes().get_active_footnotes(service_date)
+
+        if len(footnotes) == 0:
+            return service_id
+
+        query, params = self._get_validity_query('DISTINCT tv.serviceid', footnotes, service_filter)
+
         cursor = self.connection.cursor()
-        cursor.execute("""
-            SELECT DISTINCT ts.serviceid, f.servicedate FROM timetable_service ts
-            JOIN timetable_validity tv ON (ts.serviceid = tv.serviceid)
-            JOIN footnote f ON (tv.footnote = f.footnote)
-            WHERE f.servicedate = %s;""", [service_date.strftime('%Y-%m-%d')])
+        cursor.execute(query, params)
 
         for row in cursor:
             service_id.append(row[0])
 
         return service_id
 
+    def _get_validity_query(self, columns, footnotes, service_filter):
+        """
+        Query for services which are valid with one of the given footnotes,
+        leaving out services which are excluded by the service filter.
+
+        Returns:
+            tuple: Query and list of parameters
+        """
+
+        query = """
+            SELECT %s FROM timetable_validity tv
+            WHERE tv.footnote IN (%s)""" % (columns, _get_placeholders(footnotes))
+        params = list(footnotes)
+
+        filter_condition = None
+        if service_filter is not None:
+            filter_condition = _get_filter_condition(service_filter)
+
+        if filter_condition is not None:
+            query += '\n            AND %s' % filter_condition[0]
+            params.extend(filter_condition[1])
+
+        return query + ';', params
+
+    def get_footnotes(self):
+        """
+        Retrieve the footnote bitmaps. The footnotes are cached until
+        another dataset is loaded.
+
+        Returns:
+            serviceinfo.footnote.Footnotes: Footnotes, which can be used
+            to check whether a footnote is active on a service date.
+        """
+
+        version = self._get_dataset_version()
+
+        if self.footnotes is not None and version is not None and version == self.footnotes_version:
+            return self.footnotes
+
+        footnotes = footnote.Footnotes()
+
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT footnote, firstday, days FROM footnote_bitmap;""")
+
+        for row in cursor:
+            footnotes.add(row[0], row[1], str(row[2]))
+
+        self.footnotes = footnotes
+        self.footnotes_version = version
+
+        return footnotes
+
+    def _get_dataset_version(self):
+        """
+        Identify the loaded dataset by its delivery, which is replaced
+        together with the footnotes when a new delivery is loaded.
+
+        Returns:
+            tuple: Delivery rows, or None when the delivery is unknown
+        """
+
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT company, firstday, lastday, versionnumber, description FROM delivery;""")
+
+        version = tuple(tuple(row) for row in cursor.fetchall())
+
+        if len(version) == 0:
+            return None
+
+        return version
+
     def get_service_id_for_service_number(self, servicenumber, service_date):
         """
         Retrieve the service ID for a given servicenumber on a given service_date.
@@ -97,6 +224,45 @@ class IffSource(object):
 
         return service_id
 
+    def get_service_ids_for_service_numbers(self, servicenumbers, service_date):
+        """
+        Retrieve the service ID's for a list of servicenumbers on a given
+        service_date, using a single query.
+        This method does not work for variant numbers.
+
+        Args:
+            servicenumbers (list): List of service numbers
+            service_date (datetime.date): Service date
+
+        Returns:
+            dict: Dictionary with servicenumber as key and service ID as value.
+            Servicenumbers which are not found are omitted.
+        """
+
+        service_ids = {}
+
+        if len(servicenumbers) == 0:
+            return service_ids
+
+        footnotes = self.get_footnotes().get_active_footnotes(service_date)
+
+        if len(footnotes) == 0:
+            return service_ids
+
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT DISTINCT t_sv.serviceid, t_sv.servicenumber FROM timetable_service t_sv
+            JOIN timetable_validity tv ON (t_sv.serviceid = tv.serviceid)
+            WHERE tv.footnote IN (%s)
+            AND t_sv.servicenumber IN (%s);""" % (', '.join(['%s'] * len(footnotes)),
+                                                 ', '.join(['%s'] * len(servicenumbers))),
+                       footnotes + list(servicenumbers))
+
+        for row in cursor:
+            service_ids[row[1]] = row[0]
+
+        return service_ids
+
     def get_service_details(self, service_id, service_date):
         """
         Get all service information for a given service_id on a service_date.
@@ -111,8 +277,63 @@ class IffSource(object):
             has multiple servicenumbers.
         """
 
-        servicenumbers = []
-        services = []
+        rows = self._get_details_rows('ts.serviceid = %s AND f_s.servicedate = %s', [service_id, service_date])
+
+        if len(rows) == 0:
+            return None
+
+        # Get attributes for this service:
+        attributes = self._get_service_attributes(service_id)
+
+        return self._get_services(service_id, service_date, rows.values()[0], attributes)
+
+    def get_service_details_batch(self, service_ids, service_date):
+        """
+        Get all service information for multiple service_ids on a
+        service_date, using one query for the stops and one query for
+        the attributes of all services.
+
+        Args:
+            service_ids (list): List of service ID's (not the servicenumber)
+            service_date (datetime.date): Service date
+
+        Returns:
+            dict: Dictionary with service ID as key and a list of
+            serviceinfo.data.Service objects as value. The value is None
+            for services which are not found.
+        """
+
+        services = dict((service_id, None) for service_id in service_ids)
+
+        if len(service_ids) == 0:
+            return services
+
+        condition = 'ts.serviceid IN (%s) AND f_s.servicedate = %%s' % _get_placeholders(service_ids)
+        rows = self._get_details_rows(condition, list(service_ids) + [service_date])
+
+        attributes = self._get_services_attributes(rows.keys())
+
+        for service_id, service_rows in rows.items():
+            services[service_id] = self._get_services(service_id, service_date, service_rows,
+                                                      attributes.get(service_id, []))
+
+        return services
+
+    def _get_details_rows(self, condition, params):
+        """
+        Retrieve the stops of services, with their platforms, transport modes
+        and companies, which are used by _get_services() to create Service
+        objects. All service details are retrieved with this query.
+
+        Args:
+            condition (string): SQL condition on the stop (ts), the service
+                number (t_sv) and the service date (f_s.servicedate)
+            params (list): Parameters for the condition
+
+        Returns:
+            dict: Dictionary with service ID as key and the rows of the
+            service, ordered by stop, as value
+        """
 
         cursor = self.connection.cursor()
         cursor.execute("""
@@ -135,23 +356,31 @@ class IffSource(object):
                 ON (tt.serviceid = ts.serviceid AND tt.firststop <= ts.idx AND tt.laststop >= ts.idx)
             LEFT JOIN trnsmode tm ON (tt.transmode = tm.code)
             LEFT JOIN company c ON (t_sv.companynumber = c.company)
-            WHERE
-                ts.serviceid = %s
-                AND f_s.servicedate = %s
-            ORDER BY ts.idx;""", [service_id, service_date])
+            WHERE %s
+            ORDER BY ts.serviceid, ts.idx;""" % condition, params)
 
-        if cursor.rowcount == 0:
-            return None
+        # Group rows by service ID:
+        rows = {}
+        for row in cursor.fetchall():
+            rows.setdefault(row[0], []).append(row)
+
+        return rows
+
+    def _get_services(self, service_id, service_date, rows, attributes):
+        """
+        Create Service objects for a service on a service date from the rows
+        returned by the query in get_service_details().
+        """
+
+        servicenumbers = []
+        services = []
 
         metadata_set = False
         servicenumber = 0
         stops = []
 
-        # Get attributes for this service:
-        attributes = self._get_service_attributes(service_id)
-
         # Retrieve all stops for this service:
-        for row in cursor:
+        for row in rows:
             servicenumber = row[1]
 
             if servicenumber == 0 and row[2] > 0 and row[2] != '':
@@ -234,6 +463,35 @@ class IffSource(object):
 
         return attributes
 
+    def _get_services_attributes(self, service_ids):
+        """
+        Retrieve the attributes of multiple services with one query.
+
+        Returns:
+            dict: Dictionary with service ID as key and a list of attributes
+            (as returned by _get_service_attributes()) as value
+        """
+
+        attributes = {}
+
+        if len(service_ids) == 0:
+            return attributes
+
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT ta.code, a.description, a.processingcode, ta.firststop, ta.laststop, ta.serviceid
+            FROM timetable_attribute ta
+            JOIN trnsattr a ON ta.code = a.code
+            WHERE ta.serviceid IN (%s)
+            """ % _get_placeholders(service_ids), list(service_ids))
+
+        for row in cursor:
+            attribute_object = data.Attribute(row[0], row[1])
+            attribute_object.processing_code = row[2]
+            attributes.setdefault(row[5], []).append((row[3], row[4], attribute_object))
+
+        return attributes
+
     def get_services_details(self, service_ids, service_date):
         """
         Get all service information for a list of service_ids on a
@@ -258,6 +516,78 @@ class IffSource(object):
         return services
 
 
+    def iter_services_details_dates(self, service_dates, service_filter=None):
+        """
+        Get all service information for all services on multiple service dates.
+        The stops of every service are retrieved once, on the first service date
+        on which the service runs, and applied to all its service dates.
+        Services are retrieved in batches of details_batch_size.
+
+        Args:
+            service_dates (list): List of service dates (datetime.date)
+            service_filter (serviceinfo.service_filter.ServiceFilter, optional):
+                Compiled filter, services which are excluded for certain
+                are not retrieved
+
+        Returns:
+            iterator: Iterator over serviceinfo.data.Service objects,
+            for every service on every service date.
+        """
+
+        footnotes = self.get_footnotes()
+
+        # Active footnotes on every service date:
+        active = dict((service_date, set(footnotes.get_active_footnotes(service_date)))
+                      for service_date in service_dates)
+        all_active = sorted(set().union(*active.values()))
+
+        if len(all_active) == 0:
+            return
+
+        # Footnotes for every service:
+        service_footnotes = {}
+
+        query, params = self._get_validity_query('tv.serviceid, tv.footnote', all_active, service_filter)
+
+        cursor = self.connection.cursor()
+        cursor.execute(query, params)
+
+        for row in cursor:
+            service_footnotes.setdefault(row[0], set()).add(row[1])
+
+        __logger__.info('Found %s scheduled services on %s service dates',
+                        len(service_footnotes), len(service_dates))
+
+        service_ids = sorted(service_footnotes)
+
+        for offset in range(0, len(service_ids), self.details_batch_size):
+            batch = service_ids[offset:offset + self.details_batch_size]
+
+            # Service dates of every service, the stops are equal on all dates:
+            dates = {}
+            first_dates = {}
+            for service_id in batch:
+                dates[service_id] = [service_date for service_date in sorted(service_dates)
+                                     if len(service_footnotes[service_id] & active[service_date]) > 0]
+                first_dates.setdefault(dates[service_id][0], []).append(service_id)
+
+            rows = {}
+            for first_date, first_date_ids in first_dates.items():
+                condition = 'ts.serviceid IN (%s) AND f_s.servicedate = %%s' % _get_placeholders(first_date_ids)
+                rows.update(self._get_details_rows(condition, first_date_ids + [first_date]))
+
+            attributes = self._get_services_attributes(rows.keys())
+
+            for service_id in batch:
+                if service_id not in rows:
+                    __logger__.warning('Skipping service %s', service_id)
+                    continue
+
+                for service_date in dates[service_id]:
+                    for service in self._get_services(service_id, service_date, rows[service_id],
+                                                      attributes.get(service_id, [])):
+                        yield service
+
     def get_station_name(self, station_code):
         """
         Get a station name from the IFF database.
@@ -327,3 +657,324 @@ class IffSource(object):
             return None
 
         return cursor.fetchone()[0]
+
+
+def _get_filter_condition(service_filter):
+    """
+    Translate a compiled service filter to an SQL condition on the service ID
+    (tv.serviceid), which is false for services excluded by the filter.
+
+    Only services which are excluded for certain (e.g. all their companies are
+    excluded and none of their service numbers are included) are left out,
+    the filter must still be applied to the returned services.
+
+    Args:
+        service_filter (serviceinfo.service_filter.ServiceFilter): Compiled filter
+
+    Returns:
+        tuple: SQL condition and list of parameters, or None when the
+        filter can not exclude any service
+    """
+
+    exclude = service_filter.exclude
+    include = service_filter.include
+
+    # Services from IFF have no store type, an exclude filter
+    # with a 'store' condition never matches:
+    if exclude.store is not None:
+        return None
+
+    # An include filter with a 'store' condition never matches,
+    # an include filter with 'all' always matches:
+    if include.store is None and include.all:
+        return None
+
+    excluded = []
+    excluded_params = []
+
+    if exclude.all:
+        excluded.append('1 = 1')
+
+    if exclude.companies is not None:
+        # The company of every service number is excluded:
+        excluded.append("""NOT EXISTS (
+            SELECT 1 FROM timetable_service sv LEFT JOIN company c ON sv.companynumber = c.company
+            WHERE sv.serviceid = tv.serviceid
+            AND (c.code IS NULL OR LOWER(c.code) NOT IN (%s)))""" % _get_placeholders(exclude.companies))
+        excluded_params.extend(sorted(exclude.companies))
+
+    if exclude.range_starts is not None:
+        # Every service number is excluded (service number 0 is replaced
+        # by the variant or service ID):
+        ranges, params = _get_range_condition('sv.servicenumber', exclude)
+        excluded.append("""NOT EXISTS (
+            SELECT 1 FROM timetable_service sv
+            WHERE sv.serviceid = tv.serviceid
+            AND (sv.servicenumber = 0 OR NOT (%s)))""" % ranges)
+        excluded_params.extend(params)
+
+    if exclude.transport_modes is not None:
+        # Every transport mode is excluded:
+        excluded.append("""EXISTS (
+            SELECT 1 FROM timetable_transport tt WHERE tt.serviceid = tv.serviceid)
+            AND NOT EXISTS (
+            SELECT 1 FROM timetable_transport tt
+            WHERE tt.serviceid = tv.serviceid
+            AND (tt.transmode IS NULL OR LOWER(tt.transmode) NOT IN (%s)))""" % _get_placeholders(
+            exclude.transport_modes))
+        excluded_params.extend(sorted(exclude.transport_modes))
+
+    if exclude.stops is not None:
+        # One of the stops is excluded:
+        excluded.append("""EXISTS (
+            SELECT 1 FROM timetable_stop ts
+            JOIN station s ON ts.station = s.shortname
+            JOIN timetable_service sv
+                ON (sv.serviceid = ts.serviceid AND sv.firststop <= ts.idx AND sv.laststop >= ts.idx)
+            WHERE ts.serviceid = tv.serviceid
+            AND LOWER(ts.station) IN (%s))""" % _get_placeholders(exclude.stops))
+        excluded_params.extend(sorted(exclude.stops))
+
+    if len(excluded) == 0:
+        return None
+
+    included = []
+    included_params = []
+
+    if include.store is None:
+        if include.companies is not None:
+            included.append("""EXISTS (
+                SELECT 1 FROM timetable_service sv LEFT JOIN company c ON sv.companynumber = c.company
+                WHERE sv.serviceid = tv.serviceid
+                AND (c.code IS NULL OR LOWER(c.code) IN (%s)))""" % _get_placeholders(include.companies))
+            included_params.extend(sorted(include.companies))
+
+        if include.range_starts is not None:
+            ranges, params = _get_range_condition('sv.servicenumber', include)
+            included.append("""EXISTS (
+                SELECT 1 FROM timetable_service sv
+                WHERE sv.serviceid = tv.serviceid
+                AND (sv.servicenumber = 0 OR %s))""" % ranges)
+            included_params.extend(params)
+
+        if include.transport_modes is not None:
+            included.append("""EXISTS (
+                SELECT 1 FROM timetable_transport tt
+                WHERE tt.serviceid = tv.serviceid
+                AND LOWER(tt.transmode) IN (%s))""" % _get_placeholders(include.transport_modes))
+            included_params.extend(sorted(include.transport_modes))
+
+        if include.stops is not None:
+            included.append("""EXISTS (
+                SELECT 1 FROM timetable_stop ts
+                WHERE ts.serviceid = tv.serviceid
+                AND LOWER(ts.station) IN (%s))""" % _get_placeholders(include.stops))
+            included_params.extend(sorted(include.stops))
+
+    condition = '(%s)' % ' OR '.join('(%s)' % item for item in excluded)
+    if len(included) > 0:
+        condition = '%s AND NOT (%s)' % (condition, ' OR '.join(included))
+
+    return 'NOT (%s)' % condition, excluded_params + included_params
+
+
+def _get_placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _get_range_condition(column, compiled_filter):
+    """
+    SQL condition which is true when a column is in one of the service number
+    ranges of a compiled filter.
+    """
+
+    condition = ' OR '.join(['%s BETWEEN %%s AND %%s' % column] * len(compiled_filter.range_starts))
+    params = []
+    for start, end in zip(compiled_filter.range_starts, compiled_filter.range_ends):
+        params.extend([start, end])
+
+    return condition or '1 = 0', params
+
+
+def _parse_snapshot_time(value):
+    """
+    Convert a TIME value from a snapshot to a timedelta object, which is
+    the type MySQLdb returns for TIME columns. Times may exceed 24:00:00.
+    """
+
+    hours, minutes, seconds = [int(part) for part in value.split(':')]
+    return datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds)
+
+sqlite3.register_converter('TIME', _parse_snapshot_time)
+
+
+class IffSnapshotSource(IffSource):
+    """
+    An IffSource which reads from a SQLite snapshot instead of MySQL.
+    The snapshot is memory mapped, lookups are read from the page cache.
+    """
+
+    # Maximum number of bytes of the snapshot which are memory mapped:
+    mmap_size = 1024 * 1024 * 1024
+
+    def __init__(self, config):
+        """
+        Construct an IffSnapshotSource object and open the snapshot.
+
+        Args:
+            config (dict): Configuration dictionary, containing the
+                filename of the snapshot (snapshot).
+        """
+
+        self.connection = _SnapshotConnection(config['snapshot'], self.mmap_size)
+
+        # Always use Europe/Amsterdam as timezone (IFF times are local time)
+        self.timezone = pytz.timezone('Europe/Amsterdam')
+
+    def _get_dataset_version(self):
+        """
+        Identify the loaded dataset by the snapshot file, a new snapshot
+        is renamed over the old file.
+        """
+
+        return self.connection._get_file_id()
+
+
+class _SnapshotConnection(object):
+    """
+    Wrapper around a sqlite3 connection, providing cursors which accept
+    the MySQLdb queries used by IffSource. A new snapshot is renamed over
+    the old file, so the snapshot is reopened when the file has changed.
+    """
+
+    connection = None
+    filename = None
+    mmap_size = None
+    file_id = None
+
+    def __init__(self, filename, mmap_size):
+        self.filename = filename
+        self.mmap_size = mmap_size
+
+        self._open()
+
+    def _open(self):
+        self.file_id = self._get_file_id()
+
+        self.connection = sqlite3.connect(self.filename,
+            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+
+        self.connection.execute('PRAGMA query_only = 1')
+        self.connection.execute('PRAGMA mmap_size = %d' % self.mmap_size)
+
+    def _get_file_id(self):
+        """
+        Identify the snapshot file by inode and modification time.
+        """
+
+        stat = os.stat(self.filename)
+        return stat.st_ino, stat.st_mtime
+
+    def cursor(self):
+        if self._get_file_id() != self.file_id:
+            __logger__.info('Snapshot %s has changed, reopening', self.filename)
+            self.connection.close()
+            self._open()
+
+        return _SnapshotCursor(self.connection.cursor())
+
+    def close(self):
+        self.connection.close()
+
+
+class _SnapshotCursor(object):
+    """
+    Wrapper around a sqlite3 cursor. Query parameters are translated to
+    the sqlite3 parameter style, and all rows are fetched when executing
+    a query to provide the number of rows (rowcount) like MySQLdb.
+    """
+
+    cursor = None
+    description = None
+    rowcount = -1
+    rows = None
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.cursor.execute(query.replace('%s', '?'), args or [])
+        self.description = self.cursor.description
+        self.rows = self.cursor.fetchall()
+        self.rowcount = len(self.rows)
+
+    def fetchone(self):
+        if len(self.rows) == 0:
+            return None
+
+        return self.rows.pop(0)
+
+    def fetchall(self):
+        rows = self.rows
+        self.rows = []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self.cursor.close()
+
+
+class IffSourcePool(object):
+    """
+    A pool of IffSource objects. Connections are created on demand and
+    handed back to the pool after use, so repeated lookups reuse an open
+    MySQL connection instead of connecting for every lookup. IffSource
+    connections use autocommit, so a pooled connection does not keep
+    reading the snapshot of its first transaction after IFF is reloaded.
+    """
+
+    config = None
+    pool = None
+
+    def __init__(self, config, size=4):
+        """
+        Construct an IffSourcePool. No connections are made until the
+        first IffSource is requested.
+
+        Args:
+            config (dict): Configuration dictionary, containing MySQL
+                connection information (host, user, password, database).
+            size (int, optional): Maximum number of idle connections
+                kept in the pool (default: 4)
+        """
+
+        self.config = config
+        self.pool = Queue.Queue(size)
+
+    @contextmanager
+    def source(self):
+        """
+        Context manager which provides an IffSource from the pool.
+        The IffSource is returned to the pool when the block exits normally,
+        it is closed and discarded when an exception is raised.
+        """
+
+        try:
+            iff_source = self.pool.get_nowait()
+        except Queue.Empty:
+            __logger__.debug('Opening new IFF connection for pool')
+            iff_source = get_iff_source(self.config)
+
+        try:
+            yield iff_source
+        except:
+            iff_source.close()
+            raise
+
+        try:
+            self.pool.put_nowait(iff_source)
+        except Queue.Full:
+            iff_source.close()
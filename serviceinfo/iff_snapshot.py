@@ -0,0 +1,139 @@
+"""
+IFF snapshot
+
+This module builds a read-only SQLite snapshot of an IFF delivery from the
+TSV files written by iff-converter.py. The snapshot contains all tables used
+by serviceinfo.iff.IffSource, so it can be used instead of MySQL for lookups
+(see serviceinfo.iff.IffSnapshotSource). SQLite reads the file through the
+page cache, which is shared by all processes using the same snapshot.
+"""
+
+import binascii
+import codecs
+import os
+import sqlite3
+
+# Tables in the snapshot, with their columns in the order of the TSV files.
+# Text columns compare case insensitive, like the MySQL tables:
+TABLES = [
+    ('company', [('company', 'INTEGER'), ('code', 'TEXT'), ('name', 'TEXT'), ('timeturn', 'TIME')]),
+    ('footnote', [('footnote', 'INTEGER'), ('servicedate', 'DATE')]),
+    ('footnote_bitmap', [('footnote', 'INTEGER'), ('firstday', 'DATE'), ('days', 'BLOB')]),
+    ('station', [('shortname', 'TEXT'), ('trainchanges', 'INTEGER'), ('layovertime', 'INTEGER'),
+                 ('country', 'TEXT'), ('timezone', 'INTEGER'), ('x', 'INTEGER'), ('y', 'INTEGER'),
+                 ('name', 'TEXT')]),
+    ('timetable_attribute', [('serviceid', 'INTEGER'), ('code', 'TEXT'), ('firststop', 'INTEGER'),
+                             ('laststop', 'INTEGER')]),
+    ('timetable_platform', [('serviceid', 'INTEGER'), ('idx', 'INTEGER'), ('station', 'TEXT'),
+                            ('arrival', 'TEXT'), ('departure', 'TEXT'), ('footnote', 'INTEGER')]),
+    ('timetable_service', [('serviceid', 'INTEGER'), ('companynumber', 'INTEGER'), ('servicenumber', 'INTEGER'),
+                           ('variant', 'TEXT'), ('firststop', 'INTEGER'), ('laststop', 'INTEGER'),
+                           ('servicename', 'TEXT')]),
+    ('timetable_stop', [('serviceid', 'INTEGER'), ('idx', 'INTEGER'), ('station', 'TEXT'),
+                        ('arrivaltime', 'TIME'), ('departuretime', 'TIME')]),
+    ('timetable_transport', [('serviceid', 'INTEGER'), ('transmode', 'TEXT'), ('firststop', 'INTEGER'),
+                             ('laststop', 'INTEGER')]),
+    ('timetable_validity', [('serviceid', 'INTEGER'), ('footnote', 'INTEGER'), ('firststop', 'INTEGER'),
+                            ('laststop', 'INTEGER')]),
+    ('trnsattr', [('code', 'TEXT'), ('processingcode', 'INTEGER'), ('description', 'TEXT')]),
+    ('trnsmode', [('code', 'TEXT'), ('description', 'TEXT')]),
+]
+
+# Indexes for the queries issued by IffSource:
+INDEXES = [
+    ('company', ['company']),
+    ('company', ['code']),
+    ('footnote', ['footnote', 'servicedate']),
+    ('footnote_bitmap', ['footnote']),
+    ('station', ['shortname']),
+    ('timetable_attribute', ['serviceid']),
+    ('timetable_platform', ['serviceid', 'idx']),
+    ('timetable_service', ['serviceid', 'firststop', 'laststop', 'servicenumber', 'variant', 'companynumber']),
+    ('timetable_service', ['servicenumber', 'serviceid']),
+    ('timetable_stop', ['serviceid', 'idx']),
+    ('timetable_transport', ['serviceid', 'firststop', 'laststop', 'transmode']),
+    ('timetable_validity', ['serviceid', 'footnote']),
+    ('timetable_validity', ['footnote', 'serviceid']),
+    ('trnsattr', ['code']),
+    ('trnsmode', ['code']),
+]
+
+# Number of rows per insert batch:
+BATCH_SIZE = 10000
+
+
+def build_snapshot(tsv_path, filename):
+    """
+    Build a snapshot from TSV files. The snapshot is written to a temporary
+    file first and then renamed, so processes which use the previous snapshot
+    are not affected.
+
+    Args:
+        tsv_path (string): Directory with the TSV files
+        filename (string): Filename of the snapshot
+    """
+
+    temporary_filename = filename + '.tmp'
+    if os.path.exists(temporary_filename):
+        os.remove(temporary_filename)
+
+    connection = sqlite3.connect(temporary_filename)
+    connection.execute('PRAGMA journal_mode = OFF')
+    connection.execute('PRAGMA synchronous = OFF')
+
+    for table, columns in TABLES:
+        connection.execute('CREATE TABLE %s (%s)' % (table, ', '.join(
+            ['%s %s%s' % (name, column_type, ' COLLATE NOCASE' if column_type == 'TEXT' else '')
+             for name, column_type in columns])))
+
+        query = 'INSERT INTO %s VALUES (%s)' % (table, ', '.join(['?'] * len(columns)))
+        rows = []
+
+        for row in _read_tsv(os.path.join(tsv_path, table + '.tsv'), columns):
+            rows.append(row)
+
+            if len(rows) == BATCH_SIZE:
+                connection.executemany(query, rows)
+                rows = []
+
+        connection.executemany(query, rows)
+
+    for number, (table, columns) in enumerate(INDEXES):
+        connection.execute('CREATE INDEX %s_%d ON %s (%s)' % (table, number, table, ', '.join(columns)))
+
+    connection.execute('ANALYZE')
+    connection.commit()
+    connection.close()
+
+    os.rename(temporary_filename, filename)
+
+
+def _read_tsv(filename, columns):
+    """
+    Read rows from a TSV file, converting values the same way as MySQL's LOAD DATA
+    """
+
+    with codecs.open(filename, 'r', 'UTF-8') as tsv_file:
+        # Skip header:
+        tsv_file.readline()
+
+        for line in tsv_file:
+            values = line.rstrip('\n').split('\t')
+            row = []
+
+            for (_, column_type), value in zip(columns, values):
+                if value == '\\N':
+                    value = None
+                elif column_type == 'INTEGER':
+                    value = int(value) if value != '' else 0
+                elif column_type == 'BLOB':
+                    value = buffer(binascii.unhexlify(value))
+                elif column_type in ('DATE', 'TIME') and value == '':
+                    value = None
+
+                row.append(value)
+
+            # Missing columns are NULL:
+            row.extend([None] * (len(columns) - len(row)))
+
+            yield row
@@ -5,9 +5,14 @@ Module to convert services and stops to JSON objects,
 allowing them to be injected into other applications.
 """
 
+import datetime
+import hashlib
 import isodate
+import json
 
+import common
 import data
+import service_filter
 import util
 
 class Injection:
@@ -103,3 +108,153 @@ class Injection:
             if stop[0] != destination:
                 via_stops.append(stop)
         return via_stops[:self.max_via]
+
+
+class Selection(object):
+    """
+    Compiled injector selection. A departure is selected when its service
+    matches one or more of the selection filters and it departs within
+    the time window.
+    """
+
+    filters = None
+    window = None
+
+    def __init__(self, selection, window):
+        """
+        Compile the selection filters.
+
+        Args:
+            selection (list): List of filter conditions (dicts)
+            window (int): Time window in minutes
+        """
+
+        self.filters = [service_filter.Filter(filter_config) for filter_config in selection]
+        self.window = window
+
+    def match(self, service):
+        """
+        Returns True when the service matches one or more selection filters.
+        """
+
+        for compiled_filter in self.filters:
+            if compiled_filter.match(service):
+                return True
+
+        return False
+
+    def get_departures(self, store, reference_time=None):
+        """
+        Retrieve all selected departures from the service store. Only services
+        which are running in the time window are retrieved, and all departures
+        are checked against the same reference time.
+
+        Args:
+            store (serviceinfo.service_store.ServiceStore): Service store
+            reference_time (datetime, optional): Start of the time window
+                (default: current time)
+
+        Returns:
+            list: List of (service, stop) tuples
+        """
+
+        if reference_time is None:
+            reference_time = util.get_localized_datetime(datetime.datetime.now())
+
+        services = store.get_services_departing(reference_time,
+                                                reference_time + datetime.timedelta(minutes=self.window))
+
+        departures = []
+
+        for service in services:
+            if not self.match(service):
+                continue
+
+            for stop in service.stops:
+                if service_filter.departure_time_window(stop, self.window, reference_time):
+                    departures.append((service, stop))
+
+        return departures
+
+
+def get_injection_key(inject):
+    """
+    Key identifying the departure of an injection dict:
+    a tuple with service ID, stop code and service date.
+    """
+
+    return inject['service_id'], inject['stop_code'], inject['service_date']
+
+
+def get_injection_hash(inject):
+    """
+    Content hash of an injection dict, used to detect changed departures.
+    """
+
+    return hashlib.sha1(json.dumps(inject, sort_keys=True)).hexdigest()
+
+
+class InjectionCache(object):
+    """
+    Remembers the content hash of every injected departure in Redis, so
+    departures are only injected again when their injection dict changed.
+    Entries are keyed by service ID, stop code and service date, and expire
+    shortly after the (delayed) departure.
+    """
+
+    # Seconds an entry is kept after the departure:
+    expiry_margin = 600
+
+    redis = None
+
+    def __init__(self, config):
+        """
+        Initialize the cache.
+
+        Args:
+            config (dict): Redis configuration (e.g. schedule_store)
+        """
+
+        self.redis = common.get_redis(config)
+
+    def get_changed(self, injections):
+        """
+        Select new and changed injections.
+
+        Args:
+            injections (list): List of injection dicts
+
+        Returns:
+            list: Injection dicts which were not injected before,
+            or changed since they were injected
+        """
+
+        pipe = self.redis.pipeline(transaction=False)
+        for inject in injections:
+            pipe.get('injections:%s:%s:%s' % get_injection_key(inject))
+
+        return [inject for inject, injected_hash in zip(injections, pipe.execute())
+                if injected_hash != get_injection_hash(inject)]
+
+    def set_sent(self, injections):
+        """
+        Remember injection dicts after they were injected successfully.
+
+        Args:
+            injections (list): List of injection dicts
+        """
+
+        pipe = self.redis.pipeline(transaction=False)
+
+        for inject in injections:
+            key = 'injections:%s:%s:%s' % get_injection_key(inject)
+            pipe.set(key, get_injection_hash(inject))
+
+            departure = util.parse_iso_datetime(inject['departure'])
+            if departure is not None:
+                departure += datetime.timedelta(minutes=inject['departure_delay'] or 0)
+                pipe.expireat(key, util.datetime_to_timestamp(departure) + self.expiry_margin)
+            else:
+                pipe.expire(key, 86400)
+
+        pipe.execute()
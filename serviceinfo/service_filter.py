@@ -4,49 +4,127 @@ Filter module
 Module containing methods to filter service objects
 """
 
+import bisect
 import datetime
+
 import serviceinfo.util
 
 
 def match_filter(service, service_filter):
     """
     Returns True when the service matches one or more filter conditions.
+    For many services, compile the filter once with Filter instead.
     """
 
-    # 'store' condition must match if it exists with any service for this filter.
-    if 'store' in service_filter:
-        if service_filter['store'] != 'any':
-            if service.store_type != service_filter['store']:
-                return False
+    return Filter(service_filter).match(service)
 
-    # Wildcard, matches all services (handy in combition with 'store' which is checked first)
-    if 'all' in service_filter and service_filter['all'] is True:
-        return True
 
-    if 'company' in service_filter:
-        if service.company_code.lower() in (x.lower() for x in service_filter['company']):
+class Filter(object):
+    """
+    Compiled filter. Company, transport mode and stop conditions are converted
+    to sets of lowercase values and service number ranges to a sorted list of
+    non-overlapping ranges, so matching a service does not depend on the size
+    of the filter.
+    """
+
+    store = None
+    all = False
+    companies = None
+    transport_modes = None
+    stops = None
+    range_starts = None
+    range_ends = None
+
+    def __init__(self, service_filter):
+        """
+        Compile a filter.
+
+        Args:
+            service_filter (dict): Filter conditions ('store', 'all', 'company',
+                'service', 'transport_mode' and/or 'stop')
+        """
+
+        if 'store' in service_filter and service_filter['store'] != 'any':
+            self.store = service_filter['store']
+
+        self.all = 'all' in service_filter and service_filter['all'] is True
+
+        if 'company' in service_filter:
+            self.companies = frozenset(x.lower() for x in service_filter['company'])
+
+        if 'service' in service_filter:
+            self.range_starts, self.range_ends = _merge_ranges(service_filter['service'])
+
+        if 'transport_mode' in service_filter:
+            self.transport_modes = frozenset(x.lower() for x in service_filter['transport_mode'])
+
+        if 'stop' in service_filter:
+            self.stops = frozenset(x.lower() for x in service_filter['stop'])
+
+    def match(self, service):
+        """
+        Returns True when the service matches one or more filter conditions.
+        """
+
+        # 'store' condition must match if it exists with any service for this filter.
+        if self.store is not None and service.store_type != self.store:
+            return False
+
+        # Wildcard, matches all services (handy in combition with 'store' which is checked first)
+        if self.all:
             return True
 
-    if 'service' in service_filter:
-        # Convert servicenumber to int:
-        try:
-            servicenumber = int(service.servicenumber)
-        except ValueError:
-            servicenumber = 0
-        for number_range in service_filter['service']:
-            if servicenumber >= number_range[0] and servicenumber <= number_range[1]:
+        if self.companies is not None and service.company_code.lower() in self.companies:
+            return True
+
+        if self.range_starts is not None:
+            # Convert servicenumber to int:
+            try:
+                servicenumber = int(service.servicenumber)
+            except ValueError:
+                servicenumber = 0
+
+            # Last range starting at or before the service number:
+            index = bisect.bisect_right(self.range_starts, servicenumber) - 1
+            if index >= 0 and servicenumber <= self.range_ends[index]:
                 return True
 
-    if 'transport_mode' in service_filter:
-        if service.transport_mode.lower() in (x.lower() for x in service_filter['transport_mode']):
+        if self.transport_modes is not None and service.transport_mode.lower() in self.transport_modes:
             return True
 
-    if 'stop' in service_filter:
-        for stop in service.stops:
-            if stop.stop_code.lower() in (x.lower() for x in service_filter['stop']):
-                return True
+        if self.stops is not None:
+            for stop in service.stops:
+                if stop.stop_code.lower() in self.stops:
+                    return True
 
-    return False
+        return False
+
+    __call__ = match
+
+
+def _merge_ranges(number_ranges):
+    """
+    Sort and merge (inclusive) service number ranges.
+
+    Returns:
+        tuple: Lists with the start and end of every merged range
+    """
+
+    starts = []
+    ends = []
+
+    for start, end in sorted((number_range[0], number_range[1]) for number_range in number_ranges):
+        # Skip empty ranges:
+        if start > end:
+            continue
+
+        if len(ends) > 0 and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+
+    return starts, ends
 
 
 def departure_time_window(stop, minutes, check_date=None):
@@ -85,25 +163,52 @@ def departure_time_window(stop, minutes, check_date=None):
 def is_service_included(service, filter_config):
     """
     Determine whether a service should be included in the service store
-    based on the filter configuration.
+    based on the filter configuration. For many services, compile the
+    filter configuration once with ServiceFilter instead.
 
     Args:
         service (serviceinfo.data.Service): service object
         filter_config (dict): dictionary with filter configuration. Must contain 'include' and 'exclude'
-        check_date (datetime, optional): reference time (default current time)
 
     Returns:
         boolean: Returns True when the service should be included.
     """
 
-    include_service = True
+    return ServiceFilter(filter_config).is_included(service)
+
+
+class ServiceFilter(object):
+    """
+    Compiled filter configuration with an exclude and an include filter.
+    Instances can be used as a predicate, e.g. with filter().
+    """
+
+    exclude = None
+    include = None
+
+    def __init__(self, filter_config):
+        """
+        Compile a filter configuration.
+
+        Args:
+            filter_config (dict): dictionary with filter configuration. Must contain 'include' and 'exclude'
+        """
+
+        self.exclude = Filter(filter_config['exclude'])
+        self.include = Filter(filter_config['include'])
+
+    def is_included(self, service):
+        """
+        Determine whether a service should be included: services matching the
+        exclude filter are only included when they match the include filter.
+
+        Args:
+            service (serviceinfo.data.Service): service object
 
-    if serviceinfo.service_filter.match_filter(service, filter_config['exclude']):
-        include_service = False
+        Returns:
+            boolean: Returns True when the service should be included.
+        """
 
-    if include_service is False:
-        # Check to whether still include this service:
-        if serviceinfo.service_filter.match_filter(service, filter_config['include']):
-            include_service = True
+        return not self.exclude.match(service) or self.include.match(service)
 
-    return include_service
\ No newline at end of file
+    __call__ = is_included
@@ -6,7 +6,10 @@ Services are stored in a Redis instance. Both scheduled and real-time (actual)
 information about services can be stored.
 """
 
+import datetime
+import heapq
 import isodate
+import itertools
 import logging
 import common
 import json
@@ -25,6 +28,9 @@ class ServiceStore(object):
     TYPE_ACTUAL = 'actual'
     TYPE_ACTUAL_OR_SCHEDULED = 'actual_scheduled'
 
+    # Pub/sub channel for change events:
+    CHANGES_CHANNEL = 'services:changes'
+
     logger = None
 
     def __init__(self, config):
@@ -45,29 +51,94 @@ class ServiceStore(object):
         Existing information for a service is updated.
         """
 
+        self.store_services([service], service_type)
+
+    def store_services(self, services, service_type, batch_size=500):
+        """
+        Store multiple services to the service store.
+
+        Services can be a list, dictionary or any other iterable, type must be
+        TYPE_ACTUAL or TYPE_SCHEDULED. Services are stored in batches, every
+        batch is written with two pipelined Redis requests.
+        """
+
+        batch = []
+
+        for service in services:
+            batch.append(service)
+
+            if len(batch) == batch_size:
+                self._store_batch(batch, service_type)
+                batch = []
+
+        if len(batch) > 0:
+            self._store_batch(batch, service_type)
+
+    def _store_batch(self, services, service_type):
+        """
+        Internal method to store a batch of services. All reads (whether a
+        service already exists and the change versions) are done in a
+        single request, all writes are done in a second request.
+        """
+
+        pipe = self.redis.pipeline(transaction=False)
+        for service in services:
+            pipe.sismember('services:%s:%s:%s' % (service_type,
+                service.get_servicedate_str(), service.servicenumber),
+                service.service_id)
+            pipe.hgetall('services:%s:%s:%s:arrivals' % (service_type,
+                service.get_servicedate_str(), service.servicenumber))
+        pipe.incrby('services:version', len(services))
+        results = pipe.execute()
+
+        # Each service gets its own version number:
+        first_version = results[-1] - len(services) + 1
+
+        # Arrival times of all service IDs for each service number, updated
+        # while the services in this batch are added to the pipeline:
+        arrivals = {}
+        for number, service in enumerate(services):
+            arrivals.setdefault((service.get_servicedate_str(), service.servicenumber),
+                dict((service_id, int(timestamp)) for service_id, timestamp in results[2 * number + 1].items()))
+
+        pipe = self.redis.pipeline(transaction=False)
+        for number, service in enumerate(services):
+            self._store_service(pipe, service, service_type, results[2 * number], first_version + number,
+                arrivals[(service.get_servicedate_str(), service.servicenumber)])
+        pipe.execute()
+
+    def _store_service(self, pipe, service, service_type, exists, version, arrivals):
+        """
+        Internal method to add all writes for storing a service to a pipeline.
+        Arrivals is a dict with the arrival timestamps of all service IDs of
+        the service number, it is updated with the arrival of this service.
+        """
+
         # Add the servicedate:
-        self.redis.sadd('services:%s:date' % service_type,
+        pipe.sadd('services:%s:date' % service_type,
             service.get_servicedate_str())
 
         # Add service:
-        self.redis.sadd('services:%s:%s' % (service_type,
+        pipe.sadd('services:%s:%s' % (service_type,
             service.get_servicedate_str()), service.servicenumber)
 
+        # Add service to sorted index:
+        pipe.execute_command('zadd', 'services:%s:%s:index' % (service_type,
+            service.get_servicedate_str()), self._get_index_score(service.servicenumber), service.servicenumber)
+
         # Check whether service did already exist:
-        if self.redis.sismember('services:%s:%s:%s' % (service_type,
-            service.get_servicedate_str(), service.servicenumber),
-            service.service_id):
+        if exists:
             # Remove service details:
             self._delete_service_id(service.get_servicedate_str(),
-                service.service_id, service_type)
+                service.service_id, service_type, pipe)
 
         # Add service details:
-        self.redis.sadd('services:%s:%s:%s' % (service_type,
+        pipe.sadd('services:%s:%s:%s' % (service_type,
             service.get_servicedate_str(), service.servicenumber),
             service.service_id)
 
         # Add schedule ID:
-        self.redis.sadd('schedule:%s:%s' % (service_type,
+        pipe.sadd('schedule:%s:%s' % (service_type,
             service.get_servicedate_str()),
             service.service_id)
 
@@ -76,11 +147,31 @@ class ServiceStore(object):
             service.get_servicedate_str(), service.service_id)
 
         # Store service information:
-        self.redis.delete('%s:info' % key_prefix)
+        pipe.delete('%s:info' % key_prefix)
 
         first_departure = util.datetime_to_iso(service.stops[0].departure_time)
         last_arrival = util.datetime_to_iso(service.stops[-1].arrival_time)
 
+        # Add service to arrival time index, with the last arrival of all
+        # service IDs (e.g. all parts of a split service):
+        arrivals_key = 'services:%s:%s:%s:arrivals' % (service_type,
+            service.get_servicedate_str(), service.servicenumber)
+        arrival_timestamp = self._get_arrival_timestamp(service)
+
+        if arrival_timestamp is not None:
+            arrivals[str(service.service_id)] = arrival_timestamp
+            pipe.hset(arrivals_key, service.service_id, arrival_timestamp)
+        else:
+            arrivals.pop(str(service.service_id), None)
+            pipe.hdel(arrivals_key, service.service_id)
+
+        if len(arrivals) > 0:
+            pipe.execute_command('zadd', 'services:%s:%s:arrivals' % (service_type,
+                service.get_servicedate_str()), max(arrivals.values()), service.servicenumber)
+        else:
+            pipe.execute_command('zrem', 'services:%s:%s:arrivals' % (service_type,
+                service.get_servicedate_str()), service.servicenumber)
+
         service_data = {'cancelled': service.cancelled,
                         'company_code': service.company_code,
                         'company_name': service.company_name,
@@ -88,7 +179,8 @@ class ServiceStore(object):
                         'transport_mode_description': service.transport_mode_description,
                         'servicenumber': service.servicenumber,
                         'first_departure': first_departure,
-                        'last_arrival': last_arrival
+                        'last_arrival': last_arrival,
+                        'version': version
                        }
 
         stops_data = []
@@ -119,19 +211,12 @@ class ServiceStore(object):
         # Add stops data to service_data in JSON format:
         service_data['stops'] = json.dumps(stops_data)
 
-        self.redis.hmset('%s:info' % key_prefix, service_data)
-        return
+        pipe.hmset('%s:info' % key_prefix, service_data)
 
-    def store_services(self, services, service_type):
-        """
-        Store multiple services to the service store.
-
-        Services can be a list or dictionary, type must be
-        TYPE_ACTUAL or TYPE_SCHEDULED.
-        """
-
-        for service in services:
-            self.store_service(service, service_type)
+        # Publish change event, after all writes for this service:
+        self._publish_change('store', service.get_servicedate_str(), service.servicenumber,
+                             service_type, service.company_code,
+                             [stop.stop_code.lower() for stop in service.stops], version, pipe)
 
     def get_service_numbers(self, servicedate, service_type=TYPE_ACTUAL_OR_SCHEDULED):
         """
@@ -156,6 +241,269 @@ class ServiceStore(object):
             key = 'services:%s:%s' % (service_type, servicedate)
             return list(self.redis.smembers(key))
 
+    def iter_service_numbers(self, servicedate, service_type=TYPE_ACTUAL_OR_SCHEDULED, start=None,
+                             batch_size=1000):
+        """
+        Iterate over all service numbers for a given date, in sorted order:
+        numeric service numbers are sorted numerically, after all other
+        service numbers (which are sorted alphabetically). Service numbers are
+        read from the sorted index in batches, so memory usage does not depend
+        on the number of services.
+
+        Args:
+            servicedate (string): Service date (YYYY-MM-DD)
+            service_type (string, optional): Store type
+                (default: both actual and scheduled)
+            start (string, optional): Only return service numbers sorted after start
+            batch_size (int, optional): Number of service numbers per Redis request
+
+        Returns:
+            iterator: sorted service numbers (without duplicates)
+        """
+
+        if service_type == self.TYPE_ACTUAL_OR_SCHEDULED:
+            store_types = [self.TYPE_ACTUAL, self.TYPE_SCHEDULED]
+        else:
+            store_types = [service_type]
+
+        # Merge the indexes in index order, (score, service number):
+        iterators = [((self._get_index_score(servicenumber), servicenumber) for servicenumber
+                      in self._iter_service_number_index(servicedate, store_type, start, batch_size))
+                     for store_type in store_types]
+
+        previous = None
+        for _, servicenumber in heapq.merge(*iterators):
+            if servicenumber != previous:
+                yield servicenumber
+            previous = servicenumber
+
+    def get_finished_service_numbers(self, servicedate, service_type=TYPE_ACTUAL_OR_SCHEDULED, before=None):
+        """
+        Retrieve all service numbers for a given date which arrived at their
+        last stop (including delay) before the given time, based on the
+        arrival time index. For TYPE_ACTUAL_OR_SCHEDULED, the arrival time
+        of the actual service takes precedence over the scheduled service.
+
+        Args:
+            servicedate (string): Service date (YYYY-MM-DD)
+            service_type (string, optional): Store type
+                (default: actual if available, otherwise scheduled)
+            before (datetime, optional): Reference time (default: now)
+
+        Returns:
+            list: sorted service numbers
+        """
+
+        if before is None:
+            before = datetime.datetime.now()
+
+        timestamp = util.datetime_to_timestamp(before)
+
+        if service_type != self.TYPE_ACTUAL_OR_SCHEDULED:
+            return sorted(self.redis.execute_command('zrangebyscore',
+                'services:%s:%s:arrivals' % (service_type, servicedate), '-inf', timestamp))
+
+        actual_key = 'services:%s:%s:arrivals' % (self.TYPE_ACTUAL, servicedate)
+        scheduled_key = 'services:%s:%s:arrivals' % (self.TYPE_SCHEDULED, servicedate)
+
+        finished = set(self.redis.execute_command('zrangebyscore', actual_key, '-inf', timestamp))
+        finished_scheduled = self.redis.execute_command('zrangebyscore', scheduled_key, '-inf', timestamp)
+
+        # Scheduled services which also have actual information are only
+        # finished when the actual service is finished:
+        candidates = [servicenumber for servicenumber in finished_scheduled if servicenumber not in finished]
+
+        pipe = self.redis.pipeline(transaction=False)
+        for servicenumber in candidates:
+            pipe.zscore(actual_key, servicenumber)
+
+        for servicenumber, actual_score in zip(candidates, pipe.execute()):
+            if actual_score is None:
+                finished.add(servicenumber)
+
+        return sorted(finished)
+
+    def get_running_service_numbers(self, servicedate, service_type=TYPE_ACTUAL_OR_SCHEDULED, after=None):
+        """
+        Retrieve all service numbers for a given date which arrive at their
+        last stop (including delay) at or after the given time, based on the
+        arrival time index. For TYPE_ACTUAL_OR_SCHEDULED, the arrival time
+        of the actual service takes precedence over the scheduled service.
+        Service numbers which are not in the arrival time index (e.g. stored
+        before the index existed) are always returned.
+
+        Args:
+            servicedate (string): Service date (YYYY-MM-DD)
+            service_type (string, optional): Store type
+                (default: actual if available, otherwise scheduled)
+            after (datetime, optional): Reference time (default: now)
+
+        Returns:
+            list: sorted service numbers
+        """
+
+        if after is None:
+            after = datetime.datetime.now()
+
+        timestamp = util.datetime_to_timestamp(after)
+
+        if service_type != self.TYPE_ACTUAL_OR_SCHEDULED:
+            running = set(self.redis.execute_command('zrangebyscore',
+                'services:%s:%s:arrivals' % (service_type, servicedate), timestamp, '+inf'))
+            return sorted(running | self._get_unindexed_service_numbers(servicedate, service_type))
+
+        actual_key = 'services:%s:%s:arrivals' % (self.TYPE_ACTUAL, servicedate)
+        scheduled_key = 'services:%s:%s:arrivals' % (self.TYPE_SCHEDULED, servicedate)
+
+        running = set(self.redis.execute_command('zrangebyscore', actual_key, timestamp, '+inf'))
+        running |= self._get_unindexed_service_numbers(servicedate, self.TYPE_ACTUAL)
+        running_scheduled = set(self.redis.execute_command('zrangebyscore', scheduled_key, timestamp, '+inf'))
+        running_scheduled |= self._get_unindexed_service_numbers(servicedate, self.TYPE_SCHEDULED)
+
+        # Scheduled services which also have actual information are only
+        # running when the actual service is running:
+        candidates = [servicenumber for servicenumber in running_scheduled if servicenumber not in running]
+
+        pipe = self.redis.pipeline(transaction=False)
+        for servicenumber in candidates:
+            pipe.zscore(actual_key, servicenumber)
+
+        for servicenumber, actual_score in zip(candidates, pipe.execute()):
+            if actual_score is None:
+                running.add(servicenumber)
+
+        return sorted(running)
+
+    def _get_unindexed_service_numbers(self, servicedate, store_type):
+        """
+        Internal method to retrieve the service numbers of a single store type
+        which are not in the arrival time index, because they were stored before
+        the index existed or have no arrival time at their last stop.
+        """
+
+        set_key = 'services:%s:%s' % (store_type, servicedate)
+        arrivals_key = 'services:%s:%s:arrivals' % (store_type, servicedate)
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(arrivals_key)
+        pipe.scard(set_key)
+        index_size, set_size = pipe.execute()
+
+        if index_size == set_size:
+            return set()
+
+        return set(self.redis.smembers(set_key)) - set(self.redis.execute_command('zrange', arrivals_key, 0, -1))
+
+    def get_service_numbers_page(self, servicedate, service_type=TYPE_ACTUAL_OR_SCHEDULED, cursor=None, count=100):
+        """
+        Retrieve a page of sorted service numbers for a given date.
+
+        Args:
+            servicedate (string): Service date (YYYY-MM-DD)
+            service_type (string, optional): Store type
+                (default: both actual and scheduled)
+            cursor (string, optional): Cursor returned for the previous page
+                (default: start at the first page)
+            count (int, optional): Number of service numbers per page
+
+        Returns:
+            tuple: list of service numbers, cursor for the next page
+                (None when this is the last page)
+        """
+
+        servicenumbers = list(itertools.islice(
+            self.iter_service_numbers(servicedate, service_type, cursor, count), count + 1))
+
+        if len(servicenumbers) > count:
+            return servicenumbers[:count], servicenumbers[count - 1]
+        else:
+            return servicenumbers, None
+
+    def _iter_service_number_index(self, servicedate, store_type, start, batch_size):
+        """
+        Internal method to iterate over the sorted service number index
+        of a single store type.
+        """
+
+        index_key = 'services:%s:%s:index' % (store_type, servicedate)
+        set_key = 'services:%s:%s' % (store_type, servicedate)
+
+        # Build the index for service dates stored before the index existed.
+        # Storing a service for such a date adds only that service to the
+        # index, so the index is also rebuilt when it is not complete. Indexes
+        # built before numeric scores were used (score 0 for all service
+        # numbers) are rebuilt as well:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(index_key)
+        pipe.scard(set_key)
+        pipe.execute_command('zcount', index_key, '(0', '+inf')
+        pipe.execute_command('zrangebylex', index_key, '[1', '(:', 'limit', 0, 1)
+        index_size, set_size, positive_count, first_numeric = pipe.execute()
+
+        if index_size != set_size or (positive_count == 0 and len(first_numeric) > 0 and
+                                      self._get_index_score(first_numeric[0]) > 0):
+            self._build_service_number_index(servicedate, store_type)
+
+        while True:
+            if start is None:
+                servicenumbers = self.redis.execute_command('zrangebyscore', index_key, '-inf', '+inf',
+                                                            'limit', 0, batch_size)
+                batch = servicenumbers
+            else:
+                # Service numbers with the same score are sorted alphabetically,
+                # continue with those after start first:
+                start_score = self._get_index_score(start)
+                servicenumbers = [servicenumber for servicenumber
+                                  in self.redis.execute_command('zrangebyscore', index_key,
+                                                               start_score, start_score)
+                                  if servicenumber > start]
+
+                batch = self.redis.execute_command('zrangebyscore', index_key, '(%d' % start_score, '+inf',
+                                                   'limit', 0, batch_size)
+                servicenumbers.extend(batch)
+
+            for servicenumber in servicenumbers:
+                yield servicenumber
+
+            if len(batch) < batch_size:
+                return
+
+            start = servicenumbers[-1]
+
+    def _build_service_number_index(self, servicedate, store_type):
+        """
+        Internal method to build the sorted service number index from the
+        set of service numbers.
+        """
+
+        index_key = 'services:%s:%s:index' % (store_type, servicedate)
+        servicenumbers = list(self.redis.smembers('services:%s:%s' % (store_type, servicedate)))
+
+        # Replace the index in a single transaction, so readers never see a partial index:
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(index_key)
+
+        for offset in range(0, len(servicenumbers), 1000):
+            arguments = []
+            for servicenumber in servicenumbers[offset:offset + 1000]:
+                arguments.extend([self._get_index_score(servicenumber), servicenumber])
+
+            pipe.execute_command('zadd', index_key, *arguments)
+
+        pipe.execute()
+
+    def _get_index_score(self, servicenumber):
+        """
+        Internal method to determine the score of a service number in the
+        sorted index: the number itself for numeric service numbers, 0 for
+        other service numbers (which are then sorted alphabetically).
+        """
+
+        try:
+            return int(servicenumber)
+        except ValueError:
+            return 0
+
     def get_service(self, servicedate, servicenumber, service_type=TYPE_ACTUAL_OR_SCHEDULED):
         """
         Get details for a given servicenumber on a given date.
@@ -181,6 +529,65 @@ class ServiceStore(object):
 
         return services
 
+    def get_services(self, servicedate, servicenumbers, service_type=TYPE_ACTUAL_OR_SCHEDULED):
+        """
+        Get details for multiple servicenumbers on a given date.
+        All data is retrieved with two pipelined Redis requests, regardless of
+        the number of servicenumbers.
+
+        Args:
+            servicedate (string): Service date (YYYY-MM-DD)
+            servicenumbers (list): List of service numbers
+            type (string, optional): Store type (default: actual if available,
+                otherwise scheduled)
+
+        Returns:
+            dict: Dictionary with servicenumber as key and a list of service
+                objects as value. The value is None for services not found.
+        """
+
+        if service_type == self.TYPE_ACTUAL_OR_SCHEDULED:
+            store_types = [self.TYPE_ACTUAL, self.TYPE_SCHEDULED]
+        else:
+            store_types = [service_type]
+
+        # Retrieve service IDs for all servicenumbers and store types:
+        pipe = self.redis.pipeline(transaction=False)
+        for servicenumber in servicenumbers:
+            for store_type in store_types:
+                pipe.sismember('services:%s:%s' % (store_type, servicedate), servicenumber)
+                pipe.smembers('services:%s:%s:%s' % (store_type, servicedate, servicenumber))
+        results = iter(pipe.execute())
+
+        # Determine service IDs, actual services override scheduled services:
+        service_ids = {}
+        for servicenumber in servicenumbers:
+            for store_type in store_types:
+                is_member = next(results)
+                ids = next(results)
+
+                if is_member and servicenumber not in service_ids:
+                    service_ids[servicenumber] = (store_type, ids)
+
+        # Retrieve service information for all service IDs:
+        pipe = self.redis.pipeline(transaction=False)
+        for store_type, ids in service_ids.values():
+            for service_id in ids:
+                pipe.hgetall('schedule:%s:%s:%s:info' % (store_type, servicedate, service_id))
+        results = iter(pipe.execute())
+
+        services = {}
+        for servicenumber in servicenumbers:
+            services[servicenumber] = None
+
+        for servicenumber, (store_type, ids) in service_ids.items():
+            services[servicenumber] = []
+            for service_id in ids:
+                services[servicenumber].append(
+                    self._parse_service_data(servicedate, service_id, store_type, next(results)))
+
+        return services
+
     def get_service_metadata(self, servicedate, servicenumber, service_type=TYPE_ACTUAL_OR_SCHEDULED):
         """
         Get metadata for a given servicenumber on a given date.
@@ -246,21 +653,37 @@ class ServiceStore(object):
             serviceinfo.data.Service: Service object
         """
 
-        service = Service()
-
-        service.service_id = service_id
-        service.service_date = isodate.parse_date(servicedate)
-        service.source = service_type
-
         # Determine Redis key prefix:
         key_prefix = 'schedule:%s:%s:%s' % (service_type, servicedate, service_id)
 
         # Get metadata:
         service_data = self.redis.hgetall('%s:info' % key_prefix)
 
+        return self._parse_service_data(servicedate, service_id, service_type, service_data)
+
+    def _parse_service_data(self, servicedate, service_id, service_type, service_data):
+        """
+        Internal method to convert a service information hash to a Service object.
+
+        Args:
+            servicedate (string): Service date (YYYY-MM-DD)
+            service_id (int): Service id
+            service_type (string): Store type (TYPE_ACTUAL or TYPE_SCHEDULED)
+            service_data (dict): Service information hash as stored in Redis
+
+        Returns:
+            serviceinfo.data.Service: Service object, None when service_data is empty
+        """
+
         if len(service_data) == 0:
             return None
 
+        service = Service()
+
+        service.service_id = service_id
+        service.service_date = isodate.parse_date(servicedate)
+        service.source = service_type
+
         service.cancelled = (service_data['cancelled'] == 'True')
         service.company_code = service_data['company_code']
         service.company_name = service_data['company_name']
@@ -353,6 +776,46 @@ class ServiceStore(object):
 
         return services
 
+    def get_services_departing(self, from_time, to_time):
+        """
+        Retrieve services which may depart from a stop between two times:
+        services which did not arrive at their last stop (including delay)
+        before from_time and depart from their first stop before to_time.
+        Candidates are selected with the arrival time index and retrieved
+        with pipelined requests. Services of the previous service date may
+        still run after the start of a service date (4:00), and the window
+        may end on the next service date, so all these dates are searched.
+
+        Args:
+            from_time (datetime): Start of the time window
+            to_time (datetime): End of the time window
+
+        Returns:
+            list: List of serviceinfo.data.Service objects
+        """
+
+        service_date = util.get_service_date(from_time) - datetime.timedelta(days=1)
+        last_service_date = util.get_service_date(to_time)
+
+        services = []
+
+        while service_date <= last_service_date:
+            service_date_str = util.datetime_to_iso(service_date)
+            service_numbers = self.get_running_service_numbers(service_date_str, after=from_time)
+
+            for service_list in self.get_services(service_date_str, service_numbers).values():
+                for service in service_list or []:
+                    if service is None or len(service.stops) == 0:
+                        continue
+
+                    first_departure = service.stops[0].departure_time
+                    if first_departure is None or first_departure <= to_time:
+                        services.append(service)
+
+            service_date += datetime.timedelta(days=1)
+
+        return services
+
     def delete_service(self, servicedate, servicenumber, store_type):
         """
         Delete a service from the service store
@@ -392,28 +855,136 @@ class ServiceStore(object):
         for servicenumber in servicenumbers:
             self.redis.delete('services:%s:%s:%s' % (store_type, servicedate,
                 servicenumber))
+            self.redis.delete('services:%s:%s:%s:arrivals' % (store_type, servicedate,
+                servicenumber))
 
             self.redis.srem('services:%s:%s' % (store_type, servicedate),
                 servicenumber)
 
+            self.redis.execute_command('zrem', 'services:%s:%s:index' % (store_type, servicedate),
+                servicenumber)
+
+            self.redis.execute_command('zrem', 'services:%s:%s:arrivals' % (store_type, servicedate),
+                servicenumber)
+
         # Check whether servicedate can be removed:
         if not self.redis.exists('services:%s:%s' % (store_type, servicedate)):
             # Service date not in use anymore, delete it:
             self.redis.srem('services:%s:date' % store_type, servicedate)
 
+        # Publish change event:
+        company = None
+        stops = []
+
+        if service is not None:
+            company = service.company_code
+            stops = [stop.stop_code for stop in service.stops]
+
+        self._publish_change('delete', servicedate, servicenumbers[0], store_type, company, stops)
+
         return True
 
-    def _delete_service_id(self, servicedate, service_id, store_type):
+    def _get_arrival_timestamp(self, service):
+        """
+        Internal method to determine the expected arrival time (including
+        delay) at the last stop of a service, as Unix timestamp.
+        Returns None when the last stop has no arrival or departure time.
+        """
+
+        last_stop = service.stops[-1]
+
+        if last_stop.arrival_time is not None:
+            arrival = last_stop.arrival_time + datetime.timedelta(minutes=last_stop.arrival_delay)
+        elif last_stop.departure_time is not None:
+            arrival = last_stop.departure_time + datetime.timedelta(minutes=last_stop.departure_delay)
+        else:
+            return None
+
+        return util.datetime_to_timestamp(arrival)
+
+    def _publish_change(self, action, servicedate, servicenumber, store_type, company, stops,
+                        version=None, pipe=None):
+        """
+        Internal method to publish a change event for a service.
+        Each change gets a new version number, which is increasing over all services.
+
+        Args:
+            action (string): 'store' or 'delete'
+            servicedate (string): Service date in YYYY-MM-DD format
+            servicenumber (string): Service number
+            store_type (string): Store type (actual or scheduled)
+            company (string): Company code
+            stops (list): List of stop codes
+            version (int, optional): Version number, when it is already
+                reserved (default: a new version number is used)
+            pipe (optional): Redis pipeline to publish the event with
+
+        Returns:
+            int: version number of this change
+        """
+
+        if version is None:
+            version = self.redis.incr('services:version')
+
+        if pipe is None:
+            pipe = self.redis
+
+        event = {'action': action,
+                 'service_date': servicedate,
+                 'service_number': str(servicenumber),
+                 'type': store_type,
+                 'version': version,
+                 'company': company,
+                 'stops': stops
+                }
+
+        pipe.publish(self.CHANGES_CHANNEL, json.dumps(event))
+
+        return version
+
+    def listen_changes(self, timeout=None):
+        """
+        Listen for change events. Blocks until the next change is published.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait for
+                a change (default: wait until the next change)
+
+        Returns:
+            iterator: change events (dicts with action, service_date, service_number,
+                type, version, company and stops), or None when no change
+                was published within the timeout
         """
-        Internal method to delete service details from the service store
+
+        pubsub = self.redis.pubsub()
+        pubsub.subscribe(self.CHANGES_CHANNEL)
+
+        try:
+            while True:
+                message = pubsub.get_message(timeout=timeout)
+
+                if message is None:
+                    yield None
+                elif message['type'] == 'message':
+                    yield json.loads(message['data'])
+        finally:
+            pubsub.close()
+
+    def _delete_service_id(self, servicedate, service_id, store_type, pipe=None):
+        """
+        Internal method to delete service details from the service store,
+        or to add the deletes to a pipeline
         """
 
+        if pipe is None:
+            pipe = self.redis
+
         # Determine Redis key prefix:
         key_prefix = 'schedule:%s:%s:%s' %(store_type, servicedate, service_id)
 
-        self.redis.delete('%s:info' % key_prefix)
+        pipe.delete('%s:info' % key_prefix)
 
-        self.redis.srem('schedule:%s:%s' % (store_type, servicedate), service_id)
+        pipe.srem('schedule:%s:%s' % (store_type, servicedate), service_id)
 
     def get_service_dates(self, store_type=TYPE_ACTUAL_OR_SCHEDULED):
         """
@@ -56,12 +56,40 @@ class Statistics(object):
         """
         self._increment_counter("stats:services")
 
+    def get_sent_injections(self):
+        """
+        Get the total number of injections sent to DVS
+        :return: Number of sent injections
+        """
+        return self._get_counter("stats:injections:sent")
+
+    def get_skipped_injections(self):
+        """
+        Get the total number of injections skipped because the departure did not change
+        :return: Number of skipped injections
+        """
+        return self._get_counter("stats:injections:skipped")
+
+    def increment_sent_injections(self, amount=1):
+        """
+        Increment the sent injections counter
+        """
+        self._increment_counter("stats:injections:sent", amount)
+
+    def increment_skipped_injections(self, amount=1):
+        """
+        Increment the skipped injections counter
+        """
+        self._increment_counter("stats:injections:skipped", amount)
+
     def reset_counters(self):
         """
         Reset all counters to zero
         """
         self.redis.delete("stats:messages")
         self.redis.delete("stats:services")
+        self.redis.delete("stats:injections:sent")
+        self.redis.delete("stats:injections:skipped")
 
     def get_stored_services(self, store_type):
         """
@@ -83,9 +111,9 @@ class Statistics(object):
         else:
             return int(value)
 
-    def _increment_counter(self, counter):
+    def _increment_counter(self, counter, amount=1):
         try:
-            self.redis.incr(counter)
+            self.redis.incr(counter, amount)
         except redis.ResponseError as e:
             # Wrap around max 64bit:
             if e.message == 'increment or decrement would overflow':
@@ -5,6 +5,7 @@ Utility methods and functions, like methods for parsing SQL datetimes
 and magic for determining the correct servicedate for a given datetime.
 """
 
+import calendar
 import datetime
 import isodate
 from pytz import timezone
@@ -79,6 +80,22 @@ def datetime_to_iso(date_time):
         return date_time.isoformat()
 
 
+def datetime_to_timestamp(date_time):
+    """
+    Convert a datetime object to a Unix timestamp. Datetimes without
+    timezone are assumed to be in the normal Dutch timezone.
+    Returns None when date_time is None.
+    """
+
+    if date_time is None:
+        return None
+
+    if date_time.tzinfo is None:
+        date_time = get_localized_datetime(date_time)
+
+    return calendar.timegm(date_time.utctimetuple())
+
+
 def get_service_date(date_time):
     """
     Retrieve a sensible servicedate for a given datetime.
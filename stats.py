@@ -42,6 +42,10 @@ if args.COUNTER == 'messages':
     print stats.get_processed_messages()
 elif args.COUNTER == 'services':
     print stats.get_processed_services()
+elif args.COUNTER == 'injections_sent':
+    print stats.get_sent_injections()
+elif args.COUNTER == 'injections_skipped':
+    print stats.get_skipped_injections()
 elif args.COUNTER == 'actual_services':
     print stats.get_stored_services('actual')
 elif args.COUNTER == 'scheduled_services':
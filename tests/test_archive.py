@@ -34,6 +34,13 @@ class ArchiveTests(unittest.TestCase):
 
         self.store_config = config['schedule_store']
 
+        # Remove archived services and saved progress from previous tests:
+        cursor = self.archive.archive_connection.cursor()
+        cursor.execute("DELETE FROM services WHERE service_date = %s", [self.service_date_str])
+        cursor.execute("DELETE FROM archive_progress WHERE service_date = %s", [self.service_date_str])
+        self.archive.archive_connection.commit()
+        cursor.close()
+
     def _create_stop_object(self, stop_code, stop_name):
         stop = data.ServiceStop(stop_code)
         stop.stop_name = stop_name
@@ -229,6 +236,285 @@ class ArchiveTests(unittest.TestCase):
 
         store.trash_store(self.service_date_str, store.TYPE_SCHEDULED)
 
+    def test_store_archive_bulk(self):
+        numbers = [5555, 6666, 7777]
+        store = service_store.ServiceStore(self.store_config)
+
+        for number in numbers:
+            service = self._create_service_object()
+            service.servicenumber = number
+            service.service_id = number
+            store.store_services([service], store.TYPE_SCHEDULED)
+
+        self.archive.bulk_size = 2
+        self.archive.store_archive()
+
+        store.trash_store(self.service_date_str, store.TYPE_SCHEDULED)
+
+        # Verify all services are stored with their stops:
+        cursor = self.archive.archive_connection.cursor()
+        for number in numbers:
+            cursor.execute("""
+                SELECT s.id, COUNT(*) FROM services s
+                JOIN stops st ON st.service_id = s.id
+                WHERE s.service_date = %s AND s.service_number = %s
+                GROUP BY s.id
+                ORDER BY s.id DESC
+                LIMIT 1""", [self.service_date_str, number])
+            row = cursor.fetchone()
+            self.assertIsNotNone(row, "Service %s should be archived" % number)
+            self.assertEqual(row[1], 4, "Service %s should have 4 stops" % number)
+        cursor.close()
+
+    def test_store_archive_resume(self):
+        numbers = [5555, 6666, 7777]
+        store = service_store.ServiceStore(self.store_config)
+
+        for number in numbers:
+            service = self._create_service_object()
+            service.servicenumber = number
+            service.service_id = number
+            store.store_services([service], store.TYPE_SCHEDULED)
+
+        # Pretend an earlier run was interrupted after service 5555:
+        cursor = self.archive.archive_connection.cursor()
+        self.archive._commit_progress('5555', False, cursor)
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM services")
+        max_id = cursor.fetchone()[0]
+
+        self.archive.commit_size = 1
+        self.archive.store_archive()
+
+        cursor.execute("SELECT service_number FROM services WHERE id > %s ORDER BY service_number", [max_id])
+        self.assertEqual([row[0] for row in cursor.fetchall()], ['6666', '7777'])
+        self.assertEqual(self.archive._get_progress(cursor), ('7777', True))
+
+        # Completed service dates should be skipped:
+        self.archive.store_archive()
+        cursor.execute("SELECT COUNT(*) FROM services WHERE id > %s", [max_id])
+        self.assertEqual(cursor.fetchone()[0], 2)
+        cursor.close()
+
+        store.trash_store(self.service_date_str, store.TYPE_SCHEDULED)
+
+    def test_store_archive_restart(self):
+        numbers = [5555, 6666, 7777]
+        store = service_store.ServiceStore(self.store_config)
+
+        for number in numbers:
+            service = self._create_service_object()
+            service.servicenumber = number
+            service.service_id = number
+            store.store_services([service], store.TYPE_SCHEDULED)
+
+        self.archive.store_archive()
+        self.archive.store_archive(restart=True)
+
+        # Every service should be archived exactly once, with its stops:
+        cursor = self.archive.archive_connection.cursor()
+        cursor.execute("""
+            SELECT s.service_number, COUNT(*) FROM services s
+            JOIN stops st ON st.service_id = s.id
+            WHERE s.service_date = %s
+            GROUP BY s.id
+            ORDER BY s.service_number""", [self.service_date_str])
+        self.assertEqual([(row[0], row[1]) for row in cursor.fetchall()], [('5555', 4), ('6666', 4), ('7777', 4)])
+        cursor.close()
+
+        store.trash_store(self.service_date_str, store.TYPE_SCHEDULED)
+
+    def test_store_archive_wings(self):
+        store = service_store.ServiceStore(self.store_config)
+
+        # Split service with two wings, with ARNU service IDs:
+        services = []
+        for service_id, last_stop in [("1234-asd-kkd", "kkd"), ("1234-asd-ah", "ah")]:
+            service = self._create_service_object()
+            service.service_id = service_id
+            if last_stop == "ah":
+                service.stops.pop()
+            services.append(service)
+
+        store.store_services(services, store.TYPE_ACTUAL)
+
+        self.archive.store_archive()
+
+        # Wings should not collide, and should not be archived again:
+        other_archive = archive.Archive(self.service_date, self.archive.archive_config, self.store_config)
+        other_archive.store_finished(now=datetime.datetime(year=2015, month=4, day=2, hour=12))
+
+        cursor = self.archive.archive_connection.cursor()
+        cursor.execute("""
+            SELECT service_id FROM services
+            WHERE service_date = %s AND service_number = '1234'
+            ORDER BY service_id""", [self.service_date_str])
+        self.assertEqual([row[0] for row in cursor.fetchall()], ["1234-asd-ah", "1234-asd-kkd"])
+        cursor.close()
+
+        store.trash_store(self.service_date_str, store.TYPE_ACTUAL)
+
+    def test_store_archive_overlapping(self):
+        store = service_store.ServiceStore(self.store_config)
+        service = self._create_service_object()
+        service.service_id = 1234
+        store.store_services([service], store.TYPE_SCHEDULED)
+
+        self.archive.store_archive()
+
+        # Overlapping runs which did not see the archived service, in normal and bulk mode:
+        for bulk_size in [0, 10]:
+            other_archive = archive.Archive(self.service_date, self.archive.archive_config, self.store_config,
+                                            bulk_size=bulk_size)
+            cursor = other_archive.archive_connection.cursor()
+            other_archive._archive_service([service], 1234, cursor)
+            other_archive._commit(cursor)
+            cursor.close()
+
+        # The service should be archived once, with its stops:
+        cursor = self.archive.archive_connection.cursor()
+        cursor.execute("""
+            SELECT s.service_number, COUNT(*) FROM services s
+            JOIN stops st ON st.service_id = s.id
+            WHERE s.service_date = %s
+            GROUP BY s.id""", [self.service_date_str])
+        self.assertEqual([(row[0], row[1]) for row in cursor.fetchall()], [('1234', 4)])
+        cursor.close()
+
+        store.trash_store(self.service_date_str, store.TYPE_SCHEDULED)
+
+    def test_store_archive_workers(self):
+        numbers = [5555, 6666, 7777, 8888]
+        store = service_store.ServiceStore(self.store_config)
+
+        for number in numbers:
+            service = self._create_service_object()
+            service.servicenumber = number
+            service.service_id = number
+            store.store_services([service], store.TYPE_SCHEDULED)
+
+        cursor = self.archive.archive_connection.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM services")
+        max_id = cursor.fetchone()[0]
+
+        # Archive both partitions:
+        for worker in range(2):
+            self.archive.worker = worker
+            self.archive.workers = 2
+            self.archive.store_archive()
+            self.assertEqual(self.archive._get_progress(cursor)[1], True)
+
+        # Every service should be archived exactly once:
+        cursor.execute("SELECT service_number FROM services WHERE id > %s ORDER BY service_number", [max_id])
+        self.assertEqual([row[0] for row in cursor.fetchall()], ['5555', '6666', '7777', '8888'])
+        cursor.close()
+
+        store.trash_store(self.service_date_str, store.TYPE_SCHEDULED)
+
+    def test_service_partitions(self):
+        self.archive.workers = 3
+
+        partitions = [self.archive._get_partition(number) for number in range(1000, 2000)]
+        self.assertEqual(set(partitions), set([0, 1, 2]))
+        self.assertEqual(self.archive._get_partition(1234), self.archive._get_partition('1234'))
+
+    def test_store_finished(self):
+        store = service_store.ServiceStore(self.store_config)
+        store.trash_store(self.service_date_str, store.TYPE_SCHEDULED)
+
+        # Service 5555 arrives at 12:00, service 6666 at 14:00:
+        for number, hour in [(5555, 12), (6666, 14)]:
+            service = self._create_service_object()
+            service.servicenumber = number
+            service.service_id = number
+            service.stops[-1].arrival_time = datetime.datetime(year=2015, month=4, day=1, hour=hour)
+            store.store_services([service], store.TYPE_SCHEDULED)
+
+        now = datetime.datetime(year=2015, month=4, day=1, hour=13)
+        self.assertEqual(self.archive.store_finished(30, now), 1)
+
+        # Archiving again should not store services twice:
+        now = datetime.datetime(year=2015, month=4, day=1, hour=15)
+        self.assertEqual(self.archive.store_finished(30, now), 1)
+        self.assertEqual(self.archive.store_finished(30, now), 0)
+
+        # A full archive run only stores the remaining services:
+        self.archive.store_archive()
+
+        cursor = self.archive.archive_connection.cursor()
+        cursor.execute("SELECT service_number, service_id FROM services WHERE service_date = %s ORDER BY id",
+                       [self.service_date_str])
+        self.assertEqual([(row[0], row[1]) for row in cursor.fetchall()], [('5555', 5555), ('6666', 6666)])
+        cursor.close()
+
+        store.trash_store(self.service_date_str, store.TYPE_SCHEDULED)
+
+    def test_store_dimensions(self):
+        self.archive.store_station("kkd", "Köln-Deutz")
+        self.archive.store_transport_mode("ICE", "ICE International")
+        self.assertEqual(self.archive.new_stations, {"kkd": "Köln-Deutz"})
+
+        # Known stations are not written again:
+        self.archive.store_station("kkd", "Köln-Deutz")
+        self.assertEqual(len(self.archive.new_stations), 1)
+
+        self.archive._flush_dimensions()
+        self.assertEqual(self.archive.new_stations, {})
+        self.assertEqual(self.archive.new_transport_modes, {})
+
+        # New archive instance should preload the stored rows:
+        config = common.load_config("config/serviceinfo-unittest.yaml")
+        other_archive = archive.Archive(self.service_date, config['archive_database'], config['schedule_store'])
+        cursor = other_archive.archive_connection.cursor()
+        other_archive._load_dimensions(cursor)
+        cursor.close()
+
+        self.assertIn("kkd", other_archive.station_cache)
+        self.assertIn("ICE", other_archive.transport_mode_cache)
+
+    def test_upgrade_schema(self):
+        # Archive created before the service_id column and the progress and sequences tables existed:
+        cursor = self.archive.archive_connection.cursor()
+        cursor.execute("DROP TABLE archive_progress, sequences")
+        cursor.execute("""
+            ALTER TABLE services
+              DROP KEY service_date_service_number_service_id,
+              DROP COLUMN service_id,
+              ADD KEY service_date_service_number (service_date, service_number)""")
+
+        self.archive._upgrade_schema()
+
+        cursor.execute("SELECT COUNT(*) FROM archive_progress")
+        self.assertEqual(cursor.fetchone()[0], 0)
+        cursor.execute("SHOW CREATE TABLE services")
+        table = cursor.fetchone()[1]
+        self.assertIn("`service_id` varchar(32) DEFAULT NULL", table)
+        self.assertIn("UNIQUE KEY `service_date_service_number_service_id`", table)
+        self.assertNotIn("KEY `service_date_service_number` ", table)
+        cursor.close()
+
+        self.assertGreater(self.archive._reserve_service_ids(1), 0)
+
+    def test_reserve_service_ids(self):
+        first_id = self.archive._reserve_service_ids(10)
+        second_id = self.archive._reserve_service_ids(5)
+
+        self.assertGreaterEqual(second_id, first_id + 10)
+
+        # Services stored in normal mode should use the sequence as well:
+        store = service_store.ServiceStore(self.store_config)
+        service = self._create_service_object()
+        service.service_id = 1234
+        store.store_services([service], store.TYPE_SCHEDULED)
+
+        self.archive.store_archive()
+
+        cursor = self.archive.archive_connection.cursor()
+        cursor.execute("SELECT id FROM services WHERE service_date = %s", [self.service_date_str])
+        self.assertEqual(cursor.fetchone()[0], second_id + 5)
+        cursor.close()
+
+        store.trash_store(self.service_date_str, store.TYPE_SCHEDULED)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,77 @@
+import serviceinfo.delay_statistics as delay_statistics
+import serviceinfo.export as export
+
+import datetime
+import unittest
+
+
+class DelayStatisticsTests(unittest.TestCase):
+    def _create_columns(self):
+        """
+        Create columns for three services of two companies, with arrival
+        delays of 0, 2, 4 and 6 minutes at every stop after the first stop
+        """
+
+        rows = []
+
+        for service_id, company, cancelled in [(1, 'ns', False), (2, 'ns', False), (3, 'arriva', True)]:
+            for stop_nr, stop in enumerate(['ut', 'ht', 'ehv', 'hrl', 'mt']):
+                rows.append({
+                    'service_id': service_id,
+                    'service_number': str(service_id),
+                    'company': company,
+                    'transport_mode': 'IC',
+                    'cancelled': cancelled,
+                    'stop_nr': stop_nr,
+                    'stop': stop,
+                    'arrival': datetime.datetime(2015, 4, 1, 12, stop_nr * 10) if stop_nr > 0 else None,
+                    'departure': datetime.datetime(2015, 4, 1, 12, stop_nr * 10 + 1),
+                    'arrival_delay': (stop_nr - 1) * 2 if stop_nr > 0 else 0,
+                    'departure_delay': 0,
+                    'arrival_cancelled': service_id == 2 and stop_nr == 4,
+                    'departure_cancelled': False,
+                    'arrival_platform': None,
+                    'departure_platform': None,
+                })
+
+        return export.rows_to_columns(rows)
+
+    def test_company_statistics(self):
+        statistics = delay_statistics.get_delay_statistics(self._create_columns(), delay_statistics.GROUP_COMPANY)
+
+        self.assertEqual([group['key'] for group in statistics], ['ns', 'arriva'])
+
+        ns = statistics[0]
+        self.assertEqual(ns['arrivals'], 8)
+        self.assertEqual(ns['cancelled'], 1)
+        self.assertAlmostEqual(ns['cancellation_rate'], 1 / 8.0)
+
+        # Delays 0, 2, 4, 6 and 0, 2, 4 (cancelled arrival is excluded):
+        self.assertAlmostEqual(ns['punctuality'], 6 / 7.0)
+        self.assertAlmostEqual(ns['mean_delay'], 18 / 7.0)
+        self.assertEqual(ns['p50'], 2)
+        self.assertEqual(ns['p90'], 6)
+
+        # Fully cancelled service:
+        arriva = statistics[1]
+        self.assertEqual(arriva['arrivals'], 4)
+        self.assertEqual(arriva['cancellation_rate'], 1.0)
+        self.assertIsNone(arriva['punctuality'])
+        self.assertIsNone(arriva['p50'])
+
+    def test_station_statistics(self):
+        statistics = delay_statistics.get_delay_statistics(self._create_columns(), delay_statistics.GROUP_STATION,
+                                                           threshold=3)
+        statistics = dict((group['key'], group) for group in statistics)
+
+        # No arrivals at the first stop:
+        self.assertNotIn('ut', statistics)
+
+        self.assertEqual(statistics['ht']['arrivals'], 3)
+        self.assertEqual(statistics['ht']['punctuality'], 1.0)
+        self.assertEqual(statistics['hrl']['punctuality'], 0.0)
+        self.assertEqual(statistics['mt']['p95'], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
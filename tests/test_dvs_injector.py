@@ -0,0 +1,136 @@
+import imp
+import json
+import os
+
+import unittest
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+dvs_injector = imp.load_source('dvs_injector', os.path.join(ROOT_PATH, 'dvs-injector.py'))
+
+
+class FakeReceiver(object):
+    """
+    Replaces the DEALER socket and the poller of an Injector. The reply function
+    returns the reply for an injection, None to never reply, or 'late' to reply
+    only after the next timeout.
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.requests = []
+        self.replies = []
+        self.late_replies = []
+        self.reconnects = 0
+
+    def send_multipart(self, frames):
+        self.requests.append(frames)
+
+        result = self.reply(json.loads(frames[2]))
+        if result == 'late':
+            self.late_replies.append([frames[0], '', json.dumps({'result': True})])
+        elif result is not None:
+            self.replies.append([frames[0], '', json.dumps(result)])
+
+    def recv_multipart(self):
+        return self.replies.pop(0)
+
+    def poll(self, timeout):
+        if len(self.replies) > 0:
+            return True
+
+        if timeout > 0:
+            self.replies.extend(self.late_replies)
+            self.late_replies = []
+
+        return False
+
+    def unregister(self, socket):
+        pass
+
+    def close(self):
+        self.reconnects += 1
+
+
+class FakeCache(object):
+    def __init__(self):
+        self.sent = []
+
+    def set_sent(self, injections):
+        self.sent.extend(injections)
+
+
+class InjectorTest(unittest.TestCase):
+    def _prepare_injector(self, reply, max_in_flight=2):
+        injector = dvs_injector.Injector.__new__(dvs_injector.Injector)
+        injector.max_in_flight = max_in_flight
+        injector.timeout = 1000
+        injector.client = injector.poller = FakeReceiver(reply)
+
+        # The fake receiver is kept when the socket is reopened:
+        injector._connect = lambda: None
+
+        return injector
+
+    def _prepare_injections(self, service_ids):
+        return [{'service_id': service_id, 'stop_code': 'ut'} for service_id in service_ids]
+
+    def test_inject(self):
+        injector = self._prepare_injector(lambda inject: {'result': inject['service_id'] != 'i2'})
+        injections = self._prepare_injections(['i1', 'i2', 'i3', 'i4', 'i5'])
+        cache = FakeCache()
+
+        self.assertEqual(injector.inject(injections, cache), 4)
+        self.assertEqual([inject['service_id'] for inject in cache.sent], ['i1', 'i3', 'i4', 'i5'])
+
+        # Every request has a unique correlation ID, followed by the empty delimiter:
+        requests = injector.client.requests
+        self.assertEqual(len(requests), 5)
+        self.assertEqual(len(set(frames[0] for frames in requests)), 5)
+        self.assertEqual(set(frames[1] for frames in requests), set(['']))
+
+    def test_inject_timeout(self):
+        # No reply for i1, the other injections are still sent:
+        injector = self._prepare_injector(lambda inject: None if inject['service_id'] == 'i1' else {'result': True})
+        cache = FakeCache()
+
+        self.assertEqual(injector.inject(self._prepare_injections(['i1', 'i2', 'i3']), cache), 2)
+        self.assertEqual([inject['service_id'] for inject in cache.sent], ['i2', 'i3'])
+
+        # The socket is reopened after the timeout:
+        self.assertEqual(injector.client.reconnects, 1)
+
+    def test_inject_late_reply(self):
+        injector = self._prepare_injector(lambda inject: 'late' if inject['service_id'] == 'i1' else {'result': True})
+        cache = FakeCache()
+
+        self.assertEqual(injector.inject(self._prepare_injections(['i1', 'i2', 'i3']), cache), 2)
+
+        # The late reply for i1 is received in the next run, and should not confirm i4:
+        injector.client.reply = lambda inject: None
+        self.assertEqual(injector.inject(self._prepare_injections(['i4']), cache), 0)
+        self.assertEqual([inject['service_id'] for inject in cache.sent], ['i2', 'i3'])
+
+    def test_inject_abort(self):
+        # Server does not reply at all, only the first injections are sent:
+        injector = self._prepare_injector(lambda inject: None)
+        cache = FakeCache()
+
+        self.assertEqual(injector.inject(self._prepare_injections(['i1', 'i2', 'i3', 'i4', 'i5']), cache), 0)
+        self.assertEqual(len(injector.client.requests), 2)
+        self.assertEqual(cache.sent, [])
+
+    def test_inject_unreachable(self):
+        # Sends time out when the server is not connected:
+        def reply(inject):
+            raise dvs_injector.zmq.Again()
+
+        injector = self._prepare_injector(reply)
+        cache = FakeCache()
+
+        self.assertEqual(injector.inject(self._prepare_injections(['i1', 'i2', 'i3']), cache), 0)
+        # Only the first injection is attempted:
+        self.assertEqual(len(injector.client.requests), 1)
+        self.assertEqual(cache.sent, [])
+
+if __name__ == '__main__':
+    unittest.main()
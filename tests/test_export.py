@@ -0,0 +1,111 @@
+# coding=utf-8
+
+import serviceinfo.export as export
+
+import datetime
+import shutil
+import tempfile
+import unittest
+
+
+class ExportTests(unittest.TestCase):
+    service_date = datetime.date(year=2015, month=4, day=1)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _create_rows(self):
+        rows = []
+
+        for service_id, servicenumber in [(10, '1234'), (11, 'i3')]:
+            for stop_nr, stop in enumerate(['ut', 'asd', u'kkd']):
+                rows.append({
+                    'service_id': service_id,
+                    'service_number': servicenumber,
+                    'company': 'ns',
+                    'transport_mode': 'IC',
+                    'cancelled': False,
+                    'stop_nr': stop_nr,
+                    'stop': stop,
+                    'arrival': datetime.datetime(2015, 4, 1, 12, stop_nr * 10) if stop_nr > 0 else None,
+                    'departure': datetime.datetime(2015, 4, 1, 12, stop_nr * 10 + 1) if stop_nr < 2 else None,
+                    'arrival_delay': stop_nr * 2,
+                    'departure_delay': 0,
+                    'arrival_cancelled': stop_nr == 2,
+                    'departure_cancelled': False,
+                    'arrival_platform': '5b' if stop_nr > 0 else None,
+                    'departure_platform': None,
+                })
+
+        return rows
+
+    def _assert_columns(self, columns):
+        self.assertEqual(list(columns['service_id']), [10, 10, 10, 11, 11, 11])
+        self.assertEqual(columns['arrival_delay'].dtype.name, 'int16')
+
+        # 2015-04-01 12:10 in the Dutch timezone:
+        self.assertEqual(columns['arrival'][1], 1427883000)
+        self.assertEqual(columns['arrival'][0], export.NO_TIME)
+        self.assertEqual(columns['departure'][2], export.NO_TIME)
+        self.assertEqual(list(columns['arrival_cancelled']), [False, False, True] * 2)
+
+        # Dictionary encoded columns:
+        stops = columns['stop_dictionary'][columns['stop']]
+        self.assertEqual(list(stops), ['ut', 'asd', 'kkd'] * 2)
+        self.assertEqual(list(columns['service_number_dictionary']), ['1234', 'i3'])
+        self.assertEqual(list(columns['arrival_platform_dictionary'][columns['arrival_platform']]),
+                         ['', '5b', '5b'] * 2)
+
+    def test_rows_to_columns(self):
+        columns = export.rows_to_columns(self._create_rows())
+        self._assert_columns(columns)
+
+        self.assertEqual(columns['stop'].dtype.name, 'int16')
+        self.assertEqual(len(columns['stop_dictionary']), 3)
+
+    def test_export_numpy(self):
+        columns = export.rows_to_columns(self._create_rows())
+
+        filename = export.get_filename(self.directory, self.service_date, export.FORMAT_NUMPY)
+        export.write_columns(columns, filename, export.FORMAT_NUMPY)
+
+        self._assert_columns(export.load_date(self.directory, self.service_date))
+
+    def test_export_parquet(self):
+        if export.pyarrow is None:
+            self.skipTest("pyarrow is not installed")
+
+        columns = export.rows_to_columns(self._create_rows())
+
+        filename = export.get_filename(self.directory, self.service_date, export.FORMAT_PARQUET)
+        export.write_columns(columns, filename, export.FORMAT_PARQUET)
+
+        self._assert_columns(export.load_date(self.directory, self.service_date))
+
+    def test_load_dates(self):
+        columns = export.rows_to_columns(self._create_rows())
+        export.write_columns(columns, export.get_filename(self.directory, self.service_date, export.FORMAT_NUMPY),
+                             export.FORMAT_NUMPY)
+
+        # Second day with a new station:
+        rows = self._create_rows()
+        rows[0]['stop'] = 'ht'
+        other_date = self.service_date + datetime.timedelta(days=2)
+        export.write_columns(export.rows_to_columns(rows),
+                             export.get_filename(self.directory, other_date, export.FORMAT_NUMPY),
+                             export.FORMAT_NUMPY)
+
+        columns = export.load_dates(self.directory, self.service_date, other_date)
+        self.assertEqual(len(columns['service_id']), 12)
+        self.assertEqual(list(columns['stop_dictionary'][columns['stop']]),
+                         ['ut', 'asd', 'kkd'] * 2 + ['ht', 'asd', 'kkd'] + ['ut', 'asd', 'kkd'])
+
+    def test_load_date_missing(self):
+        self.assertIsNone(export.load_date(self.directory, self.service_date))
+
+
+if __name__ == '__main__':
+    unittest.main()
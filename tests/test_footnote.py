@@ -0,0 +1,65 @@
+import datetime
+import serviceinfo.footnote as footnote
+
+import unittest
+
+class FootnoteTest(unittest.TestCase):
+    def test_pack_days(self):
+        self.assertEqual(footnote.pack_days([]), '')
+        self.assertEqual(footnote.pack_days([True]), '\x01')
+        self.assertEqual(footnote.pack_days([False] * 8 + [True, False, True]), '\x00\x05')
+        self.assertEqual(footnote.pack_days([True] * 8), '\xff')
+
+    def test_is_day_active(self):
+        days = [(day % 3) == 0 for day in range(20)]
+        bitmap = footnote.pack_days(days)
+
+        for day in range(20):
+            self.assertEqual(footnote.is_day_active(bitmap, day), days[day], "Day %d" % day)
+
+        self.assertFalse(footnote.is_day_active(bitmap, -1), "Days before the bitmap are inactive")
+        self.assertFalse(footnote.is_day_active(bitmap, 24), "Days after the bitmap are inactive")
+
+    def test_footnotes(self):
+        first_day = datetime.date(year=2015, month=4, day=1)
+
+        footnotes = footnote.Footnotes()
+        footnotes.add(1, first_day, footnote.pack_days([True, True, False]))
+        footnotes.add(2, first_day, footnote.pack_days([False, True, True]))
+        self.assertEqual(len(footnotes), 2)
+
+        self.assertTrue(footnotes.is_active(1, first_day))
+        self.assertFalse(footnotes.is_active(2, first_day))
+        self.assertFalse(footnotes.is_active(3, first_day), "Unknown footnotes are inactive")
+        self.assertFalse(footnotes.is_active(1, first_day - datetime.timedelta(days=1)))
+
+        self.assertEqual(footnotes.get_active_footnotes(first_day), [1])
+        self.assertEqual(footnotes.get_active_footnotes(first_day + datetime.timedelta(days=1)), [1, 2])
+        self.assertEqual(footnotes.get_active_footnotes(first_day + datetime.timedelta(days=2)), [2])
+        self.assertEqual(footnotes.get_active_footnotes(first_day + datetime.timedelta(days=3)), [])
+
+    def test_get_active_dates(self):
+        first_day = datetime.date(year=2015, month=4, day=1)
+
+        footnotes = footnote.Footnotes()
+        footnotes.add(1, first_day, footnote.pack_days([True, False, True]))
+
+        self.assertEqual(footnotes.get_active_dates(1), [first_day, first_day + datetime.timedelta(days=2)])
+        self.assertEqual(footnotes.get_active_dates(2), [])
+
+    def test_get_changed_dates(self):
+        first_day = datetime.date(year=2015, month=4, day=1)
+
+        old = footnote.Footnotes()
+        old.add(1, first_day, footnote.pack_days([True, True, False]))
+        old.add(2, first_day, footnote.pack_days([True]))
+        old.add(3, first_day, footnote.pack_days([False, False, False, True]))
+
+        new = footnote.Footnotes()
+        new.add(1, first_day, footnote.pack_days([True, False, True]))
+        new.add(2, first_day, footnote.pack_days([True]))
+        new.add(4, first_day, footnote.pack_days([False, False, False, False, True]))
+
+        self.assertEqual(old.get_changed_dates(new),
+                         [first_day + datetime.timedelta(days=day) for day in [1, 2, 3, 4]])
+        self.assertEqual(old.get_changed_dates(old), [])
@@ -6,7 +6,10 @@ import serviceinfo.service_store as service_store
 
 from bottle import HTTPError
 import datetime
+import json
+import time
 import unittest
+import zlib
 
 
 class HttpTest(unittest.TestCase):
@@ -75,8 +78,14 @@ class HttpTest(unittest.TestCase):
 
         return service
 
+    def _get_services(self, servicedate):
+        """
+        Retrieve services list, decode the streamed JSON document
+        """
+        return json.loads(''.join(http.get_services(servicedate=servicedate)))
+
     def test_get_services(self):
-        http_services = http.get_services(servicedate="2015-04-01")
+        http_services = self._get_services(servicedate="2015-04-01")
 
         self.assertTrue("services" in http_services)
         self.assertEqual(len(http_services['services']), len(self.test_services))
@@ -86,7 +95,7 @@ class HttpTest(unittest.TestCase):
 
     def test_get_services_sorted(self):
         bottle.request.query.sort = 'true'
-        http_services = http.get_services(servicedate="2015-04-01")
+        http_services = self._get_services(servicedate="2015-04-01")
 
         self.assertTrue("services" in http_services)
         self.assertEqual(len(http_services['services']), len(self.test_services))
@@ -100,17 +109,55 @@ class HttpTest(unittest.TestCase):
 
     def test_get_services_store(self):
         bottle.request.query.type = 'actual'
-        actual_http_services = http.get_services(servicedate="2015-04-01")
+        actual_http_services = self._get_services(servicedate="2015-04-01")
 
         self.assertTrue("services" in actual_http_services)
         self.assertEqual(len(actual_http_services['services']), 0)
 
         bottle.request.query.type = 'scheduled'
-        scheduled_http_services = http.get_services(servicedate="2015-04-01")
+        scheduled_http_services = self._get_services(servicedate="2015-04-01")
 
         self.assertTrue("services" in scheduled_http_services)
         self.assertEqual(len(scheduled_http_services['services']), len(self.test_services))
 
+        bottle.request.query.type = ''
+
+    def test_get_services_paginated(self):
+        bottle.request.query.limit = '8'
+        bottle.request.query.cursor = ''
+
+        services = []
+        pages = 0
+
+        while True:
+            http_services = http.get_services(servicedate="2015-04-01")
+            self.assertLessEqual(len(http_services['services']), 8)
+
+            services.extend(http_services['services'])
+            pages += 1
+
+            if http_services['next_cursor'] is None:
+                break
+
+            bottle.request.query.cursor = http_services['next_cursor']
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(services), len(self.test_services))
+        self.assertEqual(sorted(services), services, "Not sorted")
+
+        bottle.request.query.limit = ''
+        bottle.request.query.cursor = ''
+
+    def test_get_services_paginated_invalid(self):
+        bottle.request.query.limit = 'invalid'
+
+        with self.assertRaises(HTTPError) as cm:
+            http.get_services(servicedate="2015-04-01")
+
+        self.assertEqual(cm.exception.status, "400 Bad Request")
+
+        bottle.request.query.limit = ''
+
     def test_service_details_404(self):
         with self.assertRaises(HTTPError) as cm:
             http.get_service_details(servicedate="2015-04-01", service_number="4444")
@@ -144,5 +191,200 @@ class HttpTest(unittest.TestCase):
         self.assertEqual(http_service["service_id"], 1)
         self.assertEqual(http_service["servicedate"], "2016-04-01")
 
+    def test_service_details_iff_cached(self):
+        http._get_iff_cache().clear()
+
+        http_services = http.get_service_details(servicedate="2016-04-01", service_number=1234)
+        self.assertEqual(len(http_services["services"]), 1)
+
+        # Second lookup should be served from the cache:
+        self.assertIsNotNone(http._get_iff_cache().get(("2016-04-01", "1234")))
+        http_services = http.get_service_details(servicedate="2016-04-01", service_number=1234)
+        self.assertEqual(http_services["services"][0]["service_id"], 1)
+
+        # Services not found should be cached as well:
+        with self.assertRaises(HTTPError):
+            http.get_service_details(servicedate="2016-04-01", service_number=4444)
+        self.assertEqual(http._get_iff_cache().get(("2016-04-01", "4444")), [])
+
+    def test_services_details_batch(self):
+        service_numbers = [str(service.servicenumber) for service in self.test_services[0:5]]
+        bottle.request.environ['bottle.request.json'] = service_numbers + ['4444']
+
+        http_services = http.get_services_details(servicedate="2015-04-01")
+
+        self.assertEqual(len(http_services["services"]), 5)
+        self.assertEqual(http_services["not_found"], ['4444'])
+
+        for service in self.test_services[0:5]:
+            http_service = http_services["services"][str(service.servicenumber)][0]
+            self.assertEqual(http_service["service_id"], service.service_id)
+            self.assertEqual(http_service["destination"], service.get_destination_str())
+
+    def test_services_details_batch_invalid(self):
+        bottle.request.environ['bottle.request.json'] = {'invalid': True}
+
+        with self.assertRaises(HTTPError) as cm:
+            http.get_services_details(servicedate="2015-04-01")
+
+        self.assertEqual(cm.exception.status, "400 Bad Request")
+
+
+class ServicesToDictTest(unittest.TestCase):
+    def _prepare_service(self):
+        service = data.Service()
+        service.servicenumber = 1234
+        service.service_id = 1
+        service.service_date = datetime.date(year=2015, month=4, day=1)
+
+        stop = data.ServiceStop("ut")
+        stop.departure_time = datetime.datetime(year=2015, month=4, day=1, hour=12, minute=34)
+        service.stops.append(stop)
+
+        stop = data.ServiceStop("asd")
+        stop.arrival_time = datetime.datetime(year=2015, month=4, day=1, hour=13, minute=4)
+        stop.arrival_delay = 5
+        service.stops.append(stop)
+
+        return service
+
+    def test_services_to_dict(self):
+        services = http.services_to_dict([self._prepare_service()])
+        stops = services['services'][0]['stops']
+
+        self.assertEqual(len(stops[0]), 13)
+        self.assertEqual(stops[0]['departure_time'], '2015-04-01T12:34:00')
+        self.assertIsNone(stops[0]['arrival_time'])
+        self.assertFalse('first_departure' in services['services'][0])
+
+    def test_services_to_dict_fields(self):
+        services = http.services_to_dict([self._prepare_service()], fields={'station', 'arrival_delay'})
+        stops = services['services'][0]['stops']
+
+        self.assertEqual(stops[1], {'station': 'asd', 'arrival_delay': 5})
+
+    def test_services_to_dict_compact(self):
+        services = http.services_to_dict([self._prepare_service()], compact=True)
+        service = services['services'][0]
+
+        self.assertEqual(service['first_departure'], '2015-04-01T12:34:00')
+        self.assertEqual(service['stops'][0]['departure_time'], 0)
+        self.assertIsNone(service['stops'][0]['arrival_time'])
+        self.assertEqual(service['stops'][1]['arrival_time'], 30 * 60)
+        self.assertIsNone(service['stops'][1]['departure_time'])
+
+
+class CompressionTest(unittest.TestCase):
+    def test_accepted_encoding(self):
+        self.assertEqual(http._get_accepted_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(http._get_accepted_encoding('deflate'), 'deflate')
+        self.assertEqual(http._get_accepted_encoding('br;q=1.0, gzip;q=0.8'), 'gzip')
+        self.assertEqual(http._get_accepted_encoding('gzip;q=0, deflate'), 'deflate')
+        self.assertIsNone(http._get_accepted_encoding('identity'))
+        self.assertIsNone(http._get_accepted_encoding(''))
+
+    def test_compress(self):
+        body = json.dumps({'services': ['%s' % number for number in range(0, 1000)]})
+
+        self.assertEqual(zlib.decompress(http.compress(body, 'gzip'), 16 + zlib.MAX_WBITS), body)
+        self.assertEqual(zlib.decompress(http.compress(body, 'deflate')), body)
+        self.assertLess(len(http.compress(body, 'gzip')), len(body))
+
+    def test_vary_header(self):
+        wrapper = http.CompressionPlugin(min_size=100).apply(
+            lambda size: {'services': ['1234'] * size}, None)
+
+        for accept_encoding, size, vary in [('gzip', 100, True), ('identity', 100, True), ('gzip', 1, False)]:
+            bottle.request.bind({'HTTP_ACCEPT_ENCODING': accept_encoding})
+            bottle.response.bind()
+            wrapper(size)
+
+            self.assertEqual(bottle.response.get_header('Vary') == 'Accept-Encoding', vary)
+            self.assertEqual(bottle.response.get_header('Content-Encoding') == 'gzip',
+                             vary and accept_encoding == 'gzip')
+
+
+class StreamServicesTest(unittest.TestCase):
+    def test_stream_servicenumbers_list(self):
+        services = ['%s' % number for number in range(1000, 2234)]
+        chunks = list(http._stream_servicenumbers_list(iter(services), 500))
+
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(''.join(chunks)), {'services': services})
+
+    def test_stream_servicenumbers_list_empty(self):
+        self.assertEqual(json.loads(''.join(http._stream_servicenumbers_list(iter([])))), {'services': []})
+
+
+class ChangesTest(unittest.TestCase):
+    event = {'action': 'store', 'service_date': '2015-04-01', 'service_number': '1234', 'type': 'actual',
+             'version': 42, 'company': 'NS', 'stops': ['ut', 'asd', 'rtd']}
+
+    def _filter(self, **kwargs):
+        change_filter = {'service': None, 'station': None, 'company': None, 'type': None}
+        change_filter.update(kwargs)
+        return change_filter
+
+    def test_match_change(self):
+        self.assertTrue(http._match_change(self.event, self._filter()))
+        self.assertTrue(http._match_change(self.event, self._filter(service={'1234', '5678'})))
+        self.assertFalse(http._match_change(self.event, self._filter(service={'5678'})))
+        self.assertTrue(http._match_change(self.event, self._filter(station={'asd', 'gvc'})))
+        self.assertFalse(http._match_change(self.event, self._filter(station={'gvc'})))
+        self.assertTrue(http._match_change(self.event, self._filter(company={'ns'})))
+        self.assertFalse(http._match_change(self.event, self._filter(company={'db'})))
+        self.assertTrue(http._match_change(self.event, self._filter(type={'actual'})))
+        self.assertFalse(http._match_change(self.event, self._filter(type={'scheduled'})))
+        self.assertFalse(http._match_change(self.event, self._filter(service={'1234'}, station={'gvc'})))
+
+    def test_stream_changes(self):
+        other_event = dict(self.event, service_number='5678', version=43)
+        events = list(http._stream_changes(iter([self.event, other_event]), self._filter(service={'5678'})))
+
+        self.assertEqual(len(events), 2)
+        self.assertTrue(events[1].startswith('id: 43\nevent: store\ndata: '))
+        self.assertTrue(events[1].endswith('\n\n'))
+        self.assertEqual(json.loads(events[1].split('data: ')[1]), other_event)
+
+    def test_stream_changes_heartbeat(self):
+        events = list(http._stream_changes(iter([None, self.event]), self._filter(service={'5678'})))
+        self.assertEqual(events, [': connected\n\n', ': heartbeat\n\n'])
+
+        # Heartbeats are also sent when all published events are filtered:
+        events = list(http._stream_changes(iter([self.event, self.event]), self._filter(service={'5678'}), 0))
+        self.assertEqual(events, [': connected\n\n', ': heartbeat\n\n', ': heartbeat\n\n'])
+
+        events = list(http._stream_changes(iter([self.event, self.event]), self._filter(service={'5678'}), 60))
+        self.assertEqual(events, [': connected\n\n'])
+
+
+class LookupCacheTest(unittest.TestCase):
+    def test_get_set(self):
+        cache = http.LookupCache(60, 10)
+
+        self.assertIsNone(cache.get(("2015-04-01", "1234")))
+        cache.set(("2015-04-01", "1234"), ["service"])
+        self.assertEqual(cache.get(("2015-04-01", "1234")), ["service"])
+
+        # Negative results are cached as an empty list:
+        cache.set(("2015-04-01", "4444"), [])
+        self.assertEqual(cache.get(("2015-04-01", "4444")), [])
+
+    def test_expire(self):
+        cache = http.LookupCache(-1, 10)
+
+        cache.set("key", "value")
+        self.assertIsNone(cache.get("key"))
+
+    def test_size(self):
+        cache = http.LookupCache(60, 3)
+
+        for number in range(0, 10):
+            cache.set(number, number)
+
+        self.assertLessEqual(len(cache.entries), 3)
+        self.assertEqual(cache.get(9), 9)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,7 @@ from _mysql import OperationalError
 import datetime
 import serviceinfo.common as common
 import serviceinfo.iff as iff
+import serviceinfo.service_filter as service_filter
 
 import unittest
 
@@ -19,6 +20,8 @@ class IffDatabaseTests(unittest.TestCase):
         except SystemExit:
             self.skipTest("Could not load unit testing configuration")
 
+        self.config = config
+
         try:
             self.iff = iff.IffSource(config['iff_database'])
         except OperationalError as e:
@@ -39,11 +42,65 @@ class IffDatabaseTests(unittest.TestCase):
         self.assertEquals(self.iff.get_transport_mode("S"), "Sneltrein")
         self.assertIsNone(self.iff.get_transport_mode("invalid"))
 
+    def test_pool_autocommit(self):
+        pool = iff.IffSourcePool(self.config['iff_database'])
+
+        for _ in range(2):
+            with pool.source() as iff_source:
+                cursor = iff_source.connection.cursor()
+                cursor.execute("SELECT @@autocommit")
+                self.assertEquals(cursor.fetchone()[0], 1, "Pooled connections should use autocommit")
+
     def test_get_services_date(self):
         services = self.iff.get_services_date(self.service_date)
         self.assertGreaterEqual(services, 1)
         self.assertTrue(1 in services, 'get_services_date() should return service 1 for 2015-04-01')
 
+    def test_get_services_date_filter(self):
+        filter_config = {'exclude': {'company': ['utts']}, 'include': {'service': [[5000, 5999]]}}
+        services = self.iff.get_services_date(self.service_date, service_filter.ServiceFilter(filter_config))
+        self.assertFalse(1 in services, 'get_services_date() should not return excluded service 1')
+        self.assertTrue(2 in services, 'get_services_date() should return included service 2')
+
+    def test_get_service_details_batch(self):
+        services = self.iff.get_service_details_batch([1, 2, 4], self.service_date)
+
+        self.assertIsNone(services[4])
+        for service_id in [1, 2]:
+            expected = self.iff.get_service_details(service_id, self.service_date)
+            self.assertEquals([(service.servicenumber, [stop.stop_code for stop in service.stops])
+                               for service in services[service_id]],
+                              [(service.servicenumber, [stop.stop_code for stop in service.stops])
+                               for service in expected])
+
+        self.assertEquals(services[1][0].stops[3].attributes[0].code, "NIIN")
+        self.assertEquals(self.iff.get_service_details_batch([], self.service_date), {})
+
+    def test_iter_services_details_dates(self):
+        service_dates = [self.service_date, self.other_service_date]
+        services = list(self.iff.iter_services_details_dates(service_dates))
+
+        expected_services = []
+        for service_date in service_dates:
+            expected_services.extend(self.iff.get_services_details(self.iff.get_services_date(service_date),
+                                                                   service_date))
+
+        key = lambda service: (service.service_date, service.service_id, str(service.servicenumber))
+        self.assertEquals([key(service) for service in sorted(services, key=key)],
+                          [key(service) for service in sorted(expected_services, key=key)])
+
+        for service, expected_service in zip(sorted(services, key=key), sorted(expected_services, key=key)):
+            self.assertEquals([(stop.stop_code, stop.arrival_time, stop.departure_time) for stop in service.stops],
+                              [(stop.stop_code, stop.arrival_time, stop.departure_time)
+                               for stop in expected_service.stops])
+
+    def test_get_footnotes(self):
+        footnotes = self.iff.get_footnotes()
+        self.assertTrue(footnotes.is_active(0, self.service_date))
+        self.assertFalse(footnotes.is_active(0, self.other_service_date))
+        self.assertFalse(footnotes.is_active(15, self.service_date))
+        self.assertEqual(footnotes.get_active_footnotes(self.service_date), [0])
+
     def test_get_service_details(self):
         services = self.iff.get_service_details(1, self.service_date)
         self.assertEquals(len(services), 1, "get_service_details() should return only one service for ID 1")
@@ -142,6 +199,61 @@ class IffDatabaseTests(unittest.TestCase):
     def test_get_service_details_nonexisting(self):
         self.assertIsNone(self.iff.get_service_details(9999, self.service_date))
 
+    def test_explain_queries(self):
+        # Record all queries issued by the IffSource:
+        queries = []
+        connection = self.iff.connection
+
+        class RecordingConnection(object):
+            def cursor(self):
+                cursor = connection.cursor()
+                execute = cursor.execute
+
+                def record(query, args=None):
+                    queries.append((query, args))
+                    return execute(query, args)
+
+                cursor.execute = record
+                return cursor
+
+        self.iff.connection = RecordingConnection()
+
+        # Filter with every condition which is translated to an EXISTS subquery:
+        compiled_filter = service_filter.ServiceFilter({
+            'exclude': {'company': ['utts'], 'service': [[1000, 1999]], 'transport_mode': ['ic'], 'stop': ['shl']},
+            'include': {'company': ['ns'], 'service': [[5000, 5999]], 'transport_mode': ['nsb'], 'stop': ['ledn']}})
+
+        self.iff.get_services_date(self.service_date)
+        self.iff.get_services_date(self.service_date, compiled_filter)
+        self.iff.get_service_details(1, self.service_date)
+        self.iff.get_service_details_batch([1, 2, 4], self.service_date)
+        list(self.iff.iter_services_details_dates([self.service_date, self.other_service_date]))
+        list(self.iff.iter_services_details_dates([self.service_date, self.other_service_date], compiled_filter))
+        self.iff.get_service_id_for_service_number(1234, self.service_date)
+        self.iff.get_service_ids_for_service_numbers([1234, 5678], self.service_date)
+        self.iff.get_station_name("ut")
+        self.iff.get_transport_mode("IC")
+        self.iff.get_company_name("utts")
+
+        self.iff.connection = connection
+
+        self.assertTrue(any('EXISTS' in query for query, args in queries))
+
+        # No query may scan a complete table, except for the footnote bitmaps
+        # and the delivery, which are always read completely:
+        cursor = connection.cursor()
+        for query, args in queries:
+            cursor.execute("EXPLAIN " + query.strip(), args)
+            columns = [column[0] for column in cursor.description]
+
+            for row in cursor.fetchall():
+                plan = dict(zip(columns, row))
+                if plan['table'] in ['footnote_bitmap', 'delivery']:
+                    continue
+
+                self.assertNotIn(plan['type'], ['ALL', 'index'],
+                                 "Full scan of %s in query: %s" % (plan['table'], query))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,148 @@
+from _mysql import OperationalError
+import datetime
+import imp
+import os
+import shutil
+import tempfile
+import serviceinfo.common as common
+
+import unittest
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+loader = imp.load_source('iff_loader', os.path.join(ROOT_PATH, 'iff-loader.py'))
+
+class IffLoaderTests(unittest.TestCase):
+    # These tests use a separate unit test database, all tables are dropped before each test
+
+    def setUp(self):
+        config = None
+        try:
+            config = common.load_config("config/serviceinfo-unittest.yaml")
+        except SystemExit:
+            self.skipTest("Could not load unit testing configuration")
+
+        if 'iff_loader_database' not in config:
+            self.skipTest("No IFF loader unit testing database configured")
+
+        loader.config = config['iff_loader_database']
+        loader.CREATE_TABLES = False
+        loader.TRUNCATE_TABLES = False
+        loader.SWAP_TABLES = True
+
+        self.directory = tempfile.mkdtemp()
+        loader.PARSED_FILES_PATH = self.directory + '/'
+
+        try:
+            self.connection = loader.connect()
+        except OperationalError as e:
+            self.fail("Could not connect to IFF loader database: %s" % e)
+
+        # Start with an empty database, like a database loaded before delta loading existed:
+        cursor = self.connection.cursor()
+        for table in loader.TABLES:
+            cursor.execute('DROP TABLE IF EXISTS %s' % table)
+        cursor.close()
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def _write_delivery(self, services):
+        """
+        Write TSV files for a delivery with the given services, a dict with
+        (servicenumber, footnote, hash) tuples by service ID.
+        Footnote n is active on day n (starting at 2015-04-01).
+        """
+
+        rows = dict((table, []) for table in loader.TABLES)
+
+        for footnote in range(1, 5):
+            rows['footnote_bitmap'].append([footnote, '2015-04-01', '%02x' % (1 << (footnote - 1))])
+
+        for serviceid, (servicenumber, footnote, service_hash) in services.items():
+            rows['timetable_service'].append([serviceid, 1, servicenumber, '', 1, 2, ''])
+            rows['timetable_stop'].append([serviceid, 1, 'ut', '\\N', '12:34:00'])
+            rows['timetable_stop'].append([serviceid, 2, 'asd', '13:00:00', '\\N'])
+            rows['timetable_validity'].append([serviceid, footnote, 0, 999])
+            rows['timetable_hash'].append([serviceid, service_hash])
+
+        for table in loader.TABLES:
+            with open(os.path.join(self.directory, '%s.tsv' % table), 'w') as f:
+                f.write('header\n')
+                for row in rows[table]:
+                    f.write('\t'.join(str(value) for value in row) + '\n')
+
+    def _query(self, query, args=None):
+        # New transaction, to see the changes of the loader:
+        self.connection.commit()
+
+        cursor = self.connection.cursor()
+        cursor.execute(query, args)
+        rows = cursor.fetchall()
+        cursor.close()
+
+        return [tuple(row) for row in rows]
+
+    def test_load_delta(self):
+        # First load into an empty database creates all tables and loads all services:
+        self._write_delivery({1: (1234, 1, 'a'), 2: (2345, 2, 'b'), 3: (3456, 3, 'c')})
+        dates = loader.load_delta()
+
+        self.assertEqual(dates, [datetime.date(2015, 4, day) for day in range(1, 5)])
+        self.assertEqual(self._query("SELECT serviceid, hash FROM timetable_hash ORDER BY serviceid"),
+                         [(1, 'a'), (2, 'b'), (3, 'c')])
+
+        cursor = self.connection.cursor()
+        self.assertEqual(loader.get_validity_footnotes(cursor, set([2, 3])), set([2, 3]))
+        cursor.close()
+
+        # Service 2 is changed (now on day 4), service 3 is removed and service 5 is inserted (on day 1):
+        self._write_delivery({1: (1234, 1, 'a'), 2: (2346, 4, 'b2'), 5: (5678, 1, 'e')})
+        dates = loader.load_delta()
+
+        self.assertEqual(dates, [datetime.date(2015, 4, day) for day in range(1, 5)])
+        self.assertEqual(self._query("SELECT serviceid, servicenumber FROM timetable_service ORDER BY serviceid"),
+                         [(1, 1234), (2, 2346), (5, 5678)])
+        self.assertEqual(self._query("""
+            SELECT serviceid, COUNT(*) FROM timetable_stop
+            GROUP BY serviceid
+            ORDER BY serviceid"""), [(1, 2), (2, 2), (5, 2)])
+        self.assertEqual(self._query("SELECT serviceid, hash FROM timetable_hash ORDER BY serviceid"),
+                         [(1, 'a'), (2, 'b2'), (5, 'e')])
+
+        cursor = self.connection.cursor()
+        self.assertEqual(loader.get_validity_footnotes(cursor, set([2, 3])), set([4]))
+        cursor.close()
+
+        # Unchanged delivery:
+        self.assertEqual(loader.load_delta(), [])
+
+    def test_load_delta_changed_dates(self):
+        self._write_delivery({1: (1234, 1, 'a'), 2: (2345, 2, 'b'), 3: (3456, 3, 'c')})
+        loader.load_delta()
+
+        # Only the dates of the removed service:
+        self._write_delivery({1: (1234, 1, 'a'), 2: (2345, 2, 'b')})
+        self.assertEqual(loader.load_delta(), [datetime.date(2015, 4, 3)])
+
+        # Only the dates of the inserted service:
+        self._write_delivery({1: (1234, 1, 'a'), 2: (2345, 2, 'b'), 4: (4567, 4, 'd')})
+        self.assertEqual(loader.load_delta(), [datetime.date(2015, 4, 4)])
+
+        # Old and new dates of the changed service:
+        self._write_delivery({1: (1234, 3, 'a2'), 2: (2345, 2, 'b'), 4: (4567, 4, 'd')})
+        self.assertEqual(loader.load_delta(), [datetime.date(2015, 4, 1), datetime.date(2015, 4, 3)])
+
+    def test_load_services(self):
+        self._write_delivery({1: (1234, 1, 'a'), 2: (2345, 2, 'b'), 3: (3456, 3, 'c')})
+        cursor = self.connection.cursor()
+        loader.create_missing_tables(cursor)
+        loader.load_services(cursor, 'timetable_validity', set([1, 3]))
+        cursor.close()
+
+        self.assertEqual(self._query("SELECT serviceid, footnote FROM timetable_validity ORDER BY serviceid"),
+                         [(1, 1), (3, 3)])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'timetable_validity.delta.tsv')))
+
+if __name__ == '__main__':
+    unittest.main()
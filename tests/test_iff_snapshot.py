@@ -0,0 +1,165 @@
+import datetime
+import os
+import shutil
+import tempfile
+import serviceinfo.iff as iff
+import serviceinfo.iff_snapshot as iff_snapshot
+import serviceinfo.service_filter as service_filter
+
+import unittest
+
+class IffSnapshotTests(unittest.TestCase):
+    # These tests use a snapshot of the unit test dataset
+
+    # Service date for all tests:
+    service_date = datetime.date(year=2015, month=4, day=1)
+    other_service_date = datetime.date(year=2015, month=4, day=2)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        filename = os.path.join(self.directory, 'iff-snapshot.sqlite')
+
+        iff_snapshot.build_snapshot(os.path.join(os.path.dirname(__file__), 'testdata', 'iff-tsv'), filename)
+        self.iff = iff.get_iff_source({'snapshot': filename})
+
+    def tearDown(self):
+        self.iff.close()
+        shutil.rmtree(self.directory)
+
+    def test_get_iff_source(self):
+        self.assertIsInstance(self.iff, iff.IffSnapshotSource)
+
+    def test_reopen_snapshot(self):
+        self.assertEquals(self.iff.get_station_name("ut"), "Utrecht Centraal")
+
+        # Build a new snapshot with a renamed station, which replaces the snapshot in use:
+        tsv_path = os.path.join(self.directory, 'iff-tsv')
+        shutil.copytree(os.path.join(os.path.dirname(__file__), 'testdata', 'iff-tsv'), tsv_path)
+
+        station_filename = os.path.join(tsv_path, 'station.tsv')
+        with open(station_filename, 'r') as f:
+            stations = f.read()
+        with open(station_filename, 'w') as f:
+            f.write(stations.replace('Utrecht Centraal', 'Utrecht'))
+
+        iff_snapshot.build_snapshot(tsv_path, os.path.join(self.directory, 'iff-snapshot.sqlite'))
+
+        self.assertEquals(self.iff.get_station_name("ut"), "Utrecht")
+
+    def test_get_names(self):
+        self.assertEquals(self.iff.get_company_name("utts"), "Unit testing transport")
+        self.assertIsNone(self.iff.get_company_name("invalid"))
+        self.assertEquals(self.iff.get_station_name("ut"), "Utrecht Centraal")
+        self.assertEquals(self.iff.get_station_name("UT"), "Utrecht Centraal")
+        self.assertIsNone(self.iff.get_station_name("invalid"))
+        self.assertEquals(self.iff.get_transport_mode("IC"), "Intercity")
+        self.assertIsNone(self.iff.get_transport_mode("invalid"))
+
+    def test_get_services_date(self):
+        services = self.iff.get_services_date(self.service_date)
+        self.assertTrue(1 in services, 'get_services_date() should return service 1 for 2015-04-01')
+        self.assertEquals(self.iff.get_services_date(self.other_service_date), [])
+
+    def test_get_service_details(self):
+        services = self.iff.get_service_details(1, self.service_date)
+        self.assertEquals(len(services), 1, "get_service_details() should return only one service for ID 1")
+
+        service = services[0]
+        self.assertEquals(service.servicenumber, 1234)
+        self.assertEquals(service.company_name, "Unit testing transport")
+        self.assertEquals(service.transport_mode_description, "Intercity")
+        self.assertEquals(service.get_destination_str(), "rtd")
+
+        self.assertEqual(len(service.stops), 5, "Service 1 should have 5 stops")
+        self.assertIsNone(service.stops[0].arrival_time)
+        self.assertEquals(service.stops[0].departure_time.date(), self.service_date)
+        self.assertEquals(service.stops[0].scheduled_departure_platform, "14b")
+        self.assertEquals(service.stops[3].attributes[0].code, "NIIN")
+
+        self.assertIsNone(self.iff.get_service_details(1, self.other_service_date))
+
+    def test_multiple_servicenumbers(self):
+        services = self.iff.get_service_details(2, self.service_date)
+        self.assertEquals([service.servicenumber for service in services], [5678, 6678])
+
+    def test_get_service_ids(self):
+        self.assertEquals(self.iff.get_service_id_for_service_number(1234, self.service_date), 1)
+        self.assertIsNone(self.iff.get_service_id_for_service_number(1234, self.other_service_date))
+        self.assertEquals(self.iff.get_service_ids_for_service_numbers([1234, 9999], self.service_date), {1234: 1})
+
+    def test_get_service_details_batch(self):
+        services = self.iff.get_service_details_batch([1, 2, 4], self.service_date)
+
+        self.assertIsNone(services[4])
+        for service_id in [1, 2]:
+            expected = self.iff.get_service_details(service_id, self.service_date)
+            self.assertEquals([(service.servicenumber, [stop.stop_code for stop in service.stops])
+                               for service in services[service_id]],
+                              [(service.servicenumber, [stop.stop_code for stop in service.stops])
+                               for service in expected])
+
+        self.assertEquals(services[1][0].stops[3].attributes[0].code, "NIIN")
+        self.assertEquals(self.iff.get_service_details_batch([], self.service_date), {})
+
+    def test_iter_services_details_dates(self):
+        service_dates = [self.service_date, self.other_service_date]
+        services = list(self.iff.iter_services_details_dates(service_dates))
+
+        expected_services = []
+        for service_date in service_dates:
+            expected_services.extend(self.iff.get_services_details(self.iff.get_services_date(service_date),
+                                                                   service_date))
+
+        key = lambda service: (service.service_date, service.service_id, str(service.servicenumber))
+        self.assertEquals([key(service) for service in sorted(services, key=key)],
+                          [key(service) for service in sorted(expected_services, key=key)])
+
+        for service, expected_service in zip(sorted(services, key=key), sorted(expected_services, key=key)):
+            self.assertEquals([(stop.stop_code, stop.arrival_time, stop.departure_time) for stop in service.stops],
+                              [(stop.stop_code, stop.arrival_time, stop.departure_time)
+                               for stop in expected_service.stops])
+
+        # Smaller batches should return the same services:
+        self.iff.details_batch_size = 1
+        self.assertEquals(sorted(key(service) for service in self.iff.iter_services_details_dates(service_dates)),
+                          sorted(key(service) for service in services))
+
+    def test_filter_pushdown(self):
+        filter_configs = [
+            ({'exclude': {'company': ['UTTS']}, 'include': {'service': [[5000, 5999]]}}, [2, 3, 5]),
+            ({'exclude': {'service': [[1000, 1999]]}, 'include': {'stop': ['LEDN']}}, [2, 3, 5]),
+            ({'exclude': {'stop': ['shl']}, 'include': {'company': ['utts']}}, [1, 2, 3, 5]),
+            ({'exclude': {'store': 'actual', 'all': True}, 'include': {}}, [1, 2, 3, 5]),
+            ({'exclude': {'all': True}, 'include': {'stop': ['ledn']}}, [2]),
+            ({'exclude': {'all': True}, 'include': {'store': 'actual', 'all': True}}, []),
+        ]
+
+        key = lambda service: (service.service_date, service.service_id, str(service.servicenumber))
+        unfiltered = list(self.iff.iter_services_details_dates([self.service_date]))
+
+        for filter_config, expected_service_ids in filter_configs:
+            compiled_filter = service_filter.ServiceFilter(filter_config)
+
+            self.assertEquals(sorted(self.iff.get_services_date(self.service_date, compiled_filter)),
+                              expected_service_ids)
+
+            services = self.iff.iter_services_details_dates([self.service_date], compiled_filter)
+            self.assertEquals(sorted(key(service) for service in services if compiled_filter(service)),
+                              sorted(key(service) for service in unfiltered if compiled_filter(service)))
+
+        # Service 5 has no transport mode, the filter can not be applied to it:
+        compiled_filter = service_filter.ServiceFilter({'exclude': {'transport_mode': ['ic']},
+                                                        'include': {'transport_mode': ['nsb']}})
+        self.assertEquals(sorted(self.iff.get_services_date(self.service_date, compiled_filter)), [2, 3, 5])
+
+    def test_get_footnotes(self):
+        footnotes = self.iff.get_footnotes()
+        self.assertTrue(footnotes.is_active(0, self.service_date))
+        self.assertFalse(footnotes.is_active(0, self.other_service_date))
+
+        # Footnotes are cached until the snapshot is replaced:
+        self.assertIs(self.iff.get_footnotes(), footnotes)
+
+        iff_snapshot.build_snapshot(os.path.join(os.path.dirname(__file__), 'testdata', 'iff-tsv'),
+                                    os.path.join(self.directory, 'iff-snapshot.sqlite'))
+        self.assertIsNot(self.iff.get_footnotes(), footnotes)
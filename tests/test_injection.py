@@ -1,7 +1,9 @@
+import serviceinfo.common as common
 import serviceinfo.injection as injection
 import serviceinfo.data as data
 
 import datetime
+import pytz
 import unittest
 
 
@@ -140,5 +142,67 @@ class InjectionTest(unittest.TestCase):
         inject = injection.Injection(service, stop).as_dict()
         self.assertTrue(inject['do_not_board'])
 
+    def test_selection(self):
+        selection = injection.Selection([{'service': [[100, 199]]},
+                                         {'store': 'actual', 'transport_mode': ['ic']}], 70)
+
+        service = self._prepare_service(123)
+        self.assertTrue(selection.match(service))
+
+        service = self._prepare_service(234)
+        self.assertFalse(selection.match(service))
+
+        service.store_type = 'actual'
+        self.assertTrue(selection.match(service))
+
+
+class InjectionCacheTest(unittest.TestCase):
+    # These tests use the unit test Redis database
+
+    def setUp(self):
+        try:
+            config = common.load_config("config/serviceinfo-unittest.yaml")
+        except SystemExit:
+            self.skipTest("Could not load unit testing configuration")
+
+        self.cache = injection.InjectionCache(config['schedule_store'])
+
+    def _prepare_injection(self, service_id, departure_delay=0, departure=None):
+        if departure is None:
+            departure = datetime.datetime.now(pytz.utc) + datetime.timedelta(hours=1)
+
+        return {'service_id': service_id, 'stop_code': 'ut', 'service_date': '2015-04-01',
+                'departure': departure.isoformat(), 'departure_delay': departure_delay}
+
+    def tearDown(self):
+        for key in self.cache.redis.keys('injections:*:ut:2015-04-01'):
+            self.cache.redis.delete(key)
+
+    def test_injection_cache(self):
+        injections = [self._prepare_injection('i123'), self._prepare_injection('i234')]
+        self.assertEqual(self.cache.get_changed(injections), injections)
+
+        self.cache.set_sent(injections[:1])
+        self.assertEqual(self.cache.get_changed(injections), injections[1:])
+
+        # Changed departure:
+        changed_injections = [self._prepare_injection('i123', 5), self._prepare_injection('i234')]
+        self.assertEqual(self.cache.get_changed(changed_injections), changed_injections)
+
+        self.cache.set_sent(changed_injections)
+        self.assertEqual(self.cache.get_changed(changed_injections), [])
+
+    def test_injection_cache_expiry(self):
+        self.cache.set_sent([self._prepare_injection('i123', 5)])
+
+        # Expires 10 minutes after the delayed departure:
+        expiry = self.cache.redis.ttl('injections:i123:ut:2015-04-01')
+        self.assertTrue(3600 + 300 + 600 - 5 <= expiry <= 3600 + 300 + 600, "Unexpected expiry: %s" % expiry)
+
+        # Departures in the past are not remembered:
+        departure = datetime.datetime.now(pytz.utc) - datetime.timedelta(hours=1)
+        self.cache.set_sent([self._prepare_injection('i234', departure=departure)])
+        self.assertFalse(self.cache.redis.exists('injections:i234:ut:2015-04-01'))
+
 if __name__ == '__main__':
     unittest.main()
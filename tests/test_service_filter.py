@@ -153,6 +153,43 @@ class ServiceFilterTest(unittest.TestCase):
         service.servicenumber = 2345
         self.assertTrue(service_filter.is_service_included(service, filter_config), "Service should be included")
 
+    def test_filter_overlapping_ranges(self):
+        compiled_filter = service_filter.Filter({'service': [[300, 499], [4100, 4199], [400, 599], [10, 5]]})
+
+        self.assertEqual(compiled_filter.range_starts, [300, 4100])
+        self.assertEqual(compiled_filter.range_ends, [599, 4199])
+
+        service = data.Service()
+        for servicenumber, expected in [(299, False), (300, True), (450, True), (599, True), (600, False),
+                                        (4150, True), (5000, False), (7, False), ('i4123', False)]:
+            service.servicenumber = servicenumber
+            self.assertEqual(compiled_filter.match(service), expected, "Service %s" % servicenumber)
+
+    def test_compiled_filter_config(self):
+        filter_config = {"exclude": {"company": ["UTTS", "db"], "stop": ["Asd"]},
+                         "include": {"service": [[2300, 2399]], "transport_mode": ["IC"]}}
+        compiled_filter = service_filter.ServiceFilter(filter_config)
+
+        service = data.Service()
+        service.stops.append(data.ServiceStop("rtd"))
+
+        for company_code, transport_mode, servicenumber in [('ns', 'spr', 1234), ('utts', 'spr', 1234),
+                                                            ('Utts', 'ic', 1234), ('DB', 'spr', 2345),
+                                                            ('db', 'ice', '2300')]:
+            service.company_code = company_code
+            service.transport_mode = transport_mode
+            service.servicenumber = servicenumber
+
+            self.assertEqual(compiled_filter(service),
+                             service_filter.is_service_included(service, filter_config))
+
+        service.company_code = 'ns'
+        service.transport_mode = 'spr'
+        service.servicenumber = 1234
+        service.stops.append(data.ServiceStop("asd"))
+        self.assertFalse(compiled_filter(service), "Service should be excluded")
+        self.assertEqual(filter(compiled_filter, [service]), [])
+
 
 class DepartureWindowFilterTest(unittest.TestCase):
     def setUp(self):
@@ -1,8 +1,10 @@
 from _mysql import OperationalError
 import datetime
+import json
 import serviceinfo.common as common
 import serviceinfo.data as data
 import serviceinfo.iff as iff
+import serviceinfo.injection as injection
 import serviceinfo.service_store as service_store
 
 import unittest
@@ -109,6 +111,323 @@ class ServiceStoreTests(unittest.TestCase):
         # Verify deletion:
         self.assertIsNone(self.store.get_service(self.service_date_str, "1234"))
 
+    def test_get_services(self):
+        scheduled_services = [self._prepare_service("2345"), self._prepare_service("5432")]
+        self.store.store_services(scheduled_services, self.store.TYPE_SCHEDULED)
+
+        actual_service = self._prepare_service("5432")
+        actual_service.stops[0].departure_delay = 5
+        self.store.store_services([actual_service], self.store.TYPE_ACTUAL)
+
+        services = self.store.get_services(self.service_date_str, ["2345", "5432", "9876"])
+
+        self.assertEqual(len(services), 3)
+        self.assertIsNone(services["9876"])
+        self.assertEqual(len(services["2345"]), 1)
+        self._assert_service_equal(scheduled_services[0], services["2345"][0])
+        self.assertEqual(services["2345"][0].store_type, self.store.TYPE_SCHEDULED)
+
+        # Actual service should override scheduled service:
+        self.assertEqual(len(services["5432"]), 1)
+        self._assert_service_equal(actual_service, services["5432"][0])
+        self.assertEqual(services["5432"][0].store_type, self.store.TYPE_ACTUAL)
+
+        # Only scheduled services:
+        services = self.store.get_services(self.service_date_str, ["5432"], self.store.TYPE_SCHEDULED)
+        self.assertEqual(services["5432"][0].stops[0].departure_delay, 0)
+
+        for service in scheduled_services:
+            self.store.delete_service(self.service_date_str, service.servicenumber, self.store.TYPE_SCHEDULED)
+        self.store.delete_service(self.service_date_str, "5432", self.store.TYPE_ACTUAL)
+
+    def test_iter_servicenumbers(self):
+        scheduled_services = [self._prepare_service("2345"), self._prepare_service("5432"),
+                              self._prepare_service("4321")]
+        self.store.store_services(scheduled_services, self.store.TYPE_SCHEDULED)
+
+        actual_services = [self._prepare_service("77777"), self._prepare_service("2345")]
+        self.store.store_services(actual_services, self.store.TYPE_ACTUAL)
+
+        all_numbers = list(self.store.iter_service_numbers(self.service_date_str, batch_size=2))
+        self.assertEqual(all_numbers, ["2345", "4321", "5432", "77777"])
+
+        scheduled_numbers = list(self.store.iter_service_numbers(self.service_date_str, self.store.TYPE_SCHEDULED))
+        self.assertEqual(scheduled_numbers, ["2345", "4321", "5432"])
+
+        # Pages:
+        numbers, cursor = self.store.get_service_numbers_page(self.service_date_str, count=3)
+        self.assertEqual(numbers, ["2345", "4321", "5432"])
+        self.assertEqual(cursor, "5432")
+
+        numbers, cursor = self.store.get_service_numbers_page(self.service_date_str, cursor=cursor, count=3)
+        self.assertEqual(numbers, ["77777"])
+        self.assertIsNone(cursor)
+
+        # Deleted services should be removed from the index:
+        self.store.delete_service(self.service_date_str, "5432", self.store.TYPE_SCHEDULED)
+        scheduled_numbers = list(self.store.iter_service_numbers(self.service_date_str, self.store.TYPE_SCHEDULED))
+        self.assertEqual(scheduled_numbers, ["2345", "4321"])
+
+        for service in scheduled_services:
+            self.store.delete_service(self.service_date_str, service.servicenumber, self.store.TYPE_SCHEDULED)
+
+        for service in actual_services:
+            self.store.delete_service(self.service_date_str, service.servicenumber, self.store.TYPE_ACTUAL)
+
+    def test_iter_servicenumbers_numeric(self):
+        scheduled_services = [self._prepare_service(number) for number in ["100", "9", "i10", "10", "a9"]]
+        self.store.store_services(scheduled_services, self.store.TYPE_SCHEDULED)
+        actual_services = [self._prepare_service(number) for number in ["11", "9"]]
+        self.store.store_services(actual_services, self.store.TYPE_ACTUAL)
+
+        all_numbers = list(self.store.iter_service_numbers(self.service_date_str, batch_size=2))
+        self.assertEqual(all_numbers, ["a9", "i10", "9", "10", "11", "100"])
+
+        numbers, cursor = self.store.get_service_numbers_page(self.service_date_str, count=1)
+        self.assertEqual((numbers, cursor), (["a9"], "a9"))
+        numbers, cursor = self.store.get_service_numbers_page(self.service_date_str, cursor=cursor, count=3)
+        self.assertEqual((numbers, cursor), (["i10", "9", "10"], "10"))
+        numbers, cursor = self.store.get_service_numbers_page(self.service_date_str, cursor=cursor, count=3)
+        self.assertEqual((numbers, cursor), (["11", "100"], None))
+
+        # Index built before numeric scores were used:
+        index_key = 'services:scheduled:%s:index' % self.service_date_str
+        self.store.redis.delete(index_key)
+        self.store.redis.execute_command('zadd', index_key, *[value for service in scheduled_services
+                                                              for value in (0, service.servicenumber)])
+
+        scheduled_numbers = list(self.store.iter_service_numbers(self.service_date_str, self.store.TYPE_SCHEDULED))
+        self.assertEqual(scheduled_numbers, ["a9", "i10", "9", "10", "100"])
+
+        self.store.trash_store(self.service_date_str, self.store.TYPE_SCHEDULED)
+        self.store.trash_store(self.service_date_str, self.store.TYPE_ACTUAL)
+
+    def test_iter_servicenumbers_upgrade(self):
+        scheduled_services = [self._prepare_service("2345"), self._prepare_service("5432")]
+        self.store.store_services(scheduled_services, self.store.TYPE_SCHEDULED)
+
+        # Service date stored before the index existed:
+        self.store.redis.delete('services:scheduled:%s:index' % self.service_date_str)
+
+        new_service = self._prepare_service("4321")
+        self.store.store_services([new_service], self.store.TYPE_SCHEDULED)
+
+        scheduled_numbers = list(self.store.iter_service_numbers(self.service_date_str, self.store.TYPE_SCHEDULED))
+        self.assertEqual(scheduled_numbers, ["2345", "4321", "5432"])
+
+        numbers, cursor = self.store.get_service_numbers_page(self.service_date_str, self.store.TYPE_SCHEDULED,
+                                                              count=3)
+        self.assertEqual(numbers, ["2345", "4321", "5432"])
+
+        for service in scheduled_services + [new_service]:
+            self.store.delete_service(self.service_date_str, service.servicenumber, self.store.TYPE_SCHEDULED)
+
+    def test_get_finished_service_numbers(self):
+        self.store.trash_store(self.service_date_str, self.store.TYPE_SCHEDULED)
+        self.store.trash_store(self.service_date_str, self.store.TYPE_ACTUAL)
+
+        # Arrives at 14:30:
+        scheduled_services = [self._prepare_service("2345"), self._prepare_service("5432")]
+        self.store.store_services(scheduled_services, self.store.TYPE_SCHEDULED)
+
+        # Actual service 5432 is 20 minutes late:
+        actual_service = self._prepare_service("5432")
+        actual_service.stops[-1].arrival_delay = 20
+        self.store.store_services([actual_service], self.store.TYPE_ACTUAL)
+
+        before = datetime.datetime(year=2015, month=4, day=1, hour=14, minute=29)
+        self.assertEqual(self.store.get_finished_service_numbers(self.service_date_str, before=before), [])
+
+        before = datetime.datetime(year=2015, month=4, day=1, hour=14, minute=40)
+        self.assertEqual(self.store.get_finished_service_numbers(self.service_date_str, before=before), ["2345"])
+        self.assertEqual(self.store.get_finished_service_numbers(self.service_date_str, self.store.TYPE_SCHEDULED,
+                                                                 before), ["2345", "5432"])
+
+        before = datetime.datetime(year=2015, month=4, day=1, hour=14, minute=50)
+        self.assertEqual(self.store.get_finished_service_numbers(self.service_date_str, before=before),
+                         ["2345", "5432"])
+
+        # Deleted services should be removed from the index:
+        self.store.delete_service(self.service_date_str, "2345", self.store.TYPE_SCHEDULED)
+        self.assertEqual(self.store.get_finished_service_numbers(self.service_date_str, before=before), ["5432"])
+
+        self.store.delete_service(self.service_date_str, "5432", self.store.TYPE_SCHEDULED)
+        self.store.delete_service(self.service_date_str, "5432", self.store.TYPE_ACTUAL)
+
+    def test_arrival_index_split_service(self):
+        self.store.trash_store(self.service_date_str, self.store.TYPE_SCHEDULED)
+
+        # Split service: one part arrives at 14:30, the other part at 13:37:
+        long_part = self._prepare_service("2345")
+        long_part.service_id = "2345-ut-rtd"
+        short_part = self._prepare_service("2345")
+        short_part.service_id = "2345-ut-asd"
+        short_part.stops.pop()
+
+        self.store.store_services([long_part, short_part], self.store.TYPE_SCHEDULED)
+
+        before = datetime.datetime(year=2015, month=4, day=1, hour=14, minute=0)
+        self.assertEqual(self.store.get_finished_service_numbers(self.service_date_str, before=before), [])
+
+        # Service IDs stored in separate batches:
+        self.store.store_services([short_part], self.store.TYPE_SCHEDULED)
+        self.assertEqual(self.store.get_finished_service_numbers(self.service_date_str, before=before), [])
+
+        services = self.store.get_services_departing(before, before + datetime.timedelta(minutes=70))
+        self.assertEqual(sorted(service.service_id for service in services), ["2345-ut-asd", "2345-ut-rtd"])
+
+        # Arrival is recomputed when the last arriving part is stored again:
+        long_part.stops[-1].arrival_time = datetime.datetime(year=2015, month=4, day=1, hour=13, minute=50)
+        self.store.store_services([long_part], self.store.TYPE_SCHEDULED)
+        self.assertEqual(self.store.get_finished_service_numbers(self.service_date_str, before=before), ["2345"])
+
+        self.store.delete_service(self.service_date_str, "2345", self.store.TYPE_SCHEDULED)
+        self.assertFalse(self.store.redis.exists('services:scheduled:%s:2345:arrivals' % self.service_date_str))
+
+    def _set_stop_times(self, service, hours):
+        """
+        Move the stops of a service to 2015-04-02, arriving at hh:10 and departing at hh:20
+        """
+        for stop, hour in zip(service.stops, hours):
+            if stop.arrival_time is not None:
+                stop.arrival_time = datetime.datetime(2015, 4, 2, hour, 10)
+            if stop.departure_time is not None:
+                stop.departure_time = datetime.datetime(2015, 4, 2, hour, 20)
+
+    def test_get_services_departing_service_dates(self):
+        next_date_str = '2015-04-02'
+        self.store.trash_store(self.service_date_str, self.store.TYPE_SCHEDULED)
+        self.store.trash_store(next_date_str, self.store.TYPE_SCHEDULED)
+
+        # Night service on 2015-04-01, running until 05:10 on the next day:
+        night_service = self._prepare_service("3456")
+        self._set_stop_times(night_service, [2, 3, 5])
+
+        # Service on 2015-04-02, departing at 04:20:
+        morning_service = self._prepare_service("4567")
+        morning_service.service_date = datetime.date(2015, 4, 2)
+        self._set_stop_times(morning_service, [4, 5, 6])
+
+        self.store.store_services([night_service, morning_service], self.store.TYPE_SCHEDULED)
+
+        for from_hour, from_minute in [(3, 50), (4, 10)]:
+            from_time = datetime.datetime(2015, 4, 2, from_hour, from_minute)
+            services = self.store.get_services_departing(from_time, from_time + datetime.timedelta(minutes=40))
+            self.assertEqual(sorted(service.servicenumber for service in services), ["3456", "4567"])
+
+        self.store.trash_store(self.service_date_str, self.store.TYPE_SCHEDULED)
+        self.store.trash_store(next_date_str, self.store.TYPE_SCHEDULED)
+
+    def test_get_services_departing_unindexed(self):
+        self.store.trash_store(self.service_date_str, self.store.TYPE_SCHEDULED)
+
+        # Services stored before the arrival time index existed:
+        self.store.store_services([self._prepare_service("2345"), self._prepare_service("5432")],
+                                  self.store.TYPE_SCHEDULED)
+        self.store.redis.delete('services:scheduled:%s:arrivals' % self.service_date_str)
+
+        from_time = datetime.datetime(year=2015, month=4, day=1, hour=12, minute=0)
+        services = self.store.get_services_departing(from_time, from_time + datetime.timedelta(minutes=70))
+        self.assertEqual(sorted(service.servicenumber for service in services), ["2345", "5432"])
+
+        self.store.trash_store(self.service_date_str, self.store.TYPE_SCHEDULED)
+
+    def test_get_services_departing(self):
+        self.store.trash_store(self.service_date_str, self.store.TYPE_SCHEDULED)
+        self.store.trash_store(self.service_date_str, self.store.TYPE_ACTUAL)
+
+        # Departs at 12:34, arrives at 14:30:
+        self.store.store_services([self._prepare_service("2345"), self._prepare_service("5432")],
+                                  self.store.TYPE_SCHEDULED)
+
+        # Actual service 5432 arrives 20 minutes late:
+        actual_service = self._prepare_service("5432")
+        actual_service.stops[-1].arrival_delay = 20
+        self.store.store_services([actual_service], self.store.TYPE_ACTUAL)
+
+        after = datetime.datetime(year=2015, month=4, day=1, hour=14, minute=40)
+        self.assertEqual(self.store.get_running_service_numbers(self.service_date_str, after=after), ["5432"])
+        self.assertEqual(self.store.get_running_service_numbers(self.service_date_str, self.store.TYPE_SCHEDULED,
+                                                                after), [])
+
+        from_time = datetime.datetime(year=2015, month=4, day=1, hour=11, minute=0)
+        services = self.store.get_services_departing(from_time, from_time + datetime.timedelta(minutes=70))
+        self.assertEqual(services, [])
+
+        from_time = datetime.datetime(year=2015, month=4, day=1, hour=12, minute=0)
+        services = self.store.get_services_departing(from_time, from_time + datetime.timedelta(minutes=70))
+        self.assertEqual(sorted((service.servicenumber, service.store_type) for service in services),
+                         [("2345", self.store.TYPE_SCHEDULED), ("5432", self.store.TYPE_ACTUAL)])
+
+        # Select departures of service 5432, within 70 minutes after 13:00:
+        selection = injection.Selection([{'service': [[5000, 5999]]}], 70)
+        departures = selection.get_departures(self.store, datetime.datetime(year=2015, month=4, day=1, hour=13))
+        self.assertEqual([(service.servicenumber, stop.stop_code) for service, stop in departures],
+                         [("5432", "asd")])
+
+        self.store.trash_store(self.service_date_str, self.store.TYPE_SCHEDULED)
+        self.store.trash_store(self.service_date_str, self.store.TYPE_ACTUAL)
+
+    def test_publish_changes(self):
+        pubsub = self.store.redis.pubsub()
+        pubsub.subscribe(self.store.CHANGES_CHANNEL)
+        messages = pubsub.listen()
+        self.assertEqual(next(messages)['type'], 'subscribe')
+
+        service = self._prepare_service("3456")
+        service.company_code = "NS"
+        self.store.store_services([service], self.store.TYPE_ACTUAL)
+        self.store.delete_service(self.service_date_str, "3456", self.store.TYPE_ACTUAL)
+
+        store_event = json.loads(next(messages)['data'])
+        delete_event = json.loads(next(messages)['data'])
+        pubsub.close()
+
+        self.assertEqual(store_event['action'], 'store')
+        self.assertEqual(store_event['service_date'], self.service_date_str)
+        self.assertEqual(store_event['service_number'], "3456")
+        self.assertEqual(store_event['type'], self.store.TYPE_ACTUAL)
+        self.assertEqual(store_event['company'], "NS")
+        self.assertEqual(store_event['stops'], ["ut", "asd", "rtd"])
+
+        self.assertEqual(delete_event['action'], 'delete')
+        self.assertEqual(delete_event['service_number'], "3456")
+        self.assertGreater(delete_event['version'], store_event['version'])
+
+    def test_listen_changes_timeout(self):
+        changes = self.store.listen_changes(0.1)
+        self.assertIsNone(next(changes))
+
+        service = self._prepare_service("3456")
+        self.store.store_services([service], self.store.TYPE_ACTUAL)
+
+        event = next(changes)
+        changes.close()
+        self.assertEqual(event['service_number'], "3456")
+
+        # Service details are stored when the change is published:
+        self.assertEqual(len(self.store.get_service(self.service_date_str, "3456", self.store.TYPE_ACTUAL)), 1)
+        self.store.delete_service(self.service_date_str, "3456", self.store.TYPE_ACTUAL)
+
+    def test_store_services_batches(self):
+        services = [self._prepare_service(str(number)) for number in range(6001, 6006)]
+        self.store.store_services(iter(services), self.store.TYPE_SCHEDULED, batch_size=2)
+
+        versions = []
+        for service in services:
+            retrieved_services = self.store.get_service(self.service_date_str, service.servicenumber,
+                                                        self.store.TYPE_SCHEDULED)
+            self.assertEquals(len(retrieved_services), 1)
+            self._assert_service_equal(service, retrieved_services[0])
+
+            versions.append(int(self.store.redis.hget('schedule:%s:%s:%s:info' % (
+                self.store.TYPE_SCHEDULED, self.service_date_str, service.service_id), 'version')))
+
+        self.assertEqual(versions, sorted(set(versions)), "Every service must get a new, increasing version")
+
+        for service in services:
+            self.store.delete_service(self.service_date_str, service.servicenumber, self.store.TYPE_SCHEDULED)
+
     def test_retrieve_attributes(self):
         attr_do_not_board = data.Attribute("NIIN", "Niet instappen")
         attr_do_not_board.processing_code = data.Attribute.CODE_UNBOARDING_ONLY
@@ -42,6 +42,16 @@ class StatisticsTests(unittest.TestCase):
         self.assertEqual(self.stats.get_processed_messages(), current_msg+2)
         self.assertEqual(self.stats.get_processed_services(), current_services+3)
 
+    def test_injection_counters(self):
+        self.stats.reset_counters()
+
+        self.stats.increment_sent_injections(3)
+        self.stats.increment_skipped_injections(40)
+        self.stats.increment_skipped_injections()
+
+        self.assertEqual(self.stats.get_sent_injections(), 3)
+        self.assertEqual(self.stats.get_skipped_injections(), 41)
+
     def test_overflow_counter(self):
         # Reset counters:
         self.stats.reset_counters()
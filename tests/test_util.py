@@ -87,6 +87,13 @@ class UtilTest(unittest.TestCase):
         self.assertEqual(util.datetime_to_iso(given_date), expected_string)
         self.assertIsNone(util.datetime_to_iso(None))
 
+    def test_datetime_to_timestamp(self):
+        given_datetime = timezone('Europe/Amsterdam').localize(datetime.datetime(2015, 4, 1, 12, 0))
+        self.assertEqual(util.datetime_to_timestamp(given_datetime), 1427882400)
+
+        # Naive datetimes are local time:
+        self.assertEqual(util.datetime_to_timestamp(datetime.datetime(2015, 4, 1, 12, 0)), 1427882400)
+        self.assertIsNone(util.datetime_to_timestamp(None))
 
 if __name__ == '__main__': #
     unittest.main()
@@ -16,7 +16,8 @@ CREATE TABLE `company` (
   `code` varchar(9) CHARACTER SET utf8 NOT NULL,
   `name` varchar(29) CHARACTER SET utf8 NOT NULL,
   `timeturn` time DEFAULT NULL,
-  PRIMARY KEY (`company`)
+  PRIMARY KEY (`company`),
+  KEY `code` (`code`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 INSERT INTO `company` (`company`, `code`, `name`, `timeturn`) VALUES
@@ -70,6 +71,17 @@ INSERT INTO `footnote` (`footnote`, `servicedate`) VALUES
 (0,	'2015-04-01'),
 (15,	'2016-04-01');
 
+CREATE TABLE `footnote_bitmap` (
+  `footnote` int(11) NOT NULL DEFAULT '0',
+  `firstday` date NOT NULL DEFAULT '0000-00-00',
+  `days` varbinary(128) NOT NULL,
+  PRIMARY KEY (`footnote`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+INSERT INTO `footnote_bitmap` (`footnote`, `firstday`, `days`) VALUES
+(0,	'2015-04-01',	X'01'),
+(15,	'2016-04-01',	X'01');
+
 CREATE TABLE `station` (
   `shortname` varchar(6) NOT NULL,
   `trainchanges` smallint(6) DEFAULT NULL,
@@ -126,8 +138,8 @@ CREATE TABLE `timetable_service` (
   `firststop` int(11) DEFAULT NULL,
   `laststop` int(11) DEFAULT NULL,
   `servicename` varchar(29) CHARACTER SET utf8 DEFAULT NULL,
-  KEY `serviceid` (`serviceid`),
-  KEY `serviceid_firststop_laststop` (`serviceid`,`firststop`,`laststop`)
+  KEY `serviceid_firststop_laststop` (`serviceid`,`firststop`,`laststop`,`servicenumber`,`variant`,`companynumber`),
+  KEY `servicenumber_serviceid` (`servicenumber`,`serviceid`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 INSERT INTO `timetable_service` (`serviceid`, `companynumber`, `servicenumber`, `variant`, `firststop`, `laststop`, `servicename`) VALUES
@@ -167,7 +179,7 @@ CREATE TABLE `timetable_transport` (
   `transmode` varchar(4) CHARACTER SET utf8 DEFAULT NULL,
   `firststop` int(11) DEFAULT NULL,
   `laststop` int(11) DEFAULT NULL,
-  KEY `serviceid` (`serviceid`),
+  KEY `serviceid_firststop_laststop` (`serviceid`,`firststop`,`laststop`,`transmode`),
   KEY `transmode` (`transmode`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
@@ -182,8 +194,7 @@ CREATE TABLE `timetable_validity` (
   `firststop` int(11) DEFAULT NULL,
   `laststop` int(11) DEFAULT NULL,
   UNIQUE KEY `serviceid_2` (`serviceid`,`footnote`),
-  KEY `serviceid` (`serviceid`),
-  KEY `footnote` (`footnote`)
+  KEY `footnote_serviceid` (`footnote`,`serviceid`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
 INSERT INTO `timetable_validity` (`serviceid`, `footnote`, `firststop`, `laststop`) VALUES